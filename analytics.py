@@ -0,0 +1,264 @@
+"""
+Statistiche personali di lungo periodo (/mystats mese, trimestre, anno, tutto).
+
+La storia dell'utente viene letta una sola volta (Database.get_user_history)
+e caricata in array compatti del modulo array: un valore C per giorno di
+log invece di un dict per riga. Le metriche si calcolano sugli array con
+sum/accumulate e somme cumulative, anche per anni di log.
+
+Stesse regole delle statistiche settimanali:
+- ore studiate: solo nei giorni in cui si doveva studiare
+- giorno di studio: doveva studiare e ha studiato più di 0 ore
+- distrazione media: solo sui giorni di studio (low=1, medium=2, high=3)
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from itertools import accumulate
+from operator import sub
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from database import DISTRACTION_SCORES
+from reports import distraction_text
+
+WEEKDAY_NAMES = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
+
+
+class UserHistory:
+    """Log di un utente in colonne parallele, ordinate per giorno"""
+    __slots__ = ('days', 'hours', 'should_study', 'studied', 'distraction', 'notes')
+
+    def __init__(self):
+        self.days = array('l')          # date.toordinal()
+        self.hours = array('d')         # ore contate (0 se non doveva studiare)
+        self.should_study = array('b')
+        self.studied = array('b')       # giorno di studio
+        self.distraction = array('b')   # punteggio 1-3 nei giorni di studio, altrimenti 0
+        self.notes = array('b')
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple]) -> 'UserHistory':
+        """Righe (date, should_study, hours_studied, distraction_level, notes) ordinate per data"""
+        history = cls()
+        for day, should_study, hours, distraction, notes in rows:
+            should_study = bool(should_study)
+            hours = (hours or 0.0) if should_study else 0.0
+            studied = should_study and hours > 0
+            history.days.append(date.fromisoformat(day).toordinal())
+            history.hours.append(hours)
+            history.should_study.append(should_study)
+            history.studied.append(studied)
+            history.distraction.append(DISTRACTION_SCORES.get(distraction, 2) if studied else 0)
+            history.notes.append(bool(notes))
+        return history
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def span(self, start: date, end: date) -> Tuple[int, int]:
+        """Indici [lo, hi) dei log tra start ed end compresi"""
+        return (bisect_left(self.days, start.toordinal()),
+                bisect_right(self.days, end.toordinal()))
+
+    def daily_hours(self, start: date, end: date) -> array:
+        """Ore per ogni giorno di calendario da start ad end (0 nei giorni senza log)"""
+        first = start.toordinal()
+        dense = array('d', bytes(8 * ((end - start).days + 1)))
+        lo, hi = self.span(start, end)
+        for day, hours in zip(self.days[lo:hi], self.hours[lo:hi]):
+            dense[day - first] = hours
+        return dense
+
+
+def _average_distraction(history: UserHistory, lo: int, hi: int) -> Optional[float]:
+    study_days = sum(history.studied[lo:hi])
+    return sum(history.distraction[lo:hi]) / study_days if study_days else None
+
+
+def streaks(history: UserHistory, today: date) -> Tuple[int, int]:
+    """
+    (serie attuale, serie record) di giorni di studio consecutivi.
+    Un giorno libero dichiarato non interrompe la serie (e non la allunga);
+    un giorno senza check-in o con 0 ore di studio la interrompe.
+    La serie attuale conta se l'ultimo check-in è di oggi o di ieri.
+    """
+    current = longest = 0
+    previous = None
+    for day, should_study, studied in zip(history.days, history.should_study, history.studied):
+        if previous is not None and day != previous + 1:
+            current = 0
+        if studied:
+            current += 1
+            longest = max(longest, current)
+        elif should_study:
+            current = 0
+        previous = day
+
+    if previous is None or previous < today.toordinal() - 1:
+        current = 0
+    return current, longest
+
+
+def _month_starts(start: date, end: date) -> List[date]:
+    months = []
+    month = start.replace(day=1)
+    while month <= end:
+        months.append(month)
+        month = (month + timedelta(days=32)).replace(day=1)
+    return months
+
+
+def summarize(history: UserHistory, start: date, end: date, today: date) -> Dict:
+    """Tutte le metriche del periodo [start, end] (serie calcolate su tutta la storia)"""
+    lo, hi = history.span(start, end)
+    days = (end - start).days + 1
+
+    total_hours = sum(history.hours[lo:hi])
+    study_days = sum(history.studied[lo:hi])
+    planned_days = sum(history.should_study[lo:hi])
+    avg_distraction = _average_distraction(history, lo, hi)
+
+    # Somme cumulative sulle ore giorno per giorno: medie mobili e finestre in O(giorni)
+    dense = history.daily_hours(start, end)
+    prefix = array('d', accumulate(dense, initial=0.0))
+
+    def rolling(window: int) -> Optional[float]:
+        if days < window:
+            return None
+        return (prefix[days] - prefix[days - window]) / window
+
+    best_week = None
+    if days >= 7:
+        week_totals = array('d', map(sub, prefix[7:], prefix[:-7]))
+        best_total = max(week_totals)
+        if best_total > 0:
+            best_start = start + timedelta(days=week_totals.index(best_total))
+            best_week = (best_start, best_total)
+
+    # Giorni della settimana: dense[k::7] sono tutti i giorni con lo stesso weekday
+    by_weekday = [0.0] * 7
+    for offset in range(min(7, days)):
+        column = dense[offset::7]
+        by_weekday[(start.weekday() + offset) % 7] = sum(column) / len(column)
+
+    # Andamento mese per mese (ore e distrazione)
+    months = []
+    first = start.toordinal()
+    for month_start in _month_starts(start, end):
+        month_end = min(end, (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1))
+        a = max(month_start.toordinal(), first) - first
+        b = month_end.toordinal() - first + 1
+        m_lo, m_hi = history.span(max(month_start, start), month_end)
+        months.append({
+            'month': month_start,
+            'hours': prefix[b] - prefix[a],
+            'study_days': sum(history.studied[m_lo:m_hi]),
+            'avg_distraction': _average_distraction(history, m_lo, m_hi),
+        })
+
+    # Distrazione: ultime 4 settimane del periodo contro le 4 precedenti
+    distraction_trend = None
+    if days >= 56:
+        recent = history.span(end - timedelta(days=27), end)
+        before = history.span(end - timedelta(days=55), end - timedelta(days=28))
+        recent_avg = _average_distraction(history, *recent)
+        before_avg = _average_distraction(history, *before)
+        if recent_avg is not None and before_avg is not None:
+            distraction_trend = recent_avg - before_avg
+
+    current_streak, longest_streak = streaks(history, today)
+
+    return {
+        'start': start,
+        'end': end,
+        'days': days,
+        'logged_days': hi - lo,
+        'total_hours': total_hours,
+        'study_days': study_days,
+        'planned_days': planned_days,
+        'notes_count': sum(history.notes[lo:hi]),
+        'avg_hours_per_day': total_hours / days,
+        'avg_distraction': avg_distraction,
+        'distraction_trend': distraction_trend,
+        'rolling_7': rolling(7),
+        'rolling_30': rolling(30),
+        'best_week': best_week,
+        'by_weekday': by_weekday,
+        'months': months,
+        'current_streak': current_streak,
+        'longest_streak': longest_streak,
+    }
+
+
+def user_analytics(rows: Sequence[Tuple], start: Optional[date], end: date, today: date) -> Optional[Dict]:
+    """
+    Carica la storia e calcola le metriche; start None = dal primo log.
+    Il periodo viene ristretto tra il primo log e oggi: i giorni prima e
+    dopo non hanno dati e renderebbero il calcolo lungo quanto il periodo.
+    None se nel periodo ristretto non resta nessun giorno.
+    """
+    history = UserHistory.from_rows(rows)
+    if not history:
+        return None
+    first_day = date.fromordinal(history.days[0])
+    start = first_day if start is None else max(start, first_day)
+    end = min(end, today)
+    if start > end:
+        return None
+    return summarize(history, start, end, today)
+
+
+def format_summary(summary: Dict, title: str) -> str:
+    """Messaggio di /mystats per un periodo lungo"""
+    start = summary['start'].strftime('%d/%m/%Y')
+    end = summary['end'].strftime('%d/%m/%Y')
+    message = f"**{title}** ({start} - {end})\n"
+    message += f"• Ore studiate: {summary['total_hours']:.1f}h ({summary['avg_hours_per_day']:.1f}h/giorno)\n"
+
+    planned = summary['planned_days']
+    if planned:
+        message += (f"• Giorni di studio: {summary['study_days']}/{planned} "
+                    f"({summary['study_days'] / planned * 100:.0f}%)\n")
+    else:
+        message += f"• Giorni di studio: {summary['study_days']}\n"
+
+    if summary['avg_distraction'] is not None:
+        message += f"• Distrazione media: {distraction_text(summary['avg_distraction'])}"
+        trend = summary['distraction_trend']
+        if trend is not None and abs(trend) >= 0.2:
+            message += " (in calo ↘️)" if trend < 0 else " (in aumento ↗️)"
+        message += "\n"
+    message += f"• Note aggiunte: {summary['notes_count']}\n"
+
+    message += f"\n🔥 Serie attuale: {summary['current_streak']} giorni (record: {summary['longest_streak']})\n"
+
+    averages = []
+    if summary['rolling_7'] is not None:
+        averages.append(f"7 giorni {summary['rolling_7']:.1f}h")
+    if summary['rolling_30'] is not None:
+        averages.append(f"30 giorni {summary['rolling_30']:.1f}h")
+    if averages:
+        message += f"📈 Media mobile al giorno: {', '.join(averages)}\n"
+
+    if summary['best_week']:
+        best_start, best_total = summary['best_week']
+        message += f"🏆 Settimana migliore: {best_total:.1f}h (dal {best_start.strftime('%d/%m/%Y')})\n"
+
+    by_weekday = summary['by_weekday']
+    if any(by_weekday):
+        best = max(range(7), key=by_weekday.__getitem__)
+        worst = min(range(7), key=by_weekday.__getitem__)
+        message += (f"📅 Giorno migliore: {WEEKDAY_NAMES[best]} ({by_weekday[best]:.1f}h), "
+                    f"peggiore: {WEEKDAY_NAMES[worst]} ({by_weekday[worst]:.1f}h)\n")
+
+    months = summary['months']
+    if len(months) > 1:
+        message += "\n**Mese per mese:**\n"
+        # Al massimo gli ultimi 12 mesi, il messaggio resta leggibile
+        for month in months[-12:]:
+            line = f"• {month['month'].strftime('%m/%Y')}: {month['hours']:.1f}h, {month['study_days']} giorni"
+            if month['avg_distraction'] is not None:
+                line += f", distrazione {distraction_text(month['avg_distraction']).lower()}"
+            message += line + "\n"
+
+    return message
@@ -0,0 +1,291 @@
+"""
+Archivio freddo dei log vecchi: un file SQLite per anno.
+
+Le righe di daily_logs (e i weekly_reports con le loro righe) più vecchie dell'orizzonte
+configurato escono dal database principale e finiscono in
+ARCHIVE_DIR/archive_<anno>.db. Il database "caldo" resta piccolo (indici
+poco profondi, backup e snapshot leggeri) mentre quasi tutte le query
+toccano solo la settimana corrente.
+
+I file freddi sono compatti: daily_logs è WITHOUT ROWID con chiave
+(user_id, date), quindi la storia di un utente è contigua su disco, e
+dopo ogni spostamento il file viene compattato con VACUUM.
+
+Lo spostamento avviene mese per mese, in due transazioni: prima la copia
+nel file freddo (commit), poi la cancellazione dal database caldo delle
+sole righe già presenti nel file. Un'interruzione può lasciare righe in
+entrambi (le letture danno la precedenza a quelle calde e il passaggio
+successivo le cancella), mai perderle.
+
+Le letture storiche (Database.get_user_history, export) uniscono freddo
+e caldo senza che il chiamante se ne accorga. Le statistiche settimanali
+delle settimane archiviate restano nel rollup weekly_user_stats.
+"""
+import os
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from reports import REPORT_ROW_COLUMNS, REPORT_SUMMARY_COLUMNS
+
+COLD_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS daily_logs (
+        id INTEGER,
+        user_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        should_study BOOLEAN,
+        hours_studied REAL,
+        distraction_level TEXT,
+        notes TEXT,
+        created_at TIMESTAMP,
+        PRIMARY KEY (user_id, date)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weekly_reports (
+        id INTEGER PRIMARY KEY,
+        chat_id INTEGER,
+        week_start DATE,
+        week_end DATE,
+        report_text TEXT,
+        created_at TIMESTAMP,
+        total_users INTEGER,
+        active_users INTEGER,
+        total_hours REAL,
+        goals_reached INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS weekly_report_rows (
+        report_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        weekly_goal INTEGER,
+        total_hours REAL,
+        study_days INTEGER,
+        total_study_days INTEGER,
+        avg_distraction REAL,
+        notes_count INTEGER,
+        goal_reached BOOLEAN,
+        PRIMARY KEY (report_id, user_id)
+    ) WITHOUT ROWID
+    ''',
+)
+
+DAILY_LOG_COLUMNS = ('id', 'user_id', 'date', 'should_study', 'hours_studied',
+                     'distraction_level', 'notes', 'created_at')
+REPORT_COLUMNS = ('id', 'chat_id', 'week_start', 'week_end', 'report_text', 'created_at',
+                  *(column for column, _ in REPORT_SUMMARY_COLUMNS))
+
+# Stesse colonne di SQL_USER_HISTORY nel database caldo
+SQL_COLD_USER_HISTORY = '''
+    SELECT date, should_study, hours_studied, distraction_level, notes
+    FROM daily_logs
+    WHERE user_id = ?
+    ORDER BY date
+'''
+
+# Orizzonte minimo: la settimana corrente e le ultime settimane restano sempre calde
+MIN_HORIZON_DAYS = 28
+
+
+def archive_file_name(year: int) -> str:
+    return f"archive_{year}.db"
+
+
+def archive_cutoff(today: date, horizon_days: int) -> date:
+    """Primo giorno che resta caldo: un lunedì, così una settimana non è mai divisa"""
+    if horizon_days < MIN_HORIZON_DAYS:
+        raise ValueError(f"Orizzonte di archiviazione troppo corto (minimo {MIN_HORIZON_DAYS} giorni)")
+    cutoff = today - timedelta(days=horizon_days)
+    return cutoff - timedelta(days=cutoff.weekday())
+
+
+def month_ranges(first: date, before: date) -> Iterator[Tuple[date, date]]:
+    """[inizio, fine) di ogni mese da first a before (escluso)"""
+    start = first.replace(day=1)
+    while start < before:
+        end = (start + timedelta(days=32)).replace(day=1)
+        yield start, min(end, before)
+        start = end
+
+
+def create_cold_schema(conn: sqlite3.Connection, schema: str = 'main'):
+    """Tabelle del file freddo; aggiunge i totali dei report ai file creati prima della migrazione 10"""
+    for statement in COLD_SCHEMA:
+        conn.execute(statement.replace('CREATE TABLE IF NOT EXISTS ', f'CREATE TABLE IF NOT EXISTS {schema}.'))
+    columns = {row[1] for row in conn.execute(f'PRAGMA {schema}.table_info(weekly_reports)')}
+    for column, column_type in REPORT_SUMMARY_COLUMNS:
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {schema}.weekly_reports ADD COLUMN {column} {column_type}')
+
+
+def open_cold(path: str) -> sqlite3.Connection:
+    """Connessione in sola lettura ad un file freddo"""
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    conn.execute('PRAGMA query_only = 1')
+    return conn
+
+
+class ColdStorage:
+    """File freddi di una cartella, nell'ordine degli anni"""
+
+    def __init__(self, archive_dir: str, years: Sequence[int] = ()):
+        self.archive_dir = archive_dir
+        self.years: List[int] = sorted(years)
+
+    def path(self, year: int) -> str:
+        return os.path.join(self.archive_dir, archive_file_name(year))
+
+    def paths(self) -> List[str]:
+        return [self.path(year) for year in self.years if os.path.exists(self.path(year))]
+
+    def user_history(self, user_id: int) -> List[Tuple]:
+        """Log archiviati dell'utente, in ordine di data (gli anni sono già in ordine)"""
+        rows = []
+        for path in self.paths():
+            conn = open_cold(path)
+            try:
+                rows.extend(conn.execute(SQL_COLD_USER_HISTORY, (user_id,)))
+            finally:
+                conn.close()
+        return rows
+
+    def upgrade(self):
+        """Porta i file esistenti allo schema attuale (all'apertura del database)"""
+        for path in self.paths():
+            conn = sqlite3.connect(path)
+            try:
+                with conn:
+                    create_cold_schema(conn)
+            finally:
+                conn.close()
+
+    def weekly_report(self, chat_key: int, week_start: str, rows: bool = True) -> Optional[Dict]:
+        """Report archiviato della chat (0 = senza gruppo), nel file dell'anno di week_start"""
+        year = int(week_start[:4])
+        if year not in self.years or not os.path.exists(self.path(year)):
+            return None
+        conn = open_cold(self.path(year))
+        conn.row_factory = sqlite3.Row
+        try:
+            report = conn.execute('''
+                SELECT id, chat_id, week_start, week_end, total_users, active_users,
+                       total_hours, goals_reached, report_text
+                FROM weekly_reports
+                WHERE COALESCE(chat_id, 0) = ? AND week_start = ?
+            ''', (chat_key, week_start)).fetchone()
+            if report is None:
+                return None
+            report = dict(report)
+            if rows:
+                report['rows'] = [dict(row) for row in conn.execute(f'''
+                    SELECT {', '.join(REPORT_ROW_COLUMNS)} FROM weekly_report_rows
+                    WHERE report_id = ? ORDER BY user_id
+                ''', (report['id'],))]
+            return report
+        finally:
+            conn.close()
+
+    def move(self, conn: sqlite3.Connection, year: int, start: date, end: date) -> Dict[str, int]:
+        """
+        Sposta nel file dell'anno i log con data in [start, end) e i report
+        (con le loro righe) con week_start nello stesso intervallo. conn è la connessione di
+        scrittura del database caldo (fuori da transazioni).
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        conn.execute('ATTACH DATABASE ? AS cold', (self.path(year),))
+        try:
+            create_cold_schema(conn, 'cold')
+            params = (start.isoformat(), end.isoformat())
+
+            # 1) copia (commit sul file freddo)
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(f'''
+                INSERT OR REPLACE INTO cold.daily_logs ({', '.join(DAILY_LOG_COLUMNS)})
+                SELECT {', '.join(DAILY_LOG_COLUMNS)} FROM main.daily_logs
+                WHERE date >= ? AND date < ?
+            ''', params)
+            conn.execute(f'''
+                INSERT OR REPLACE INTO cold.weekly_reports ({', '.join(REPORT_COLUMNS)})
+                SELECT {', '.join(REPORT_COLUMNS)} FROM main.weekly_reports
+                WHERE week_start >= ? AND week_start < ?
+            ''', params)
+            conn.execute(f'''
+                INSERT OR REPLACE INTO cold.weekly_report_rows ({', '.join(REPORT_ROW_COLUMNS)})
+                SELECT {', '.join(REPORT_ROW_COLUMNS)} FROM main.weekly_report_rows
+                WHERE report_id IN (SELECT id FROM main.weekly_reports
+                                    WHERE week_start >= ? AND week_start < ?)
+            ''', params)
+            conn.commit()
+
+            # 2) cancellazione dal caldo delle sole righe già copiate
+            conn.execute('BEGIN IMMEDIATE')
+            logs = conn.execute('''
+                DELETE FROM main.daily_logs
+                WHERE date >= ? AND date < ?
+                  AND EXISTS (SELECT 1 FROM cold.daily_logs c
+                              WHERE c.user_id = daily_logs.user_id AND c.date = daily_logs.date)
+            ''', params).rowcount
+            conn.execute('''
+                DELETE FROM main.weekly_report_rows
+                WHERE report_id IN (SELECT id FROM main.weekly_reports
+                                    WHERE week_start >= ? AND week_start < ?
+                                      AND id IN (SELECT id FROM cold.weekly_reports))
+            ''', params)
+            reports = conn.execute('''
+                DELETE FROM main.weekly_reports
+                WHERE week_start >= ? AND week_start < ?
+                  AND id IN (SELECT id FROM cold.weekly_reports)
+            ''', params).rowcount
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.execute('DETACH DATABASE cold')
+        return {'daily_logs': logs, 'weekly_reports': reports}
+
+    def compact(self, year: int):
+        """VACUUM del file freddo dopo uno spostamento"""
+        conn = sqlite3.connect(self.path(year))
+        try:
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+    def iter_rows(self, sql: str, params: tuple) -> Iterator[sqlite3.Cursor]:
+        """Cursore della query su ogni file freddo, in ordine di anno (per l'export)"""
+        for path in self.paths():
+            conn = open_cold(path)
+            try:
+                yield conn.execute(sql, params)
+            finally:
+                conn.close()
+
+
+def merge_history(cold: List[Tuple], hot: List[Tuple]) -> List[Tuple]:
+    """Storia fredda + calda; se un giorno è in entrambi (spostamento interrotto) vince il caldo"""
+    if not cold:
+        return hot
+    if hot:
+        hot_dates = {row[0] for row in hot}
+        kept = [row for row in cold if row[0] not in hot_dates]
+        if len(kept) < len(cold):
+            # Il giorno rimasto nel caldo va rimesso al suo posto (storia in ordine di data)
+            return sorted(kept + hot, key=lambda row: row[0])
+    return cold + hot
+
+
+def first_archivable_day(conn: sqlite3.Connection, before: date) -> Optional[date]:
+    """Primo giorno con log o report da archiviare (None se non c'è niente)"""
+    row = conn.execute('''
+        SELECT MIN(first) FROM (
+            SELECT MIN(date) AS first FROM daily_logs WHERE date < ?
+            UNION ALL
+            SELECT MIN(week_start) FROM weekly_reports WHERE week_start < ?
+        )
+    ''', (before.isoformat(), before.isoformat())).fetchone()
+    return date.fromisoformat(row[0]) if row and row[0] else None
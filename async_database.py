@@ -0,0 +1,172 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from database import Database
+from write_behind import WriteBehindQueue
+
+
+class AsyncDatabase:
+    """
+    Versione awaitable di Database per gli handler asyncio.
+
+    Ogni metodo di Database è disponibile come coroutine con la stessa firma:
+    le scritture girano su un unico thread dedicato (serializzate, come la
+    connessione di scrittura), le letture su un pool di thread in parallelo.
+    Così un fsync lento non blocca mai l'event loop.
+
+    Le scritture brevi e frequenti (BATCHED_METHODS: check-in e impostazioni)
+    passano dalla coda write-behind: la coroutine ritorna subito True e le
+    scritture vengono committate a gruppi (WriteBehindQueue). Chi deve
+    rileggere un dato appena scritto chiama prima await barrier().
+    """
+
+    # Metodi che scrivono sul database (vanno sul thread di scrittura)
+    WRITE_METHODS = frozenset({
+        'init_db',
+        'open',
+        'add_user',
+        'update_user_goal',
+        'update_user_checkin_time',
+        'update_user_reminders',
+        'add_daily_log',
+        'save_weekly_report',
+        'backup_database',
+        'rebuild_weekly_rollup',
+        'archive_logs',
+        'acquire_lease',
+        'release_lease',
+        'claim_notifications',
+        'finish_notifications',
+        'reclaim_notifications',
+        'prune_coordination',
+        'add_group',
+        'deactivate_group',
+        'add_group_member',
+        'remove_group_member',
+    })
+
+    # Scritture accodate nella write-behind e committate a gruppi
+    BATCHED_METHODS = frozenset({
+        'add_daily_log',
+        'update_user_goal',
+        'update_user_checkin_time',
+        'update_user_reminders',
+    })
+
+    def __init__(self, db: Database, write_behind: bool = True,
+                 write_delay: float = 0.005, write_batch: int = 100):
+        self.db = db
+        self._write_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='db-writer'
+        )
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=db.read_pool_size, thread_name_prefix='db-reader'
+        )
+        self._query_listeners = []
+        self.write_queue = WriteBehindQueue(
+            self._submit_batch, max_delay=write_delay, max_batch=write_batch
+        ) if write_behind else None
+
+    def add_query_listener(self, listener):
+        """
+        Registra listener(nome_metodo, secondi, write), chiamato dopo ogni
+        operazione con il tempo passato nel thread del database (senza l'attesa
+        in coda). Gira nel contesto del chiamante: può usare contextvars.
+        """
+        self._query_listeners.append(listener)
+
+    def _submit(self, func, args: tuple, kwargs: dict, write: bool,
+                context: Optional[contextvars.Context] = None) -> asyncio.Future:
+        """
+        Invia subito la funzione al thread (l'ordine delle scritture è quello di invio).
+        Con il tracciamento SQL la funzione gira nel contesto del chiamante (o in context),
+        così le sue query sono attribuite alla richiesta in corso.
+        """
+        executor = self._write_executor if write else self._read_executor
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        if self.db.tracer is not None:
+            if context is None:
+                context = contextvars.copy_context()
+            call = functools.partial(context.run, call)
+        if not self._query_listeners:
+            return loop.run_in_executor(executor, call)
+
+        elapsed = []
+
+        def timed_call():
+            start = time.perf_counter()
+            try:
+                return call()
+            finally:
+                elapsed.append(time.perf_counter() - start)
+
+        name = getattr(func, '__name__', repr(func))
+
+        def notify(future):
+            # I done callback girano nel contesto di chi ha inviato la funzione
+            if elapsed:
+                for listener in self._query_listeners:
+                    listener(name, elapsed[0], write)
+
+        future = loop.run_in_executor(executor, timed_call)
+        future.add_done_callback(notify)
+        return future
+
+    def _submit_batch(self, calls) -> asyncio.Future:
+        # Un batch raccoglie scritture di più richieste: il suo commit non è di nessuna
+        return self._submit(self.db.run_batch, (calls,), {}, True, context=contextvars.Context())
+
+    async def run(self, func, *args, write: bool = False, **kwargs):
+        """Esegue una funzione sincrona sul thread di scrittura o di lettura"""
+        if write and self.write_queue is not None:
+            # Le scritture già accodate passano prima di questa
+            self.write_queue.flush()
+        return await self._submit(func, args, kwargs, write)
+
+    async def barrier(self):
+        """Attende che le scritture accodate finora siano committate (read-your-write)"""
+        if self.write_queue is not None:
+            await self.write_queue.barrier()
+
+    async def get_user(self, user_id: int):
+        """Profilo utente: dalla cache senza passare dai thread, altrimenti dal database"""
+        user = self.db.user_cache.get(user_id)
+        if user is not None:
+            return user
+        return await self.run(self.db.load_user, user_id)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        write = name in self.WRITE_METHODS
+
+        if name in self.BATCHED_METHODS and self.write_queue is not None:
+            @functools.wraps(attr)
+            async def method(*args, **kwargs):
+                self.write_queue.submit(name, args, kwargs)
+                return True
+        else:
+            @functools.wraps(attr)
+            async def method(*args, **kwargs):
+                return await self.run(attr, *args, write=write, **kwargs)
+
+        # Cache sull'istanza: __getattr__ non viene più chiamato per questo nome
+        setattr(self, name, method)
+        return method
+
+    def shutdown(self):
+        """Attende le operazioni in corso, scrive quelle ancora in coda e chiude thread e connessioni"""
+        self._write_executor.shutdown(wait=True)
+        if self.write_queue is not None:
+            calls = self.write_queue.drain()
+            if calls:
+                self.db.run_batch(calls)
+        self._read_executor.shutdown(wait=True)
+        self.db.close()
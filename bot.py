@@ -1,11 +1,23 @@
+# Prima di tutto: il profilo di avvio misura anche gli import che seguono
+from startup import PROFILE
+
+import asyncio
+import contextlib
+import functools
 import logging
+import os
+import tempfile
 import pytz
-from datetime import datetime, time
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from typing import Optional
+from telegram import Update, Chat, ChatMember
+from telegram.error import Forbidden
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ContextTypes,
     MessageHandler,
     filters
@@ -14,6 +26,20 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from database import Database
+from async_database import AsyncDatabase
+from dispatcher import MinuteDispatcher, CHECKIN, REMINDER_START, REMINDER_END
+from rate_limiter import PriorityRateLimiter, PRIORITY_INTERACTIVE, PRIORITY_BULK
+import checkin_flow
+from group_registry import GroupRegistry
+from coordination import LeaderLease, default_worker_id
+from snapshots import SnapshotManager, create_compressed_snapshot
+from export import export_table, parse_export_args
+from archive import MIN_HORIZON_DAYS, archive_cutoff
+import analytics
+import leaderboard
+import reports
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS, SCHEDULER_LAG, observe_query
+from sql_trace import format_report as format_sql_trace
 from config import Config
 
 # Setup logging
@@ -23,14 +49,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Inizializza database
-db = Database(Config.DB_PATH)
+# Database: le migrazioni girano al primo uso, non all'import (avvio veloce)
+db = Database(Config.DB_PATH, archive_dir=Config.ARCHIVE_DIR, lazy=True,
+              trace=Config.SQL_TRACE, trace_slow_queries=Config.SQL_TRACE_SLOW_QUERIES)
+# Accesso non bloccante per gli handler (thread di scrittura + pool di lettura)
+adb = AsyncDatabase(
+    db,
+    write_behind=Config.WRITE_BEHIND,
+    write_delay=Config.WRITE_BATCH_DELAY_MS / 1000,
+    write_batch=Config.WRITE_BATCH_MAX_SIZE
+)
+# Tempo per metodo di Database nelle metriche (/metrics)
+adb.add_query_listener(observe_query)
 
 # Timezone italiana
 TZ = pytz.timezone(Config.TIMEZONE)
 
-# Stato temporaneo per check-in
-user_checkin_state = {}
+# Chiave con cui si firmano i bottoni del check-in (stato nel callback_data)
+CHECKIN_KEY = checkin_flow.signing_key(Config.BOT_TOKEN)
+
+# Gruppi in cui si trova il bot e loro membri (per i report settimanali)
+group_registry = GroupRegistry(adb)
+
+# Più worker sullo stesso database: lo scheduler gira solo sul leader
+SCHEDULER_LEASE = 'scheduler'
+WORKER_ID = Config.WORKER_ID or default_worker_id()
+# Notifiche non inviate: si riprovano per un'ora al massimo e per non più di 3 tentativi
+WEEKLY_REPORT = 'weekly_report'
+NOTIFICATION_RETRY_SECONDS = 3600
+NOTIFICATION_MAX_ATTEMPTS = 3
 
 
 # ========== COMANDI BASE ==========
@@ -40,7 +87,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Registra utente nel database
-    db.add_user(user.id, user.username or user.first_name)
+    await adb.add_user(user.id, user.username or user.first_name)
     
     await update.message.reply_text(Config.WELCOME_MESSAGE)
 
@@ -68,7 +115,7 @@ async def setgoal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⚠️ Inserisci un numero di ore valido (0-168)")
             return
         
-        db.update_user_goal(user_id, goal)
+        await adb.update_user_goal(user_id, goal)
         await update.message.reply_text(f"✅ Obiettivo settimanale impostato: {goal} ore")
     except ValueError:
         await update.message.reply_text("⚠️ Inserisci un numero valido")
@@ -89,10 +136,11 @@ async def settime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         time_str = context.args[0]
         datetime.strptime(time_str, '%H:%M')
         
-        db.update_user_checkin_time(user_id, time_str)
+        await adb.update_user_checkin_time(user_id, time_str)
+        await adb.barrier()
         
         # Rischedula check-in per questo utente
-        reschedule_user_checkin(context.application, user_id)
+        await reschedule_user_checkin(context.application, user_id)
         
         await update.message.reply_text(f"✅ Orario check-in impostato: {time_str}")
     except ValueError:
@@ -118,10 +166,11 @@ async def setreminders_command(update: Update, context: ContextTypes.DEFAULT_TYP
         datetime.strptime(start_time, '%H:%M')
         datetime.strptime(end_time, '%H:%M')
         
-        db.update_user_reminders(user_id, start_time, end_time)
+        await adb.update_user_reminders(user_id, start_time, end_time)
+        await adb.barrier()
         
         # Rischedula reminder per questo utente
-        reschedule_user_reminders(context.application, user_id)
+        await reschedule_user_reminders(context.application, user_id)
         
         await update.message.reply_text(
             f"✅ Reminder impostati:\n"
@@ -137,7 +186,7 @@ async def setreminders_command(update: Update, context: ContextTypes.DEFAULT_TYP
 async def checkin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /checkin - Avvia check-in manuale"""
     user_id = update.effective_user.id
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     
     if not user:
         await update.message.reply_text("⚠️ Usa /start per registrarti prima!")
@@ -146,33 +195,31 @@ async def checkin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_checkin_message(update.effective_chat.id, user_id, context)
 
 
-async def send_checkin_message(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE):
+async def send_checkin_message(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE,
+                               priority: int = PRIORITY_INTERACTIVE):
     """Invia messaggio di check-in con bottoni"""
     # Ottieni username
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     username = user['username'] if user else "utente"
     
-    keyboard = [
-        [
-            InlineKeyboardButton("Sì", callback_data=f"checkin_yes_{user_id}"),
-            InlineKeyboardButton("No - giorno libero", callback_data=f"checkin_no_{user_id}")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    today = datetime.now(TZ).date()
+    answers = checkin_flow.start(user_id, today)
+    reply_markup = checkin_flow.keyboard(checkin_flow.FIRST_STEP, answers, CHECKIN_KEY)
+    question = checkin_flow.STEPS[checkin_flow.FIRST_STEP].question
     
-    today = datetime.now(TZ).strftime('%Y-%m-%d')
-    existing_log = db.get_daily_log(user_id, today)
+    existing_log = await adb.get_daily_log(user_id, today.strftime('%Y-%m-%d'))
     
     if existing_log:
         message = f"ℹ️ @{username}, hai già fatto il check-in oggi!\n\n"
-        message += "Vuoi aggiornarlo?\n\n1️⃣ Dovevi studiare oggi?"
+        message += f"Vuoi aggiornarlo?\n\n{question}"
     else:
-        message = f"🎯 Check-in giornaliero - @{username}\n\n1️⃣ Dovevi studiare oggi?"
+        message = f"🎯 Check-in giornaliero - @{username}\n\n{question}"
     
     await context.bot.send_message(
         chat_id=chat_id,
         text=message,
-        reply_markup=reply_markup
+        reply_markup=reply_markup,
+        rate_limit_args=priority
     )
 
 
@@ -182,121 +229,161 @@ async def skip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     today = datetime.now(TZ).strftime('%Y-%m-%d')
     
     # Salva come giorno libero
-    db.add_daily_log(user_id, today, should_study=False, hours_studied=0, 
-                     distraction_level='low', notes='Giorno libero')
+    await adb.add_daily_log(user_id, today, should_study=False, hours_studied=0, 
+                            distraction_level='low', notes='Giorno libero')
     
     await update.message.reply_text("✅ Check-in saltato. Registrato come giorno libero.")
 
 
+CHECKIN_EXPIRED_MESSAGE = "⚠️ Questo check-in è scaduto. Usa /checkin per ricominciare."
+
+# Bottoni del formato precedente (stato in memoria): solo il primo passo non ha stato
+LEGACY_CALLBACK_PREFIXES = ('checkin_yes_', 'checkin_no_', 'hours_', 'distraction_')
+
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Gestisce callback dai bottoni inline"""
+    """
+    Gestisce i bottoni del check-in. Tutto lo stato è nel callback_data
+    (vedi checkin_flow): nessuna memoria tra un passo e l'altro.
+    """
     query = update.callback_query
-    await query.answer()
     
-    data = query.data
-    user_id = int(data.split('_')[-1])
+    try:
+        step, answers = checkin_flow.decode(query.data, CHECKIN_KEY, ttl=Config.CHECKIN_TTL)
+    except checkin_flow.ExpiredCallback:
+        await query.answer()
+        await query.edit_message_text(CHECKIN_EXPIRED_MESSAGE)
+        return
+    except checkin_flow.InvalidCallback:
+        step, answers = legacy_checkin_answers(query.data)
+        if answers is None:
+            await query.answer()
+            await query.edit_message_text(CHECKIN_EXPIRED_MESSAGE)
+            return
     
     # Verifica che l'utente che clicca sia quello giusto
-    if query.from_user.id != user_id:
+    if query.from_user.id != answers.user_id:
         await query.answer("⚠️ Questo check-in non è per te!", show_alert=True)
         return
+    await query.answer()
     
-    today = datetime.now(TZ).strftime('%Y-%m-%d')
-    
-    # Step 1: Dovevi studiare?
-    if data.startswith('checkin_yes_'):
-        user_checkin_state[user_id] = {'should_study': True, 'date': today}
-        
-        keyboard = [
-            [InlineKeyboardButton("0h", callback_data=f"hours_0_{user_id}"),
-             InlineKeyboardButton("0.5h", callback_data=f"hours_0.5_{user_id}"),
-             InlineKeyboardButton("1h", callback_data=f"hours_1_{user_id}")],
-            [InlineKeyboardButton("1.5h", callback_data=f"hours_1.5_{user_id}"),
-             InlineKeyboardButton("2h", callback_data=f"hours_2_{user_id}"),
-             InlineKeyboardButton("2.5h", callback_data=f"hours_2.5_{user_id}")],
-            [InlineKeyboardButton("3h+", callback_data=f"hours_3_{user_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    following = checkin_flow.next_step(step, answers)
+    if following is not None:
         await query.edit_message_text(
-            text="2️⃣ Quante ore hai studiato?",
-            reply_markup=reply_markup
+            text=checkin_flow.STEPS[following].question,
+            reply_markup=checkin_flow.keyboard(following, answers, CHECKIN_KEY)
         )
+        return
     
-    elif data.startswith('checkin_no_'):
+    await save_checkin(query, context, answers)
+
+
+def legacy_checkin_answers(data: str):
+    """Primo passo dei bottoni già inviati col vecchio formato (checkin_yes_ID / checkin_no_ID)"""
+    if data.startswith(('checkin_yes_', 'checkin_no_')):
+        user_id = int(data.split('_')[-1])
+        answers = checkin_flow.start(user_id, datetime.now(TZ).date())
+        option = checkin_flow.option_index('should_study', data.startswith('checkin_yes_'))
+        return checkin_flow.FIRST_STEP, answers.answer(checkin_flow.FIRST_STEP, option)
+    return None, None
+
+
+async def save_checkin(query, context: ContextTypes.DEFAULT_TYPE, answers: checkin_flow.CheckinAnswers):
+    """Ultimo passo del check-in: salva il log e mostra il totale della settimana"""
+    user_id = answers.user_id
+    day = answers.date.strftime('%Y-%m-%d')
+    
+    if not answers.value('should_study'):
         # Giorno libero
-        db.add_daily_log(user_id, today, should_study=False, hours_studied=0,
-                        distraction_level='low', notes='Giorno libero')
+        await adb.add_daily_log(user_id, day, should_study=False, hours_studied=0,
+                                distraction_level='low', notes='Giorno libero')
         await query.edit_message_text("✅ Check-in salvato! Giorno libero registrato.")
-        user_checkin_state.pop(user_id, None)
+        return
     
-    # Step 2: Ore studiate
-    elif data.startswith('hours_'):
-        hours = float(data.split('_')[1])
-        user_checkin_state[user_id]['hours_studied'] = hours
-        
-        keyboard = [
-            [InlineKeyboardButton("Basso 💪", callback_data=f"distraction_low_{user_id}"),
-             InlineKeyboardButton("Medio 😅", callback_data=f"distraction_medium_{user_id}")],
-            [InlineKeyboardButton("Alto 😞", callback_data=f"distraction_high_{user_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text="3️⃣ Livello di distrazione?",
-            reply_markup=reply_markup
-        )
+    hours = answers.value('hours')
+    await adb.add_daily_log(
+        user_id,
+        day,
+        True,
+        hours,
+        answers.value('distraction'),
+        notes=""
+    )
+    # Il totale settimanale deve già contenere il check-in appena salvato
+    await adb.barrier()
     
-    # Step 3: Distrazione
-    elif data.startswith('distraction_'):
-        distraction = data.split('_')[1]
-        user_checkin_state[user_id]['distraction_level'] = distraction
-        
-        # Salva nel database
-        state = user_checkin_state[user_id]
-        db.add_daily_log(
-            user_id, 
-            state['date'],
-            state['should_study'],
-            state['hours_studied'],
-            state['distraction_level'],
-            notes=""
-        )
-        
-        # Calcola ore settimanali
-        week_start, week_end = db.get_week_dates()
-        stats = db.get_user_weekly_stats(user_id, week_start, week_end)
-        user = db.get_user(user_id)
-        goal = user['weekly_goal'] if user else 20
-        
-        await query.edit_message_text(
-            f"✅ Check-in salvato!\n\n"
-            f"Ore oggi: {state['hours_studied']}h\n"
-            f"Totale questa settimana: {stats['total_hours']}h / {goal}h"
-        )
-        
-        # Chiedi note (opzionale)
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text="4️⃣ Vuoi aggiungere note? (opzionale)\nRispondi a questo messaggio o ignora."
-        )
-        
-        user_checkin_state.pop(user_id, None)
+    # Calcola ore settimanali
+    week_start, week_end = db.get_week_dates()
+    stats = await adb.get_user_weekly_stats(user_id, week_start, week_end)
+    user = await adb.get_user(user_id)
+    goal = user['weekly_goal'] if user else 20
+    
+    await query.edit_message_text(
+        f"✅ Check-in salvato!\n\n"
+        f"Ore oggi: {hours}h\n"
+        f"Totale questa settimana: {stats['total_hours']}h / {goal}h"
+    )
+    
+    # Chiedi note (opzionale)
+    await context.bot.send_message(
+        chat_id=query.message.chat_id,
+        text="4️⃣ Vuoi aggiungere note? (opzionale)\nRispondi a questo messaggio o ignora."
+    )
 
 
 # ========== STATISTICHE ==========
 
+# Periodi di /mystats: giorni all'indietro da oggi (None = tutta la storia)
+MYSTATS_RANGES = {
+    'mese': ("Ultimi 30 giorni", 30),
+    'trimestre': ("Ultimi 90 giorni", 90),
+    'anno': ("Ultimo anno", 365),
+    'tutto': ("Da sempre", None),
+}
+
+# Periodo a scelta più lungo accettato da /mystats (il calcolo è per giorno di calendario)
+MYSTATS_MAX_DAYS = 3660
+
+MYSTATS_USAGE = (
+    "⚠️ Uso: /mystats [mese|trimestre|anno|tutto]\n"
+    f"oppure /mystats AAAA-MM-GG AAAA-MM-GG (al massimo {MYSTATS_MAX_DAYS} giorni)"
+)
+
+
+def parse_mystats_range(args: list, today: date):
+    """(titolo, inizio, fine) dagli argomenti di /mystats; inizio None = dal primo log"""
+    if len(args) == 1 and args[0].lower() in MYSTATS_RANGES:
+        title, days = MYSTATS_RANGES[args[0].lower()]
+        start = today - timedelta(days=days - 1) if days else None
+        return title, start, today
+    
+    if len(args) == 2:
+        start = datetime.strptime(args[0], '%Y-%m-%d').date()
+        end = datetime.strptime(args[1], '%Y-%m-%d').date()
+        if start > end:
+            raise ValueError("inizio dopo la fine")
+        if (end - start).days + 1 > MYSTATS_MAX_DAYS:
+            raise ValueError("periodo troppo lungo")
+        return "Periodo", start, end
+    
+    raise ValueError("periodo non valido")
+
+
 async def mystats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /mystats - Mostra statistiche personali"""
+    """Comando /mystats [periodo] - Mostra statistiche personali"""
     user_id = update.effective_user.id
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     
     if not user:
         await update.message.reply_text("⚠️ Usa /start per registrarti prima!")
         return
     
+    if context.args and context.args[0].lower() not in ('settimana', 'week'):
+        await send_long_range_stats(update, context, user)
+        return
+    
     week_start, week_end = db.get_week_dates()
-    stats = db.get_user_weekly_stats(user_id, week_start, week_end)
+    stats = await adb.get_user_weekly_stats(user_id, week_start, week_end)
     
     message = f"📊 **Statistiche personali - @{user['username']}**\n\n"
     message += f"**Questa settimana:**\n"
@@ -313,112 +400,379 @@ async def mystats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             message += f"\n📈 Progresso: {completion:.0f}%"
     
+    message += "\n\nPeriodi più lunghi: /mystats mese | trimestre | anno | tutto"
+    
+    await update.message.reply_text(message)
+
+
+async def send_long_range_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, user: dict):
+    """/mystats su un periodo lungo: serie, medie mobili, giorni della settimana, andamento"""
+    today = datetime.now(TZ).date()
+    try:
+        title, start, end = parse_mystats_range(context.args, today)
+    except ValueError:
+        await update.message.reply_text(MYSTATS_USAGE)
+        return
+    
+    # Storia letta una volta sola; il calcolo gira su un thread del database
+    rows = await adb.get_user_history(user['user_id'])
+    summary = await adb.run(analytics.user_analytics, rows, start, end, today)
+    
+    if summary is None:
+        await update.message.reply_text("📊 Nessun check-in registrato nel periodo.")
+        return
+    
+    message = f"📊 **Statistiche personali - @{user['username']}**\n\n"
+    message += analytics.format_summary(summary, title)
     await update.message.reply_text(message)
 
 
 async def weekly_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /weekly - Genera report settimanale"""
+    """Comando /weekly [AAAA-MM-GG] - Report settimanale (di una settimana passata con la data)"""
+    if context.args:
+        try:
+            day = datetime.strptime(context.args[0], '%Y-%m-%d').date()
+        except ValueError:
+            await update.message.reply_text("⚠️ Uso: /weekly oppure /weekly AAAA-MM-GG")
+            return
+        await send_past_weekly_report(update, day)
+        return
     await generate_weekly_report(context, update.effective_chat.id)
 
 
+def previous_week_start(week_start: str) -> str:
+    """Lunedì della settimana prima"""
+    return (datetime.strptime(week_start, '%Y-%m-%d') - timedelta(weeks=1)).strftime('%Y-%m-%d')
+
+
+async def send_past_weekly_report(update: Update, day: date):
+    """Report salvato della settimana che contiene day (del gruppo o, fuori dai gruppi, di tutti)"""
+    chat_id = update.effective_chat.id
+    members = await group_registry.members(chat_id)
+    report_chat_id = chat_id if members else None
+    week_start = (day - timedelta(days=day.weekday())).isoformat()
+    
+    report = await adb.get_weekly_report(report_chat_id, week_start)
+    if report is None:
+        await update.message.reply_text(f"⚠️ Nessun report salvato per la settimana del {week_start}.")
+        return
+    if report['report_text'] is not None:
+        # Vecchio report rimasto come testo
+        await update.message.reply_text(report['report_text'])
+        return
+    previous = await adb.get_weekly_report(report_chat_id, previous_week_start(week_start), rows=False)
+    await update.message.reply_text(reports.render_report(report, previous))
+
+
 async def generate_weekly_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
-    """Genera e invia report settimanale"""
+    """Genera e invia report settimanale (in un gruppo: solo i suoi membri)"""
     week_start, week_end = db.get_week_dates()
-    users = db.get_all_active_users()
+    members = await group_registry.members(chat_id)
+    # Report del gruppo o, fuori dai gruppi registrati, quello di tutti
+    report_chat_id = chat_id if members else None
     
-    if not users:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="⚠️ Nessun utente registrato."
-        )
-        return
+    message = db.report_cache.get(report_chat_id, week_start)
+    if message is None:
+        token = db.report_cache.load_token()
+        users = await adb.get_all_users_weekly_stats(week_start, week_end)
+        if members:
+            users = [stats for stats in users if stats['user_id'] in members]
+        
+        if not users:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="⚠️ Nessun utente registrato."
+            )
+            return
+        
+        report = reports.build_report(users, week_start, week_end)
+        previous = await adb.get_weekly_report(report_chat_id, previous_week_start(week_start), rows=False)
+        message = reports.render_report(report, previous)
+        db.report_cache.put(report_chat_id, week_start, message, token)
+        # Un solo report per chat e settimana: aggiorna quello salvato
+        await adb.save_weekly_report(report, chat_id=report_chat_id)
     
-    # Header
-    start_date = datetime.strptime(week_start, '%Y-%m-%d').strftime('%d/%m')
-    end_date = datetime.strptime(week_end, '%Y-%m-%d').strftime('%d/%m')
+    await context.bot.send_message(chat_id=chat_id, text=message)
+
+
+# Righe della classifica mostrate da /leaderboard
+LEADERBOARD_SIZE = 10
+
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /leaderboard [ore|obiettivo] - Classifica della settimana"""
+    metric = context.args[0].lower() if context.args else 'ore'
+    if metric not in leaderboard.METRICS:
+        await update.message.reply_text("⚠️ Uso: /leaderboard [ore|obiettivo]")
+        return
     
-    message = f"📈 **REPORT SETTIMANALE**\n"
-    message += f"Settimana {start_date} - {end_date}\n\n"
-    message += "📊 **STATISTICHE PERSONALI:**\n\n"
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    week_start, _ = db.get_week_dates()
+    # Classifica del gruppo o, fuori dai gruppi registrati, quella di tutti
+    members = await group_registry.members(chat_id)
+    board = await adb.get_leaderboard(chat_id if members else None, week_start, user_id,
+                                      metric=metric, limit=LEADERBOARD_SIZE)
     
-    # Statistiche per utente
-    total_hours_all = 0
-    active_users = 0
-    goals_reached = 0
+    if not board['total']:
+        await update.message.reply_text("⚠️ Nessun utente registrato.")
+        return
     
-    for user in users:
-        stats = db.get_user_weekly_stats(user['user_id'], week_start, week_end)
-        
-        if stats['study_days'] > 0:
-            active_users += 1
-            total_hours_all += stats['total_hours']
-            
-            message += f"@{user['username']}:\n"
-            message += f"• Ore studiate: {stats['total_hours']}h / {user['weekly_goal']}h obiettivo"
-            
-            if stats['total_hours'] >= user['weekly_goal']:
-                message += " ✅"
-                goals_reached += 1
-            
-            message += f"\n• Giorni di studio: {stats['study_days']}/{stats['total_study_days']}\n"
-            message += f"• Distrazione media: {stats['distraction_text']}\n"
-            
-            if stats['notes_count'] > 0:
-                message += f"• Note aggiunte: {stats['notes_count']}\n"
-            
-            message += "\n"
-    
-    # Statistiche di gruppo
-    message += "---\n\n"
-    message += "📊 **STATISTICHE DI GRUPPO:**\n\n"
-    message += f"• Partecipanti attivi: {active_users}/{len(users)}\n"
-    message += f"• Totale ore studiate: {total_hours_all}h\n"
-    
-    if active_users > 0:
-        avg_hours = total_hours_all / active_users
-        message += f"• Media ore/persona: {avg_hours:.1f}h\n"
-        completion_rate = (goals_reached / active_users) * 100
-        message += f"• Tasso completamento obiettivi: {completion_rate:.0f}%\n"
-    
-    # Salva report nel database
-    db.save_weekly_report(week_start, week_end, message)
+    title = "ore studiate" if metric == 'ore' else "obiettivo raggiunto"
+    message = f"🏆 **CLASSIFICA SETTIMANALE** ({title})\n\n"
+    for position, member_id, entry in board['top']:
+        message += format_leaderboard_line(position, entry, member_id == user_id)
     
-    await context.bot.send_message(chat_id=chat_id, text=message)
+    rank = board['rank']
+    if rank is not None and rank > LEADERBOARD_SIZE:
+        message += "…\n"
+        message += format_leaderboard_line(rank, board['me'], True)
+    message += f"\n👥 {board['total']} in classifica"
+    await update.message.reply_text(message)
+
+
+def format_leaderboard_line(position: int, entry: dict, is_me: bool) -> str:
+    """Riga della classifica: posizione, utente, ore e % dell'obiettivo"""
+    medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(position, f"{position}.")
+    percent = leaderboard.completion(entry) * 100
+    line = f"{medal} @{entry['username']} - {entry['total_hours']:.1f}h ({percent:.0f}%)"
+    return line + (" ⬅️\n" if is_me else "\n")
 
 
 # ========== BACKUP ==========
 
-async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /backup - Invia backup database (solo in chat privata)"""
+async def check_admin(update: Update) -> bool:
+    """Comandi di amministrazione: solo in chat privata e solo per gli utenti in ADMIN_USER_IDS"""
     if update.effective_chat.type != 'private':
         await update.message.reply_text(
             "⚠️ Questo comando funziona solo in chat privata con il bot."
         )
+        return False
+    if update.effective_user.id not in Config.ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Comando riservato agli amministratori.")
+        return False
+    return True
+
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /backup - Invia backup database (solo admin, in chat privata)"""
+    if not await check_admin(update):
         return
     
-    db_path = db.backup_database()
+    timestamp = datetime.now(TZ).strftime('%Y%m%d_%H%M')
+    snapshot_path = os.path.join(
+        tempfile.gettempdir(), f"study_bot_backup_{timestamp}_{update.effective_user.id}.db.gz"
+    )
     
     try:
-        await update.message.reply_document(
-            document=open(db_path, 'rb'),
-            filename=f"study_bot_backup_{datetime.now(TZ).strftime('%Y%m%d_%H%M')}.db",
-            caption="📦 Backup database"
-        )
+        # Copia online + compressione su un thread: i check-in continuano a scrivere
+        snapshot = await asyncio.to_thread(create_compressed_snapshot, db.db_path, snapshot_path)
+        
+        # Il file viene letto durante l'invio, senza caricarlo tutto in memoria prima
+        with open(snapshot_path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"study_bot_backup_{timestamp}.db.gz",
+                caption=f"📦 Backup database "
+                        f"({snapshot['size'] / 1024:.0f} KB, {snapshot['raw_size'] / 1024:.0f} KB non compresso)"
+            )
     except Exception as e:
         await update.message.reply_text(f"⚠️ Errore durante backup: {e}")
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /export - Esporta una tabella in CSV/JSONL compresso (solo admin, in chat privata)"""
+    if not await check_admin(update):
+        return
+    
+    try:
+        options = parse_export_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"⚠️ {e}\n\n"
+            "Uso: /export <daily_logs|users|weekly_reports|weekly_report_rows> [csv|jsonl] "
+            "[dal AAAA-MM-GG] [al AAAA-MM-GG] [user_id]\n"
+            "Esempio: /export daily_logs jsonl 2026-01-01 2026-03-31"
+        )
+        return
+    
+    timestamp = datetime.now(TZ).strftime('%Y%m%d_%H%M')
+    filename = f"{options['table']}_{timestamp}.{options['fmt']}.gz"
+    export_path = os.path.join(
+        tempfile.gettempdir(), f"study_bot_export_{timestamp}_{update.effective_user.id}.{options['fmt']}.gz"
+    )
+    
+    try:
+        # Lettura a blocchi e compressione su un thread: il bot continua a rispondere
+        result = await asyncio.to_thread(export_table, db.db_path, dest_path=export_path,
+                                         archive_dir=Config.ARCHIVE_DIR, **options)
+        with open(export_path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=filename,
+                caption=f"📤 Export {result['table']}: {result['rows']} righe "
+                        f"({result['size'] / 1024:.0f} KB)"
+            )
+    except Exception as e:
+        await update.message.reply_text(f"⚠️ Errore durante export: {e}")
+    finally:
+        if os.path.exists(export_path):
+            os.remove(export_path)
+
+
+async def take_periodic_snapshot(application: Application, manager: SnapshotManager):
+    """Snapshot periodico (full o incrementale) nella cartella SNAPSHOT_DIR"""
+    if not application.leader.is_leader:
+        return
+    try:
+        snapshot = await asyncio.to_thread(manager.snapshot)
+    except Exception as e:
+        logger.error(f"Errore snapshot periodico: {e}")
+        return
+    
+    if snapshot:
+        logger.info(f"Snapshot {snapshot['type']} salvato: {snapshot['file']} ({snapshot['size']} byte)")
+
+
+async def archive_old_logs(application: Application):
+    """Sposta nell'archivio freddo i log più vecchi di ARCHIVE_AFTER_DAYS giorni"""
+    if not application.leader.is_leader:
+        return
+    before = archive_cutoff(datetime.now(TZ).date(), Config.ARCHIVE_AFTER_DAYS)
+    try:
+        # Su un thread a parte: archive_logs prende il lock di scrittura un mese
+        # per volta, le scritture degli handler passano tra un mese e l'altro
+        result = await asyncio.to_thread(db.archive_logs, before)
+    except Exception as e:
+        logger.error(f"Errore archiviazione log: {e}")
+        return
+    
+    if result['daily_logs'] or result['weekly_reports']:
+        logger.info(f"Archiviati {result['daily_logs']} log e {result['weekly_reports']} report "
+                    f"precedenti al {before.isoformat()}")
+
+
+# ========== TRACCIAMENTO SQL ==========
+
+# Limite di Telegram per un messaggio
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+async def sqltrace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /sqltrace [reset] - Riepilogo del tracciamento SQL (solo admin, in chat privata)"""
+    if not await check_admin(update):
+        return
+    
+    if db.tracer is None:
+        await update.message.reply_text("⚠️ Tracciamento SQL non attivo: avvia il bot con SQL_TRACE=1.")
+        return
+    
+    reset = bool(context.args) and context.args[0].lower() == 'reset'
+    report = await adb.sql_trace_report(reset=reset)
+    message = format_sql_trace(report, sql_width=100)
+    if len(message) > TELEGRAM_MESSAGE_LIMIT:
+        message = message[:TELEGRAM_MESSAGE_LIMIT - 1] + "…"
+    await update.message.reply_text(message)
+
+
+async def log_sql_trace():
+    """Riepilogo periodico del tracciamento SQL nel log (ogni worker ha il suo)"""
+    report = await adb.sql_trace_report(reset=True)
+    if report['statements']:
+        logger.info(f"Tracciamento SQL\n{format_sql_trace(report)}")
 
 
 # ========== SCHEDULER ==========
 
+# Utenti letti per blocco durante il caricamento degli orari all'avvio
+SCHEDULE_CHUNK_SIZE = 500
+
+
 def setup_scheduler(application: Application):
-    """Configura lo scheduler per notifiche automatiche"""
+    """
+    Configura lo scheduler per notifiche automatiche.
+    Gli orari degli utenti li carica load_schedules, in background.
+    """
     scheduler = AsyncIOScheduler(timezone=TZ)
+    application.minute_dispatcher = MinuteDispatcher()
+    # Finché il caricamento è in corso: utenti con orari già aggiornati dagli handler
+    application.schedules_pending = set()
+    application.schedules_ready = asyncio.Event()
     
-    # Schedule check-in per ogni utente
-    users = db.get_all_active_users()
-    for user in users:
-        schedule_user_checkin(scheduler, application, user)
-        schedule_user_reminders(scheduler, application, user)
+    # Leader dello scheduler: solo lui esegue i job qui sotto (vedi coordination.py)
+    application.leader = LeaderLease(
+        adb, SCHEDULER_LEASE, WORKER_ID,
+        ttl=Config.LEASE_TTL_SECONDS, interval=Config.LEASE_HEARTBEAT_SECONDS,
+        on_elected=lambda lease: on_scheduler_elected(application, lease),
+        on_demoted=lambda: on_scheduler_demoted(application)
+    )
+    # Ultima modifica (anche degli altri worker) applicata a orari e cache
+    application.change_seq = 0
+    application.sync_lock = asyncio.Lock()
+    application.pruned_day = None
+    # Appena eletti si riprendono anche le notifiche lasciate a metà dal leader precedente
+    application.takeover_pending = False
+    # In polling gli update li riceve solo il leader (Telegram ammette un solo getUpdates)
+    application.poll_with_leader = False
+    
+    # Un solo job al minuto per tutte le notifiche degli utenti
+    scheduler.add_job(
+        dispatch_notifications,
+        CronTrigger(minute='*', timezone=TZ),
+        args=[application],
+        id='notifications',
+        coalesce=True,
+        misfire_grace_time=30
+    )
+    
+    # Modifiche fatte dagli altri worker: orari, cache, gruppi
+    scheduler.add_job(
+        sync_changes,
+        'interval',
+        seconds=Config.LEASE_HEARTBEAT_SECONDS,
+        args=[application],
+        id='sync_changes',
+        coalesce=True
+    )
+    
+    # Snapshot periodici del database (se è configurata una cartella)
+    if Config.SNAPSHOT_DIR:
+        scheduler.add_job(
+            take_periodic_snapshot,
+            'interval',
+            minutes=Config.SNAPSHOT_INTERVAL_MINUTES,
+            args=[application, SnapshotManager(db.db_path, Config.SNAPSHOT_DIR,
+                                  keep_chains=Config.SNAPSHOT_KEEP_CHAINS,
+                                  full_every=Config.SNAPSHOT_FULL_EVERY)],
+            id='periodic_snapshot',
+            coalesce=True
+        )
+    
+    # Archivio freddo dei log vecchi, ogni lunedì notte
+    if Config.ARCHIVE_AFTER_DAYS:
+        if Config.ARCHIVE_AFTER_DAYS < MIN_HORIZON_DAYS:
+            logger.error(f"ARCHIVE_AFTER_DAYS deve essere almeno {MIN_HORIZON_DAYS}: archiviazione disattivata")
+        else:
+            scheduler.add_job(
+                archive_old_logs,
+                CronTrigger(day_of_week='mon', hour=4, minute=0, timezone=TZ),
+                args=[application],
+                id='archive_logs',
+                coalesce=True
+            )
+    
+    # Riepilogo del tracciamento SQL (se attivo)
+    if db.tracer is not None and Config.SQL_TRACE_LOG_MINUTES:
+        scheduler.add_job(
+            log_sql_trace,
+            'interval',
+            minutes=Config.SQL_TRACE_LOG_MINUTES,
+            id='sql_trace_log',
+            coalesce=True
+        )
     
     # Schedule report settimanale (Domenica alle 20:00)
     scheduler.add_job(
@@ -435,147 +789,505 @@ def setup_scheduler(application: Application):
     return scheduler
 
 
-def schedule_user_checkin(scheduler: AsyncIOScheduler, application: Application, user: dict):
+async def start_background_tasks(application: Application, poll: bool = False):
+    """
+    Avvia il caricamento degli orari e l'elezione del leader senza aspettarli:
+    gli update sono serviti da subito. Con poll=True il polling parte (e si
+    ferma) con la leadership.
+    """
+    application.poll_with_leader = poll
+    application.schedule_loader = asyncio.create_task(load_schedules(application))
+    application.leader.start()
+
+
+async def stop_background_tasks(application: Application):
+    """Allo spegnimento: ferma il caricamento e lascia il lease agli altri worker"""
+    application.schedule_loader.cancel()
+    await application.leader.stop()
+
+
+async def on_scheduler_elected(application: Application, lease: dict):
+    """Diventato leader: riprende dall'ultimo minuto e dalle notifiche non inviate del leader precedente"""
+    if lease['checkpoint']:
+        application.minute_dispatcher.resume_from(datetime.fromisoformat(lease['checkpoint']))
+    application.takeover_pending = True
+    if application.poll_with_leader and not application.updater.running:
+        with PROFILE.phase('polling'):
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        if PROFILE.ready_at is None:
+            PROFILE.ready()
+
+
+async def on_scheduler_demoted(application: Application):
+    """Un altro worker è il leader: smette di ricevere update in polling"""
+    if application.poll_with_leader and application.updater.running:
+        await application.updater.stop()
+
+
+async def load_schedules(application: Application):
+    """
+    Apre il database (migrazioni) e indicizza check-in e reminder degli
+    utenti attivi a blocchi di SCHEDULE_CHUNK_SIZE, cedendo l'event loop
+    tra un blocco e l'altro. Il job delle notifiche aspetta la fine del
+    caricamento e poi recupera i minuti passati nel frattempo.
+    """
+    dispatcher = application.minute_dispatcher
+    try:
+        with PROFILE.phase('database'):
+            await adb.run(db.open, write=True)
+        # Le modifiche da qui in poi le applica sync_changes, anche se già lette nei blocchi
+        application.change_seq = await adb.get_change_seq()
+        
+        start = perf_counter()
+        after_user_id = 0
+        loaded = 0
+        while True:
+            users = await adb.get_active_users_page(after_user_id, SCHEDULE_CHUNK_SIZE)
+            pending = application.schedules_pending
+            for user in users:
+                # Orari cambiati durante il caricamento: l'indice è già più recente del blocco
+                if user['user_id'] in pending:
+                    continue
+                schedule_user_checkin(dispatcher, user)
+                schedule_user_reminders(dispatcher, user)
+            loaded += len(users)
+            if len(users) < SCHEDULE_CHUNK_SIZE:
+                break
+            after_user_id = users[-1]['user_id']
+        PROFILE.record('schedules', start, f"{loaded} utenti")
+    except Exception as e:
+        logger.error(f"Errore caricamento orari degli utenti: {e}")
+    finally:
+        application.schedules_pending = None
+        application.schedules_ready.set()
+    
+    logger.info(f"Avvio: {PROFILE.summary()}")
+
+
+def mark_rescheduled(application: Application, user: dict):
+    """Durante il caricamento: l'utente ha già orari aggiornati, il suo blocco non li tocca"""
+    pending = getattr(application, 'schedules_pending', None)
+    if pending is not None:
+        pending.add(user['user_id'])
+        schedule_user_checkin(application.minute_dispatcher, user)
+        schedule_user_reminders(application.minute_dispatcher, user)
+
+
+def schedule_user_checkin(dispatcher: MinuteDispatcher, user: dict):
     """Schedula check-in per un utente specifico"""
     if not user['checkin_time']:
         return
     
-    hour, minute = map(int, user['checkin_time'].split(':'))
-    
-    scheduler.add_job(
-        send_user_checkin,
-        CronTrigger(hour=hour, minute=minute, timezone=TZ),
-        args=[application, user['user_id']],
-        id=f"checkin_{user['user_id']}",
-        replace_existing=True
-    )
+    dispatcher.set_time(CHECKIN, user['user_id'], user['checkin_time'])
 
 
-def schedule_user_reminders(scheduler: AsyncIOScheduler, application: Application, user: dict):
+def schedule_user_reminders(dispatcher: MinuteDispatcher, user: dict):
     """Schedula reminder per un utente specifico"""
     if not user['reminder_start'] or not user['reminder_end']:
         return
     
-    # Reminder inizio
-    hour_start, minute_start = map(int, user['reminder_start'].split(':'))
-    scheduler.add_job(
-        send_start_reminder,
-        CronTrigger(hour=hour_start, minute=minute_start, timezone=TZ),
-        args=[application, user['user_id']],
-        id=f"reminder_start_{user['user_id']}",
-        replace_existing=True
-    )
-    
-    # Reminder fine
-    hour_end, minute_end = map(int, user['reminder_end'].split(':'))
-    scheduler.add_job(
-        send_end_reminder,
-        CronTrigger(hour=hour_end, minute=minute_end, timezone=TZ),
-        args=[application, user['user_id']],
-        id=f"reminder_end_{user['user_id']}",
-        replace_existing=True
-    )
+    dispatcher.set_time(REMINDER_START, user['user_id'], user['reminder_start'])
+    dispatcher.set_time(REMINDER_END, user['user_id'], user['reminder_end'])
 
 
-def reschedule_user_checkin(application: Application, user_id: int):
+async def reschedule_user_checkin(application: Application, user_id: int):
     """Rischedula check-in per un utente dopo cambio orario"""
-    user = db.get_user(user_id)
-    if user and hasattr(application, 'scheduler'):
-        schedule_user_checkin(application.scheduler, application, user)
+    user = await adb.get_user(user_id)
+    if user and hasattr(application, 'minute_dispatcher'):
+        schedule_user_checkin(application.minute_dispatcher, user)
+        mark_rescheduled(application, user)
 
 
-def reschedule_user_reminders(application: Application, user_id: int):
+async def reschedule_user_reminders(application: Application, user_id: int):
     """Rischedula reminder per un utente dopo cambio orari"""
-    user = db.get_user(user_id)
-    if user and hasattr(application, 'scheduler'):
-        schedule_user_reminders(application.scheduler, application, user)
+    user = await adb.get_user(user_id)
+    if user and hasattr(application, 'minute_dispatcher'):
+        schedule_user_reminders(application.minute_dispatcher, user)
+        mark_rescheduled(application, user)
+
+
+async def sync_changes(application: Application):
+    """
+    Applica le modifiche registrate in change_log (anche dagli altri worker):
+    la cache utenti e report la aggiorna Database.sync_changes, qui orari e gruppi.
+    """
+    await application.schedules_ready.wait()
+    async with application.sync_lock:
+        application.change_seq, changes = await adb.sync_changes(application.change_seq)
+        
+        users = {entity_id for entity, entity_id in changes if entity == 'user'}
+        for user_id in users:
+            user = await adb.get_user(user_id)
+            if user and user['is_active']:
+                schedule_user_checkin(application.minute_dispatcher, user)
+                schedule_user_reminders(application.minute_dispatcher, user)
+            else:
+                application.minute_dispatcher.remove_user(user_id)
+        if any(entity == 'group' for entity, _ in changes):
+            group_registry.invalidate()
+    
+    # Una volta al giorno il leader toglie le notifiche e le modifiche vecchie
+    today = datetime.now(TZ).date()
+    if application.leader.is_leader and application.pruned_day != today:
+        application.pruned_day = today
+        await adb.prune_coordination()
+
+
+async def dispatch_notifications(application: Application):
+    """Job al minuto: invia check-in e reminder in scadenza (solo sul leader)"""
+    leader = application.leader
+    if not leader.is_leader:
+        return
+    # All'avvio: prima tutti gli orari, poi i minuti (anche quelli passati nell'attesa)
+    await application.schedules_ready.wait()
+    # Orari cambiati sugli altri worker
+    await sync_changes(application)
+    dispatcher = application.minute_dispatcher
+    senders = {
+        CHECKIN: send_user_checkin,
+        REMINDER_START: send_start_reminder,
+        REMINDER_END: send_end_reminder,
+    }
+    
+    now = datetime.now(TZ)
+    minutes = dispatcher.minutes_to_dispatch(now)
+    claimed = []
+    if minutes:
+        due = []
+        for minute in minutes:
+            day = scheduled_at(now, minute).date().isoformat()
+            for kind in senders:
+                for user_id in dispatcher.due(kind, minute):
+                    due.append((day, minute, kind, user_id))
+        
+        # Solo le notifiche che nessun altro ha già preso in carico, e solo se il lease è ancora nostro
+        claimed = await adb.claim_notifications(
+            SCHEDULER_LEASE, leader.holder, due,
+            checkpoint=now.replace(second=0, microsecond=0).isoformat()
+        )
+        if claimed is None:
+            logger.warning(f"Lease {SCHEDULER_LEASE} perso: {len(due)} notifiche lasciate al nuovo leader")
+            return
+    
+    # Invii falliti da riprovare e, dopo un cambio di leader, quelli che il precedente non ha concluso
+    takeover = application.takeover_pending
+    retried = await adb.reclaim_notifications(
+        SCHEDULER_LEASE, leader.holder, NOTIFICATION_RETRY_SECONDS, takeover=takeover
+    )
+    if retried is None:
+        return
+    if takeover:
+        application.takeover_pending = False
+    if retried:
+        logger.info(f"{len(retried)} notifiche non inviate riprese")
+    
+    tasks = []
+    for claim in claimed:
+        day, minute, kind, user_id = claim
+        SCHEDULER_LAG.labels(kind).observe(scheduler_lag(now, minute))
+        tasks.append(notification_status(claim, senders[kind](application, user_id)))
+    for claim in retried:
+        day, minute, kind, target_id = claim
+        if kind == WEEKLY_REPORT:
+            tasks.append(notification_status(claim, resend_weekly_report(application, target_id, day)))
+        else:
+            tasks.append(notification_status(claim, senders[kind](application, target_id)))
+    if not tasks:
+        return
+    
+    results = await asyncio.gather(*tasks)
+    await adb.finish_notifications(leader.holder, list(zip(claimed + retried, results)),
+                                   max_attempts=NOTIFICATION_MAX_ATTEMPTS)
+
+
+async def notification_status(claim: tuple, sending) -> str:
+    """
+    Esito di un invio per notification_log: 'sent' (o quello restituito),
+    'failed' se il destinatario ha bloccato il bot, 'released' (da
+    riprovare) per gli altri errori.
+    """
+    try:
+        return await sending or 'sent'
+    except Forbidden:
+        return 'failed'
+    except Exception as e:
+        day, minute, kind, target_id = claim
+        logger.error(f"Errore invio {kind} delle {minute} a {target_id}: {e}")
+        return 'released'
+
+
+def scheduled_at(now: datetime, minute: str) -> datetime:
+    """Ultimo istante passato con orario HH:MM (ieri se oggi non è ancora arrivato)"""
+    hour, minute = map(int, minute.split(':'))
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if scheduled > now:
+        scheduled -= timedelta(days=1)
+    return scheduled
+
+
+def scheduler_lag(now: datetime, minute: str) -> float:
+    """Secondi tra l'orario previsto (HH:MM, ultimo passato) e now"""
+    return (now - scheduled_at(now, minute)).total_seconds()
 
 
 async def send_user_checkin(application: Application, user_id: int):
     """Invia check-in automatico ad un utente"""
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     if not user:
         return
     
-    # Invia in privato all'utente
-    try:
-        await send_checkin_message(user_id, user_id, application)
-    except Exception as e:
-        logger.error(f"Errore invio check-in a {user_id}: {e}")
+    # Invia in privato all'utente (gli errori li registra notification_status)
+    await send_checkin_message(user_id, user_id, application, priority=PRIORITY_BULK)
 
 
 async def send_start_reminder(application: Application, user_id: int):
     """Invia reminder inizio studio"""
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     if not user:
         return
     
-    try:
-        await application.bot.send_message(
-            chat_id=user_id,
-            text=f"⏰ Reminder: È ora di studiare! 💪"
-        )
-    except Exception as e:
-        logger.error(f"Errore invio reminder start a {user_id}: {e}")
+    await application.bot.send_message(
+        chat_id=user_id,
+        text=f"⏰ Reminder: È ora di studiare! 💪",
+        rate_limit_args=PRIORITY_BULK
+    )
 
 
 async def send_end_reminder(application: Application, user_id: int):
     """Invia reminder fine studio"""
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     if not user:
         return
     
+    await application.bot.send_message(
+        chat_id=user_id,
+        text=f"⏱️ Session terminata! Ricorda il check-in alle {user['checkin_time']}",
+        rate_limit_args=PRIORITY_BULK
+    )
+
+
+async def send_weekly_report_to_all(application: Application):
+    """Invia report settimanale a tutti i gruppi attivi (solo sul leader, una volta per gruppo)"""
+    leader = application.leader
+    if not leader.is_leader:
+        return
+    
+    # Membri aggiunti dagli altri worker
+    group_registry.invalidate()
+    groups = await group_registry.groups()
+    # Il gruppo principale riceve il report di tutti anche senza membri registrati
+    if Config.ALLOWED_GROUP_ID:
+        groups.setdefault(int(Config.ALLOWED_GROUP_ID), set())
+    if not groups:
+        logger.info("Nessun gruppo registrato: report settimanale non inviato")
+        return
+    
+    day = datetime.now(TZ).date().isoformat()
+    claimed = await adb.claim_notifications(
+        SCHEDULER_LEASE, leader.holder,
+        [(day, Config.WEEKLY_REPORT_TIME, WEEKLY_REPORT, chat_id) for chat_id in groups]
+    )
+    if not claimed:
+        return
+    
+    # Statistiche di tutti gli utenti in una sola query, poi divise per gruppo
+    week_start, week_end = db.get_week_dates()
+    token = db.report_cache.load_token()
+    all_users = await adb.get_all_users_weekly_stats(week_start, week_end)
+    semaphore = asyncio.Semaphore(Config.REPORT_SEND_CONCURRENCY)
+    
+    async def send_to_group(claim: tuple) -> str:
+        chat_id = claim[3]
+        async with semaphore:
+            return await notification_status(claim, send_group_report(
+                application, chat_id, groups[chat_id], week_start, week_end, all_users, token
+            ))
+    
+    results = await asyncio.gather(*(send_to_group(claim) for claim in claimed))
+    await adb.finish_notifications(leader.holder, list(zip(claimed, results)),
+                                   max_attempts=NOTIFICATION_MAX_ATTEMPTS)
+    logger.info(f"Report settimanale inviato a {results.count('sent')}/{len(claimed)} gruppi")
+
+
+async def resend_weekly_report(application: Application, chat_id: int, day: str) -> str:
+    """Nuovo tentativo di invio del report della settimana di day (ripreso da notification_log)"""
+    groups = await group_registry.groups()
+    if Config.ALLOWED_GROUP_ID:
+        groups.setdefault(int(Config.ALLOWED_GROUP_ID), set())
+    if chat_id not in groups:
+        return 'skipped'
+    
+    monday = date.fromisoformat(day) - timedelta(days=date.fromisoformat(day).weekday())
+    week_start, week_end = monday.isoformat(), (monday + timedelta(days=6)).isoformat()
+    token = db.report_cache.load_token()
+    all_users = await adb.get_all_users_weekly_stats(week_start, week_end)
+    return await send_group_report(application, chat_id, groups[chat_id], week_start, week_end, all_users, token)
+
+
+async def send_group_report(application: Application, chat_id: int, members: set,
+                            week_start: str, week_end: str, all_users: list, token: int) -> str:
+    """
+    Salva e invia il report della settimana ad un gruppo: 'sent', 'skipped'
+    se nessun utente del gruppo, 'failed' se il bot non è più nel gruppo.
+    Gli altri errori di invio li gestisce notification_status.
+    """
+    if members:
+        users = [stats for stats in all_users if stats['user_id'] in members]
+    elif Config.ALLOWED_GROUP_ID and chat_id == int(Config.ALLOWED_GROUP_ID):
+        users = all_users
+    else:
+        users = []
+    if not users:
+        return 'skipped'
+    # Report del gruppo o, per il gruppo principale senza membri, quello di tutti (come /weekly)
+    report_chat_id = chat_id if members else None
+    
+    report = reports.build_report(users, week_start, week_end)
+    previous = await adb.get_weekly_report(report_chat_id, previous_week_start(week_start), rows=False)
+    message = reports.render_report(report, previous)
+    db.report_cache.put(report_chat_id, week_start, message, token)
+    await adb.save_weekly_report(report, chat_id=report_chat_id)
+    
     try:
         await application.bot.send_message(
-            chat_id=user_id,
-            text=f"⏱️ Session terminata! Ricorda il check-in alle {user['checkin_time']}"
+            chat_id=chat_id,
+            text=message,
+            rate_limit_args=PRIORITY_BULK
         )
-    except Exception as e:
-        logger.error(f"Errore invio reminder end a {user_id}: {e}")
+    except Forbidden:
+        # Il bot non è più nel gruppo
+        await group_registry.remove_group(chat_id)
+        return 'failed'
+    return 'sent'
 
 
-async def send_weekly_report_to_all(application: Application):
-    """Invia report settimanale a tutti i gruppi attivi"""
-    # Per ora invia nel gruppo principale
-    # TODO: Gestire multipli gruppi se necessario
-    users = db.get_all_active_users()
-    if users:
-        # Prendi il primo utente per ottenere un chat_id valido
-        # In produzione, salva i chat_id dei gruppi nel database
-        pass
+# ========== GRUPPI ==========
+
+async def track_group_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Registra i gruppi e i loro membri dai messaggi (gira prima degli altri handler)"""
+    chat = update.effective_chat
+    message = update.effective_message
+    if chat is None or message is None:
+        return
+    
+    # Gruppo diventato supergruppo: cambia chat_id
+    if message.migrate_to_chat_id:
+        await group_registry.migrate_group(chat.id, message.migrate_to_chat_id)
+        return
+    
+    if message.left_chat_member:
+        await group_registry.remove_member(chat.id, message.left_chat_member.id)
+        return
+    
+    users = list(message.new_chat_members or [])
+    if update.effective_user:
+        users.append(update.effective_user)
+    for user in users:
+        if not user.is_bot:
+            await group_registry.add_member(chat.id, user.id, chat.title)
+
+
+async def track_bot_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Bot aggiunto o rimosso da un gruppo"""
+    member_update = update.my_chat_member
+    chat = member_update.chat
+    if chat.type not in (Chat.GROUP, Chat.SUPERGROUP):
+        return
+    
+    status = member_update.new_chat_member.status
+    if status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER):
+        await group_registry.add_group(chat.id, chat.title)
+    elif status in (ChatMember.LEFT, ChatMember.BANNED):
+        await group_registry.remove_group(chat.id)
 
 
 # ========== MAIN ==========
 
+def callback_step(update: Update) -> str:
+    """Nome dello step del check-in (per le metriche) dal callback_data"""
+    step = checkin_flow.peek_step(update.callback_query.data)
+    return f'button:{step}' if step else 'button:other'
+
+
+def instrumented(callback, name: Optional[str] = None):
+    """Registra durata ed errori dell'handler (nome fisso o, per i bottoni, lo step)"""
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        label = name or callback_step(update)
+        PROFILE.first_update()
+        start = perf_counter()
+        # Con il tracciamento SQL attivo le query dell'handler sono contate per label
+        tracing = db.tracer.request(label) if db.tracer is not None else contextlib.nullcontext()
+        try:
+            with tracing:
+                return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.labels(label).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(label).observe(perf_counter() - start)
+
+    return wrapper
+
+
+def build_application(rate_limiter: Optional[PriorityRateLimiter] = None) -> Application:
+    """Crea l'Application con tutti gli handler registrati"""
+    # Tutte le chiamate alla Bot API passano dalla coda con limiti e priorità
+    builder = (
+        Application.builder()
+        .token(Config.BOT_TOKEN)
+        .rate_limiter(rate_limiter or PriorityRateLimiter())
+        # Più connessioni HTTP: gli invii in parallelo non si mettono in fila su una sola
+        .connection_pool_size(Config.BOT_API_CONNECTIONS)
+        # Un update lento (es. /weekly) non blocca quelli dietro di lui nella coda
+        .concurrent_updates(Config.CONCURRENT_UPDATES)
+    )
+    if Config.BOT_API_BASE_URL:
+        builder = builder.base_url(Config.BOT_API_BASE_URL)
+    application = builder.build()
+    
+    # Registro dei gruppi: gira prima degli altri handler senza fermarli
+    application.add_handler(MessageHandler(filters.ChatType.GROUPS, track_group_activity), group=-1)
+    application.add_handler(ChatMemberHandler(track_bot_membership, ChatMemberHandler.MY_CHAT_MEMBER))
+    
+    # Registra handler
+    application.add_handler(CommandHandler("start", instrumented(start_command, "/start")))
+    application.add_handler(CommandHandler("help", instrumented(help_command, "/help")))
+    application.add_handler(CommandHandler("setgoal", instrumented(setgoal_command, "/setgoal")))
+    application.add_handler(CommandHandler("settime", instrumented(settime_command, "/settime")))
+    application.add_handler(CommandHandler("setreminders", instrumented(setreminders_command, "/setreminders")))
+    application.add_handler(CommandHandler("checkin", instrumented(checkin_command, "/checkin")))
+    application.add_handler(CommandHandler("skip", instrumented(skip_command, "/skip")))
+    application.add_handler(CommandHandler("mystats", instrumented(mystats_command, "/mystats")))
+    application.add_handler(CommandHandler("weekly", instrumented(weekly_command, "/weekly")))
+    application.add_handler(CommandHandler("leaderboard", instrumented(leaderboard_command, "/leaderboard")))
+    application.add_handler(CommandHandler("backup", instrumented(backup_command, "/backup")))
+    application.add_handler(CommandHandler("export", instrumented(export_command, "/export")))
+    application.add_handler(CommandHandler("sqltrace", instrumented(sqltrace_command, "/sqltrace")))
+    application.add_handler(CallbackQueryHandler(instrumented(button_callback)))
+    
+    return application
+
+
 def main():
-    """Avvia il bot"""
+    """
+    Avvia il bot come run.py (stesso percorso del deploy): in polling riceve
+    gli update solo il worker leader, gli altri restano in attesa del lease
+    """
+    # Import qui: run importa bot
+    import run
+    
     if not Config.validate_token():
         logger.error("❌ BOT_TOKEN non configurato! Controlla il file .env")
         return
+    if not Config.validate_webhook():
+        logger.error("❌ WEBHOOK_SECRET non configurato: in modalità webhook è obbligatorio")
+        return
     
-    # Crea application
-    application = Application.builder().token(Config.BOT_TOKEN).build()
-    
-    # Setup scheduler
-    scheduler = setup_scheduler(application)
-    application.scheduler = scheduler
-    
-    # Registra handler
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("setgoal", setgoal_command))
-    application.add_handler(CommandHandler("settime", settime_command))
-    application.add_handler(CommandHandler("setreminders", setreminders_command))
-    application.add_handler(CommandHandler("checkin", checkin_command))
-    application.add_handler(CommandHandler("skip", skip_command))
-    application.add_handler(CommandHandler("mystats", mystats_command))
-    application.add_handler(CommandHandler("weekly", weekly_command))
-    application.add_handler(CommandHandler("backup", backup_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    
-    # Avvia bot
-    logger.info("🚀 Bot avviato!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    asyncio.run(run.serve())
+
+
+PROFILE.record('import', PROFILE.origin)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+"""
+Check-in giornaliero come macchina a stati dichiarativa, senza stato sul server.
+
+Ogni passo (STEPS) dichiara domanda, opzioni e passo successivo. Le
+risposte date fin qui viaggiano nel callback_data dei bottoni: chi
+riceve il click trova nel bottone stesso utente, data del check-in,
+istante di inizio e scelte precedenti, quindi qualsiasi processo può
+gestire qualsiasi passo (dispatch O(1) sul codice del passo).
+
+Formato del callback_data (base64 url-safe, 32 caratteri, limite Telegram 64 byte):
+
+    versione/passo  1 byte   (4 bit versione, 4 bit indice del passo risposto)
+    user_id         8 byte
+    data            2 byte   (giorni dal 2020-01-01)
+    inizio          4 byte   (minuti dal 1970, per la scadenza)
+    scelte          1 byte   (indice+1 dell'opzione scelta per ogni passo, 0 = non ancora)
+    firma           8 byte   (HMAC-SHA256 troncato, chiave derivata dal token del bot)
+
+La firma impedisce di costruire a mano un callback con risposte o utente
+diversi: i bottoni validi sono solo quelli generati dal bot.
+"""
+import base64
+import hashlib
+import hmac
+import struct
+import time
+from datetime import date
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+VERSION = 1
+EPOCH = date(2020, 1, 1).toordinal()
+SIGNATURE_SIZE = 8
+_PAYLOAD = struct.Struct('>BqHIB')
+CALLBACK_DATA_LENGTH = len(base64.urlsafe_b64encode(bytes(_PAYLOAD.size + SIGNATURE_SIZE)))
+
+
+class Step(NamedTuple):
+    question: str
+    options: Tuple[Tuple[str, object], ...]   # (etichetta del bottone, valore)
+    rows: Tuple[int, ...]                     # bottoni per riga
+    next: Dict[object, Optional[str]]         # valore scelto -> passo successivo (None = fine)
+    default_next: Optional[str] = None
+
+
+# Passi del check-in, nell'ordine in cui compaiono le scelte nel callback_data
+STEPS: Dict[str, Step] = {
+    'should_study': Step(
+        question="1️⃣ Dovevi studiare oggi?",
+        options=(("Sì", True), ("No - giorno libero", False)),
+        rows=(2,),
+        next={True: 'hours', False: None},
+    ),
+    'hours': Step(
+        question="2️⃣ Quante ore hai studiato?",
+        options=(("0h", 0.0), ("0.5h", 0.5), ("1h", 1.0), ("1.5h", 1.5),
+                 ("2h", 2.0), ("2.5h", 2.5), ("3h+", 3.0)),
+        rows=(3, 3, 1),
+        next={},
+        default_next='distraction',
+    ),
+    'distraction': Step(
+        question="3️⃣ Livello di distrazione?",
+        options=(("Basso 💪", 'low'), ("Medio 😅", 'medium'), ("Alto 😞", 'high')),
+        rows=(2, 1),
+        next={},
+    ),
+}
+FIRST_STEP = 'should_study'
+
+STEP_ORDER = tuple(STEPS)
+STEP_INDEX = {name: index for index, name in enumerate(STEP_ORDER)}
+# Bit usati da ogni passo nel byte delle scelte
+_BITS = tuple(len(step.options).bit_length() for step in STEPS.values())
+assert sum(_BITS) <= 8, "le scelte devono stare in un byte"
+
+
+class InvalidCallback(ValueError):
+    """callback_data non generato dal bot, malformato o di un'altra versione"""
+
+
+class ExpiredCallback(ValueError):
+    """Check-in iniziato da più di ttl secondi"""
+
+
+class CheckinAnswers(NamedTuple):
+    user_id: int
+    date: date
+    started_at: int                           # minuti dal 1970
+    choices: Tuple[Optional[int], ...]        # indice dell'opzione scelta per passo
+
+    def value(self, step: str):
+        """Valore scelto per il passo (None se non ancora risposto)"""
+        choice = self.choices[STEP_INDEX[step]]
+        return None if choice is None else STEPS[step].options[choice][1]
+
+    def answer(self, step: str, option: int) -> 'CheckinAnswers':
+        choices = list(self.choices)
+        choices[STEP_INDEX[step]] = option
+        return self._replace(choices=tuple(choices))
+
+
+def signing_key(bot_token: str) -> bytes:
+    """Chiave HMAC dei bottoni: uguale per tutti i processi con lo stesso token"""
+    return hashlib.sha256(b'checkin-callback:' + bot_token.encode('utf-8')).digest()
+
+
+def start(user_id: int, day: date, now: Optional[float] = None) -> CheckinAnswers:
+    """Nuovo check-in senza risposte"""
+    now = time.time() if now is None else now
+    return CheckinAnswers(user_id, day, int(now // 60), (None,) * len(STEP_ORDER))
+
+
+def next_step(step: str, answers: CheckinAnswers) -> Optional[str]:
+    """Passo successivo dopo aver risposto a step (None = check-in completo)"""
+    spec = STEPS[step]
+    return spec.next.get(answers.value(step), spec.default_next)
+
+
+def option_index(step: str, value) -> int:
+    """Indice dell'opzione con quel valore (per costruire bottoni a mano, es. nei test di carico)"""
+    for index, (_, option_value) in enumerate(STEPS[step].options):
+        if option_value == value:
+            return index
+    raise ValueError(f"{step}: opzione {value!r} inesistente")
+
+
+def _pack_choices(choices: Tuple[Optional[int], ...]) -> int:
+    packed = 0
+    for choice, bits in zip(choices, _BITS):
+        packed = (packed << bits) | (0 if choice is None else choice + 1)
+    return packed
+
+
+def _unpack_choices(packed: int) -> Tuple[Optional[int], ...]:
+    choices = []
+    for bits, step in zip(reversed(_BITS), reversed(STEP_ORDER)):
+        value = packed & ((1 << bits) - 1)
+        packed >>= bits
+        if value > len(STEPS[step].options):
+            raise InvalidCallback("scelta fuori intervallo")
+        choices.append(None if value == 0 else value - 1)
+    return tuple(reversed(choices))
+
+
+def encode(step: str, option: int, answers: CheckinAnswers, key: bytes) -> str:
+    """callback_data del bottone 'option' al passo 'step'"""
+    answers = answers.answer(step, option)
+    payload = _PAYLOAD.pack(
+        (VERSION << 4) | STEP_INDEX[step],
+        answers.user_id,
+        answers.date.toordinal() - EPOCH,
+        answers.started_at,
+        _pack_choices(answers.choices),
+    )
+    signature = hmac.new(key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    return base64.urlsafe_b64encode(payload + signature).decode('ascii')
+
+
+def decode(data: str, key: bytes, ttl: Optional[float] = None,
+           now: Optional[float] = None) -> Tuple[str, CheckinAnswers]:
+    """
+    (passo risposto, risposte compresa quella del bottone) dal callback_data.
+    InvalidCallback se non è un bottone del check-in, ExpiredCallback se è scaduto.
+    """
+    if len(data) != CALLBACK_DATA_LENGTH:
+        raise InvalidCallback("lunghezza non valida")
+    try:
+        raw = base64.urlsafe_b64decode(data.encode('ascii'))
+    except (ValueError, UnicodeEncodeError):
+        raise InvalidCallback("base64 non valido")
+
+    payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    expected = hmac.new(key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidCallback("firma non valida")
+
+    header, user_id, day, started_at, packed = _PAYLOAD.unpack(payload)
+    if header >> 4 != VERSION or (header & 0x0F) >= len(STEP_ORDER):
+        raise InvalidCallback("versione o passo sconosciuti")
+    step = STEP_ORDER[header & 0x0F]
+    answers = CheckinAnswers(user_id, date.fromordinal(EPOCH + day), started_at,
+                             _unpack_choices(packed))
+    if answers.choices[STEP_INDEX[step]] is None:
+        raise InvalidCallback("passo senza risposta")
+
+    now = time.time() if now is None else now
+    if ttl is not None and now - started_at * 60 > ttl:
+        raise ExpiredCallback("check-in scaduto")
+    return step, answers
+
+
+def peek_step(data: str) -> Optional[str]:
+    """Passo a cui risponde il bottone, senza verificare la firma (per metriche e log)"""
+    try:
+        header = base64.urlsafe_b64decode(data[:4].encode('ascii'))[0]
+    except (ValueError, UnicodeEncodeError, IndexError):
+        return None
+    index = header & 0x0F
+    if len(data) != CALLBACK_DATA_LENGTH or header >> 4 != VERSION or index >= len(STEP_ORDER):
+        return None
+    return STEP_ORDER[index]
+
+
+def keyboard(step: str, answers: CheckinAnswers, key: bytes) -> InlineKeyboardMarkup:
+    """Bottoni del passo, ognuno con le risposte precedenti più la propria"""
+    spec = STEPS[step]
+    buttons = [
+        InlineKeyboardButton(label, callback_data=encode(step, index, answers, key))
+        for index, (label, _) in enumerate(spec.options)
+    ]
+    rows = []
+    for size in spec.rows:
+        rows.append(buttons[:size])
+        buttons = buttons[size:]
+    return InlineKeyboardMarkup(rows)
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import FrozenSet, Optional
 
 class Config:
     """Configurazione del bot"""
@@ -10,15 +10,75 @@ class Config:
     # ID del gruppo dove opera il bot (opzionale, per limitare l'uso)
     ALLOWED_GROUP_ID: Optional[int] = os.getenv('ALLOWED_GROUP_ID', None)
     
+    # ID Telegram degli amministratori, separati da virgola: solo loro possono
+    # usare /backup, /export e /sqltrace (vuoto = nessuno)
+    ADMIN_USER_IDS: FrozenSet[int] = frozenset(
+        int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()
+    )
+    
+    # URL della Bot API (vuoto = Telegram). Utile per test con un server locale
+    BOT_API_BASE_URL: str = os.getenv('BOT_API_BASE_URL', '')
+    
+    # Webhook: se attivo gli update arrivano via HTTP su run.py invece che con il polling
+    WEBHOOK_MODE: bool = os.getenv('WEBHOOK_MODE', '0') == '1'
+    # URL pubblico registrato su Telegram (es: https://mio-bot.onrender.com/telegram)
+    # Se vuoto il webhook non viene registrato (per provarlo in locale)
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', '/telegram')
+    # Obbligatorio con WEBHOOK_MODE=1: le richieste senza questo secret vengono rifiutate
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', '')
+    # Update in coda oltre i quali si risponde 503 e Telegram riprova più tardi
+    WEBHOOK_MAX_PENDING: int = int(os.getenv('WEBHOOK_MAX_PENDING', 1000))
+    
     # Timezone
     TIMEZONE: str = 'Europe/Rome'
     
     # Database
     DB_PATH: str = os.getenv('DB_PATH', 'study_bot.db')
     
+    # Secondi dopo i quali i bottoni di un check-in non concluso scadono
+    CHECKIN_TTL: int = int(os.getenv('CHECKIN_TTL', os.getenv('CHECKIN_STATE_TTL', 6 * 3600)))
+    
+    # Write-behind: check-in e impostazioni committati a gruppi ogni
+    # WRITE_BATCH_DELAY_MS millisecondi o ogni WRITE_BATCH_MAX_SIZE scritture
+    WRITE_BEHIND: bool = os.getenv('WRITE_BEHIND', '1') == '1'
+    WRITE_BATCH_DELAY_MS: int = int(os.getenv('WRITE_BATCH_DELAY_MS', 5))
+    WRITE_BATCH_MAX_SIZE: int = int(os.getenv('WRITE_BATCH_MAX_SIZE', 100))
+    
+    # Più worker sullo stesso database: solo il leader (chi tiene il lease)
+    # esegue lo scheduler e, in polling, riceve gli update
+    WORKER_ID: str = os.getenv('WORKER_ID', '')
+    LEASE_TTL_SECONDS: int = int(os.getenv('LEASE_TTL_SECONDS', 30))
+    LEASE_HEARTBEAT_SECONDS: int = int(os.getenv('LEASE_HEARTBEAT_SECONDS', 10))
+    
+    # Archivio freddo: log più vecchi di ARCHIVE_AFTER_DAYS giorni spostati
+    # in ARCHIVE_DIR, un file per anno (0 = archiviazione disattivata)
+    ARCHIVE_DIR: str = os.getenv('ARCHIVE_DIR', 'archive')
+    ARCHIVE_AFTER_DAYS: int = int(os.getenv('ARCHIVE_AFTER_DAYS', 0))
+    
+    # Tracciamento SQL (tempi per metodo, statement lenti, commit per richiesta):
+    # /sqltrace e un riepilogo nel log ogni SQL_TRACE_LOG_MINUTES minuti (0 = mai)
+    SQL_TRACE: bool = os.getenv('SQL_TRACE', '0') == '1'
+    SQL_TRACE_SLOW_QUERIES: int = int(os.getenv('SQL_TRACE_SLOW_QUERIES', 20))
+    SQL_TRACE_LOG_MINUTES: int = int(os.getenv('SQL_TRACE_LOG_MINUTES', 15))
+    
+    # Snapshot periodici del database (vuoto = disattivati)
+    SNAPSHOT_DIR: str = os.getenv('SNAPSHOT_DIR', '')
+    SNAPSHOT_INTERVAL_MINUTES: int = int(os.getenv('SNAPSHOT_INTERVAL_MINUTES', 60))
+    # Catene (full + delta) da tenere e delta prima di un nuovo full
+    SNAPSHOT_KEEP_CHAINS: int = int(os.getenv('SNAPSHOT_KEEP_CHAINS', 4))
+    SNAPSHOT_FULL_EVERY: int = int(os.getenv('SNAPSHOT_FULL_EVERY', 24))
+    
     # Giorno report settimanale (0=Lunedì, 6=Domenica)
     WEEKLY_REPORT_DAY: int = 6  # Domenica
     WEEKLY_REPORT_TIME: str = "20:00"
+    # Gruppi a cui il report viene inviato in parallelo
+    REPORT_SEND_CONCURRENCY: int = int(os.getenv('REPORT_SEND_CONCURRENCY', 5))
+    
+    # Connessioni HTTP verso la Bot API
+    BOT_API_CONNECTIONS: int = int(os.getenv('BOT_API_CONNECTIONS', 8))
+    # Update elaborati in parallelo (1 = uno alla volta, in ordine di arrivo)
+    CONCURRENT_UPDATES: int = int(os.getenv('CONCURRENT_UPDATES', 8))
     
     # Messaggi
     WELCOME_MESSAGE = """
@@ -48,18 +108,28 @@ Comandi disponibili:
 
 **Uso quotidiano:**
 • /checkin - Check-in manuale
-• /mystats - Le tue statistiche personali
+• /mystats - Le tue statistiche personali (settimana)
+• /mystats [mese|trimestre|anno|tutto] - Serie, medie e andamento nel tempo
 • /skip - Salta il check-in di oggi (giorno libero)
 
 **Report:**
 • /weekly - Mostra report settimanale
+• /weekly [AAAA-MM-GG] - Report di una settimana passata
+• /leaderboard [ore|obiettivo] - Classifica della settimana
 • /help - Mostra questo messaggio
 
 **Admin:**
-• /backup - Scarica backup database (solo in privato)
+• /backup - Scarica backup database (solo admin, in privato)
+• /export [tabella] [csv|jsonl] [dal] [al] [user_id] - Esporta i dati (solo admin, in privato)
+• /sqltrace [reset] - Tempi delle query e statement lenti, con SQL_TRACE=1 (solo admin, in privato)
 """
 
     @staticmethod
     def validate_token() -> bool:
         """Verifica che il token sia configurato"""
         return bool(Config.BOT_TOKEN and Config.BOT_TOKEN != '')
+    
+    @staticmethod
+    def validate_webhook() -> bool:
+        """In modalità webhook il secret è obbligatorio: senza, chiunque potrebbe inviare update falsi"""
+        return not Config.WEBHOOK_MODE or bool(Config.WEBHOOK_SECRET)
@@ -0,0 +1,116 @@
+"""
+Elezione del leader tra più worker che condividono lo stesso database.
+
+Ogni worker prova a prendere (o rinnovare) il lease ogni `interval`
+secondi; il lease scade dopo `ttl` secondi senza rinnovo, e allora lo
+prende il primo worker che ci riprova (failover). Solo il leader esegue
+i job dello scheduler (notifiche, report, snapshot, archivio).
+
+Il lease da solo non basta per l'invio una volta sola: un leader fermo
+(es. GC, disco lento) può non accorgersi di averlo perso. Per questo le
+notifiche vengono prese in carico con Database.claim_notifications, che
+controlla il lease nella stessa transazione e registra ogni notifica in
+notification_log: due leader non prendono mai in carico la stessa notifica.
+L'esito dell'invio resta sulla riga (finish_notifications): gli invii
+falliti e quelli che un leader caduto non ha concluso li riprende
+Database.reclaim_notifications, quindi ogni notifica arriva almeno una volta.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id() -> str:
+    """Nome del worker: host e pid (unico anche con più processi sulla stessa macchina)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderLease:
+    """
+    Lease 'name' sul database, rinnovato in background.
+    on_elected(lease) e on_demoted() vengono chiamate ad ogni cambio di ruolo.
+    """
+
+    def __init__(self, adb: AsyncDatabase, name: str, holder: str,
+                 ttl: float = 30.0, interval: float = 10.0,
+                 on_elected: Optional[Callable[[Dict], Awaitable[None]]] = None,
+                 on_demoted: Optional[Callable[[], Awaitable[None]]] = None):
+        if interval >= ttl:
+            raise ValueError("L'intervallo di rinnovo deve essere più corto della durata del lease")
+        self.adb = adb
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.interval = interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        # Ultimo lease letto dal database
+        self.lease: Optional[Dict] = None
+        self._leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """True se il lease è nostro e non ancora scaduto (anche se il rinnovo è in ritardo)"""
+        return (self.lease is not None and self.lease['holder'] == self.holder
+                and time.time() < self.lease['expires_at'])
+
+    @property
+    def term(self) -> Optional[int]:
+        return self.lease['term'] if self.is_leader else None
+
+    def start(self):
+        """Primo tentativo subito, poi un rinnovo ogni interval secondi"""
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self.renew()
+            await asyncio.sleep(self.interval)
+
+    async def renew(self):
+        try:
+            self.lease = await self.adb.acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            # Senza rinnovo il lease resta valido fino a expires_at, poi is_leader diventa False
+            logger.error(f"Errore rinnovo lease {self.name}: {e}")
+        await self._update_role()
+
+    async def _update_role(self):
+        leader = self.is_leader
+        if leader == self._leader:
+            return
+        self._leader = leader
+        if leader:
+            logger.info(f"{self.holder} è il leader di {self.name} (term {self.lease['term']})")
+            callback = self.on_elected(self.lease) if self.on_elected else None
+        else:
+            holder = self.lease['holder'] if self.lease else '?'
+            logger.info(f"{self.holder} non è più il leader di {self.name} (ora: {holder})")
+            callback = self.on_demoted() if self.on_demoted else None
+        if callback is not None:
+            try:
+                await callback
+            except Exception as e:
+                logger.error(f"Errore cambio di ruolo ({self.name}): {e}")
+
+    async def stop(self):
+        """Smette di rinnovare e, se è il leader, lascia subito il lease agli altri"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self.adb.release_lease(self.name, self.holder)
+        self.lease = None
+        await self._update_role()
@@ -1,104 +1,545 @@
+import queue
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Optional, List, Dict, Tuple
+
+from leaderboard import LeaderboardIndex
+from archive import ColdStorage, archive_file_name, first_archivable_day, merge_history, month_ranges
+from migrations import migrate, WEEKLY_ROLLUP_SELECT
+from reports import REPORT_ROW_COLUMNS, distraction_text
+from sql_trace import SqlTracer, is_full_scan
+from user_cache import UserCache
+from report_cache import ReportCache
+
+# Pragma applicati ad ogni connessione
+# WAL: i lettori non bloccano lo scrittore (e viceversa)
+# synchronous=NORMAL: in WAL resta consistente, fsync solo al checkpoint
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",      # ~8 MB di page cache per connessione
+    "PRAGMA mmap_size = 67108864",    # 64 MB memory-mapped I/O
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Statement preparati tenuti in cache da ogni connessione
+STATEMENT_CACHE_SIZE = 256
+
+# Punteggio distrazione usato dalle statistiche
+DISTRACTION_SCORES = {'low': 1, 'medium': 2, 'high': 3}
+
+# Aggregati settimanali calcolati in SQL sulle righe di daily_logs (alias "l")
+# Distrazione: low=1, medium=2, high=3 (valori sconosciuti contano come medium)
+WEEKLY_STATS_COLUMNS = '''
+    COALESCE(SUM(CASE WHEN l.should_study THEN l.hours_studied END), 0) AS total_hours,
+    COUNT(CASE WHEN l.should_study AND l.hours_studied > 0 THEN 1 END) AS study_days,
+    COUNT(CASE WHEN l.should_study THEN 1 END) AS total_study_days,
+    AVG(CASE WHEN l.should_study AND l.hours_studied > 0 THEN
+        CASE l.distraction_level
+            WHEN 'low' THEN 1 WHEN 'medium' THEN 2 WHEN 'high' THEN 3 ELSE 2
+        END
+    END) AS avg_distraction,
+    COUNT(CASE WHEN l.notes IS NOT NULL AND l.notes != '' THEN 1 END) AS notes_count
+'''
+
+SQL_ACTIVE_USERS = 'SELECT * FROM users WHERE is_active = 1'
+# Utenti attivi a blocchi per user_id (idx_users_active contiene anche il rowid = user_id)
+SQL_ACTIVE_USERS_PAGE = '''
+    SELECT * FROM users
+    WHERE is_active = 1 AND user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+'''
+
+SQL_WEEKLY_LOGS = '''
+    SELECT * FROM daily_logs 
+    WHERE user_id = ? AND date BETWEEN ? AND ?
+    ORDER BY date
+'''
+
+SQL_USER_WEEKLY_STATS = f'''
+    SELECT {WEEKLY_STATS_COLUMNS}
+    FROM daily_logs l
+    WHERE l.user_id = ? AND l.date BETWEEN ? AND ?
+'''
+
+# Statistiche di una settimana intera (lunedì-domenica) dal rollup weekly_user_stats
+ROLLUP_STATS_COLUMNS = '''
+    COALESCE(w.total_hours, 0) AS total_hours,
+    COALESCE(w.study_days, 0) AS study_days,
+    COALESCE(w.total_study_days, 0) AS total_study_days,
+    CASE WHEN w.study_days > 0
+        THEN CAST(w.distraction_sum AS REAL) / w.study_days
+    END AS avg_distraction,
+    COALESCE(w.notes_count, 0) AS notes_count
+'''
+
+SQL_USER_WEEKLY_ROLLUP = f'''
+    SELECT {ROLLUP_STATS_COLUMNS}
+    FROM weekly_user_stats w
+    WHERE w.user_id = ? AND w.week_start = ?
+'''
+
+SQL_ALL_USERS_WEEKLY_ROLLUP = f'''
+    SELECT u.user_id, u.username, u.weekly_goal, {ROLLUP_STATS_COLUMNS}
+    FROM users u
+    LEFT JOIN weekly_user_stats w
+        ON w.user_id = u.user_id AND w.week_start = ?
+    WHERE u.is_active = 1
+    ORDER BY u.user_id
+'''
+
+SQL_ALL_USERS_WEEKLY_STATS = f'''
+    SELECT u.user_id, u.username, u.weekly_goal, {WEEKLY_STATS_COLUMNS}
+    FROM users u
+    LEFT JOIN daily_logs l
+        ON l.user_id = u.user_id AND l.date BETWEEN ? AND ?
+    WHERE u.is_active = 1
+    GROUP BY u.user_id
+    ORDER BY u.user_id
+'''
+
+# Membri di un gruppo con i totali della settimana (per costruire la classifica)
+SQL_GROUP_LEADERBOARD = '''
+    SELECT u.user_id, u.username, u.weekly_goal,
+           COALESCE(w.total_hours, 0) AS total_hours, COALESCE(w.study_days, 0) AS study_days
+    FROM group_members m
+    JOIN users u ON u.user_id = m.user_id AND u.is_active = 1
+    LEFT JOIN weekly_user_stats w ON w.user_id = u.user_id AND w.week_start = ?
+    WHERE m.chat_id = ?
+'''
+
+SQL_ALL_USERS_LEADERBOARD = '''
+    SELECT u.user_id, u.username, u.weekly_goal,
+           COALESCE(w.total_hours, 0) AS total_hours, COALESCE(w.study_days, 0) AS study_days
+    FROM users u
+    LEFT JOIN weekly_user_stats w ON w.user_id = u.user_id AND w.week_start = ?
+    WHERE u.is_active = 1
+'''
+
+# Report di una chat (0 = senza gruppo) in una settimana, dall'indice unico
+SQL_WEEKLY_REPORT = '''
+    SELECT id, chat_id, week_start, week_end, total_users, active_users,
+           total_hours, goals_reached, report_text
+    FROM weekly_reports
+    WHERE COALESCE(chat_id, 0) = ? AND week_start = ?
+'''
+
+SQL_WEEKLY_REPORT_ROWS = f'''
+    SELECT {', '.join(REPORT_ROW_COLUMNS)}
+    FROM weekly_report_rows
+    WHERE report_id = ?
+    ORDER BY user_id
+'''
+
+# Storia completa di un utente, letta tutta dall'indice di copertura
+SQL_USER_HISTORY = '''
+    SELECT date, should_study, hours_studied, distraction_level, notes
+    FROM daily_logs
+    WHERE user_id = ?
+    ORDER BY date
+'''
+
+# Query calde controllate da check_query_plans: (sql, parametri di esempio, indice atteso)
+HOT_QUERIES = {
+    'get_all_active_users': (SQL_ACTIVE_USERS, (), 'idx_users_active'),
+    'get_active_users_page': (SQL_ACTIVE_USERS_PAGE, (0, 500), 'idx_users_active'),
+    'get_weekly_logs': (
+        SQL_WEEKLY_LOGS, (1, '2024-01-01', '2024-01-07'),
+        'idx_daily_logs_user_date_stats'
+    ),
+    'get_user_weekly_stats': (
+        SQL_USER_WEEKLY_STATS, (1, '2024-01-01', '2024-01-07'),
+        'idx_daily_logs_user_date_stats'
+    ),
+    'get_all_users_weekly_stats': (
+        SQL_ALL_USERS_WEEKLY_STATS, ('2024-01-01', '2024-01-07'),
+        'idx_daily_logs_user_date_stats'
+    ),
+    'get_user_weekly_stats (rollup)': (
+        SQL_USER_WEEKLY_ROLLUP, (1, '2024-01-01'), 'PRIMARY KEY'
+    ),
+    'get_all_users_weekly_stats (rollup)': (
+        SQL_ALL_USERS_WEEKLY_ROLLUP, ('2024-01-01',), 'PRIMARY KEY'
+    ),
+    'get_user_history': (SQL_USER_HISTORY, (1,), 'idx_daily_logs_user_date_stats'),
+    'get_leaderboard': (SQL_GROUP_LEADERBOARD, ('2024-01-01', 1), 'PRIMARY KEY'),
+    'get_weekly_report': (SQL_WEEKLY_REPORT, (0, '2024-01-01'), 'idx_weekly_reports_chat_week'),
+    'get_weekly_report (righe)': (SQL_WEEKLY_REPORT_ROWS, (1,), 'PRIMARY KEY'),
+}
+
+
+def _week_start(date_str: str) -> str:
+    """Lunedì della settimana di una data (YYYY-MM-DD)"""
+    day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    return (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+
+
+def _is_full_week(week_start: str, week_end: str) -> bool:
+    """True se l'intervallo è esattamente una settimana lunedì-domenica"""
+    start = datetime.strptime(week_start, '%Y-%m-%d').date()
+    end = datetime.strptime(week_end, '%Y-%m-%d').date()
+    return start.weekday() == 0 and end - start == timedelta(days=6)
+
+
+def _log_contribution(log) -> Tuple[float, int, int, int, int]:
+    """
+    Contributo di un log al rollup settimanale:
+    (ore, giorno studiato, giorno di studio previsto, punteggio distrazione, note)
+    """
+    if not log:
+        return (0, 0, 0, 0, 0)
+
+    should_study = bool(log['should_study'])
+    studied = should_study and log['hours_studied'] > 0
+    return (
+        log['hours_studied'] if should_study else 0,
+        int(studied),
+        int(should_study),
+        DISTRACTION_SCORES.get(log['distraction_level'], 2) if studied else 0,
+        int(bool(log['notes']))
+    )
+
+
+_EMPTY_STATS_ROW = {
+    'total_hours': 0, 'study_days': 0, 'total_study_days': 0,
+    'avg_distraction': None, 'notes_count': 0
+}
+
+
+def _weekly_stats_from_row(row) -> Dict:
+    """Costruisce il dict di statistiche da una riga con WEEKLY_STATS_COLUMNS"""
+    return {
+        'total_hours': row['total_hours'],
+        'study_days': row['study_days'],
+        'total_study_days': row['total_study_days'],
+        'avg_distraction': row['avg_distraction'] or 0,
+        'distraction_text': distraction_text(row['avg_distraction'] or 0),
+        'notes_count': row['notes_count']
+    }
+
 
 class Database:
-    def __init__(self, db_path: str = "study_bot.db"):
+    def __init__(self, db_path: str = "study_bot.db", read_pool_size: int = 4,
+                 user_cache_size: int = 10000, user_cache_ttl: float = 300.0,
+                 archive_dir: str = '', lazy: bool = False, trace: bool = False,
+                 trace_slow_queries: int = 20):
         self.db_path = db_path
-        self.init_db()
+        self.read_pool_size = read_pool_size
+        
+        # Tracciamento SQL opzionale: tempi per metodo e statement lenti (vedi sql_trace.py)
+        self.tracer: Optional[SqlTracer] = SqlTracer(trace_slow_queries) if trace else None
+        
+        # Profili utente letti spesso: cache in memoria aggiornata dalle scritture
+        self.user_cache = UserCache(user_cache_size, user_cache_ttl)
+        # Report settimanali renderizzati, invalidati dalle scritture che li toccano
+        self.report_cache = ReportCache()
+        # Classifiche dei gruppi, aggiornate ad ogni check-in (vedi leaderboard.py)
+        self.leaderboards = LeaderboardIndex()
+        
+        # Una sola connessione di scrittura, riusata e serializzata dal lock
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.RLock()
+        # Dentro batch(): callback da eseguire dopo il commit (aggiornamento cache).
+        # Per thread: la scrittura di un altro thread non finisce nel batch aperto
+        self._batch_local = threading.local()
+        
+        # Pool di connessioni di lettura, create on demand
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers_created = 0
+        self._readers_lock = threading.Lock()
+        
+        # Log vecchi spostati nei file freddi (un file per anno, vedi archive.py)
+        self.cold = ColdStorage(archive_dir)
+        
+        # Migrazioni e anni archiviati: subito, o con lazy=True al primo uso
+        # (il bot si avvia senza aspettare il disco, vedi open())
+        self._ready = False
+        self._opening = False
+        self._open_lock = threading.RLock()
+        if not lazy:
+            self.open()
+    
+    def open(self):
+        """
+        Applica le migrazioni e carica gli anni archiviati, una volta sola.
+        Chiamato da reader()/writer() al primo uso: gli altri thread aspettano
+        che finisca, il thread che apre (che passa di nuovo da writer) no.
+        """
+        with self._open_lock:
+            if self._ready or self._opening:
+                return
+            self._opening = True
+            try:
+                self.init_db()
+                self.cold.years = self.get_archived_years()
+                self.cold.upgrade()
+                self._ready = True
+            finally:
+                self._opening = False
     
-    def get_connection(self):
-        """Crea connessione al database"""
-        conn = sqlite3.connect(self.db_path)
+    def _connect(self) -> sqlite3.Connection:
+        """Apre una nuova connessione con i pragma di tuning"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if self.tracer is not None:
+            self.tracer.install(conn)
         return conn
     
-    def init_db(self):
-        """Inizializza il database con le tabelle necessarie"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def get_connection(self) -> sqlite3.Connection:
+        """Restituisce la connessione di scrittura condivisa (creata al primo uso)"""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            return self._writer
+    
+    @contextmanager
+    def writer(self, immediate: bool = False):
+        """
+        Connessione di scrittura in esclusiva per la durata del blocco.
+        Commit all'uscita, rollback in caso di eccezione.
+        Con immediate=True la transazione prende subito il lock di scrittura.
         
-        # Tabella utenti
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                weekly_goal INTEGER DEFAULT 20,
-                checkin_time TEXT DEFAULT "23:00",
-                reminder_start TEXT,
-                reminder_end TEXT,
-                joined_date DATE DEFAULT CURRENT_DATE,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
+        Dentro batch() il blocco diventa un savepoint della transazione del
+        batch: un errore annulla solo questa operazione, il commit è unico.
+        """
+        if not self._ready:
+            self.open()
+        with self._write_lock:
+            conn = self.get_connection()
+            if self._batch_callbacks() is not None:
+                conn.execute('SAVEPOINT batch_op')
+                try:
+                    yield conn
+                except Exception:
+                    conn.execute('ROLLBACK TO batch_op')
+                    conn.execute('RELEASE batch_op')
+                    raise
+                conn.execute('RELEASE batch_op')
+                return
+            
+            try:
+                if immediate:
+                    conn.execute('BEGIN IMMEDIATE')
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if self.tracer is not None:
+                    self.tracer.finish(conn)
+    
+    @contextmanager
+    def batch(self):
+        """
+        Group commit: tutte le scritture del blocco in una sola transazione.
+        Le cache vengono aggiornate solo dopo il commit (_after_commit).
+        """
+        if not self._ready:
+            self.open()
+        with self._write_lock:
+            conn = self.get_connection()
+            callbacks = self._batch_local.callbacks = []
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._batch_local.callbacks = None
+                if self.tracer is not None:
+                    self.tracer.finish(conn)
         
-        # Tabella log giornalieri
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                date DATE,
-                should_study BOOLEAN,
-                hours_studied REAL,
-                distraction_level TEXT,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id),
-                UNIQUE(user_id, date)
-            )
-        ''')
+        for callback in callbacks:
+            callback()
+    
+    def _batch_callbacks(self) -> Optional[List[Callable[[], None]]]:
+        """Callback del batch aperto da questo thread (None fuori da batch())"""
+        return getattr(self._batch_local, 'callbacks', None)
+    
+    def _after_commit(self, callback: Callable[[], None]):
+        """Esegue callback subito, o al commit del batch in corso nello stesso thread"""
+        callbacks = self._batch_callbacks()
+        if callbacks is not None:
+            callbacks.append(callback)
+        else:
+            callback()
+    
+    def _call_for_batch(self, name: str, args: tuple, kwargs: Dict):
+        try:
+            return getattr(self, name)(*args, **kwargs)
+        except Exception as e:
+            return e
+    
+    def run_batch(self, calls: List[Tuple[str, tuple, Dict]]) -> List:
+        """
+        Esegue i metodi di scrittura (nome, args, kwargs) con un solo commit.
+        Restituisce i risultati nello stesso ordine; se un metodo solleva
+        un'eccezione, al suo posto c'è l'eccezione (le altre scritture restano).
+        Se è il commit a fallire le operazioni vengono ripetute una per una.
+        """
+        try:
+            with self.batch():
+                return [self._call_for_batch(*call) for call in calls]
+        except Exception as e:
+            print(f"Errore group commit ({len(calls)} scritture), riprovo una per una: {e}")
+        return [self._call_for_batch(*call) for call in calls]
+    
+    @contextmanager
+    def reader(self):
+        """Prende in prestito una connessione di lettura dal pool"""
+        if not self._ready:
+            self.open()
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self.tracer is not None:
+                self.tracer.finish(conn)
+            self._readers.put(conn)
+    
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
         
-        # Tabella report settimanali
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS weekly_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                week_start DATE,
-                week_end DATE,
-                report_text TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        with self._readers_lock:
+            if self._readers_created < self.read_pool_size:
+                self._readers_created += 1
+                return self._connect()
         
-        conn.commit()
-        conn.close()
+        # Pool esaurito: aspetta che un'altra lettura restituisca la connessione
+        return self._readers.get()
+    
+    def close(self):
+        """Chiude tutte le connessioni aperte"""
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        
+        with self._readers_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._readers_created = 0
+    
+    def init_db(self):
+        """Inizializza il database applicando le migrazioni mancanti"""
+        with self.writer() as conn:
+            migrate(conn)
+    
+    def explain_query_plan(self, sql: str, params: tuple = ()) -> List[str]:
+        """Restituisce le righe di EXPLAIN QUERY PLAN per una query"""
+        with self.reader() as conn:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        return [row['detail'] for row in rows]
+    
+    def sql_trace_report(self, limit: int = 10, reset: bool = False) -> Optional[Dict]:
+        """
+        Riepilogo del tracciamento SQL (None se non è attivo), con il piano
+        degli statement più lenti. Con reset=True le statistiche ripartono da zero.
+        """
+        if self.tracer is None:
+            return None
+        report = self.tracer.report(self.explain_query_plan, limit)
+        if reset:
+            self.tracer.reset()
+        return report
+    
+    def check_query_plans(self) -> Dict[str, Dict]:
+        """
+        Verifica che le query più frequenti usino gli indici previsti.
+        Per ogni query: piano di esecuzione e se usa l'indice atteso
+        (e nessuna scansione completa di tabella).
+        """
+        results = {}
+        for name, (sql, params, index_name) in HOT_QUERIES.items():
+            plan = self.explain_query_plan(sql, params)
+            uses_index = (
+                any(index_name in detail for detail in plan)
+                and not any(is_full_scan(detail) for detail in plan)
+            )
+            results[name] = {'plan': plan, 'uses_index': uses_index}
+        return results
     
     # ========== USER MANAGEMENT ==========
     
     def add_user(self, user_id: int, username: str) -> bool:
         """Aggiunge un nuovo utente"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username)
-                VALUES (?, ?)
-            ''', (user_id, username))
-            conn.commit()
-            conn.close()
+            with self.writer() as conn:
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO users (user_id, username)
+                    VALUES (?, ?)
+                ''', (user_id, username))
+            self._after_commit(lambda: self.user_cache.invalidate(user_id))
+            if cursor.rowcount:
+                # Un utente in più nel report di tutti gli utenti e nelle classifiche
+                self._after_commit(lambda: self.report_cache.invalidate_chat(None))
+                self._after_commit(self.leaderboards.clear)
             return True
         except Exception as e:
             print(f"Errore aggiunta utente: {e}")
             return False
     
+    def _user_report_chats(self, conn: sqlite3.Connection, user_ids: Iterable[int]) -> List[Optional[int]]:
+        """Chiavi dei report che contengono gli utenti: None (tutti gli utenti) e i loro gruppi"""
+        user_ids = tuple(user_ids)
+        placeholders = ','.join('?' * len(user_ids))
+        rows = conn.execute(f'''
+            SELECT DISTINCT chat_id FROM group_members WHERE user_id IN ({placeholders})
+        ''', user_ids).fetchall()
+        return [None] + [row['chat_id'] for row in rows]
+    
     def get_user(self, user_id: int) -> Optional[Dict]:
-        """Recupera dati utente"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        """Recupera dati utente (dalla cache se presente)"""
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
+        return self.load_user(user_id)
+    
+    def load_user(self, user_id: int) -> Optional[Dict]:
+        """Legge l'utente dal database e lo mette in cache"""
+        token = self.user_cache.load_token()
+        with self.reader() as conn:
+            row = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if not row:
+            return None
+        user = dict(row)
+        self.user_cache.put(user_id, user, token)
+        return user
     
     def update_user_goal(self, user_id: int, weekly_goal: int) -> bool:
         """Aggiorna obiettivo settimanale"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users SET weekly_goal = ? WHERE user_id = ?
-            ''', (weekly_goal, user_id))
-            conn.commit()
-            conn.close()
+            with self.writer() as conn:
+                conn.execute('''
+                    UPDATE users SET weekly_goal = ? WHERE user_id = ?
+                ''', (weekly_goal, user_id))
+                chats = self._user_report_chats(conn, [user_id])
+            self._after_commit(lambda: self.user_cache.update(user_id, weekly_goal=weekly_goal))
+            # L'obiettivo compare in tutti i report che contengono l'utente
+            self._after_commit(lambda: self.report_cache.invalidate_chats(chats))
+            self._after_commit(lambda: self.leaderboards.update_goal(user_id, weekly_goal))
             return True
         except Exception as e:
             print(f"Errore update goal: {e}")
@@ -107,13 +548,11 @@ class Database:
     def update_user_checkin_time(self, user_id: int, checkin_time: str) -> bool:
         """Aggiorna orario check-in"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users SET checkin_time = ? WHERE user_id = ?
-            ''', (checkin_time, user_id))
-            conn.commit()
-            conn.close()
+            with self.writer() as conn:
+                conn.execute('''
+                    UPDATE users SET checkin_time = ? WHERE user_id = ?
+                ''', (checkin_time, user_id))
+            self._after_commit(lambda: self.user_cache.update(user_id, checkin_time=checkin_time))
             return True
         except Exception as e:
             print(f"Errore update checkin time: {e}")
@@ -122,13 +561,13 @@ class Database:
     def update_user_reminders(self, user_id: int, reminder_start: str, reminder_end: str) -> bool:
         """Aggiorna orari reminder"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users SET reminder_start = ?, reminder_end = ? WHERE user_id = ?
-            ''', (reminder_start, reminder_end, user_id))
-            conn.commit()
-            conn.close()
+            with self.writer() as conn:
+                conn.execute('''
+                    UPDATE users SET reminder_start = ?, reminder_end = ? WHERE user_id = ?
+                ''', (reminder_start, reminder_end, user_id))
+            self._after_commit(lambda: self.user_cache.update(
+                user_id, reminder_start=reminder_start, reminder_end=reminder_end
+            ))
             return True
         except Exception as e:
             print(f"Errore update reminders: {e}")
@@ -136,11 +575,14 @@ class Database:
     
     def get_all_active_users(self) -> List[Dict]:
         """Recupera tutti gli utenti attivi"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE is_active = 1')
-        rows = cursor.fetchall()
-        conn.close()
+        with self.reader() as conn:
+            rows = conn.execute(SQL_ACTIVE_USERS).fetchall()
+        return [dict(row) for row in rows]
+    
+    def get_active_users_page(self, after_user_id: int = 0, limit: int = 500) -> List[Dict]:
+        """Utenti attivi con user_id > after_user_id, al massimo limit, in ordine di user_id"""
+        with self.reader() as conn:
+            rows = conn.execute(SQL_ACTIVE_USERS_PAGE, (after_user_id, limit)).fetchall()
         return [dict(row) for row in rows]
     
     # ========== DAILY LOGS ==========
@@ -149,20 +591,50 @@ class Database:
                       hours_studied: float, distraction_level: str, notes: str = "") -> bool:
         """Aggiunge o aggiorna log giornaliero"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO daily_logs (user_id, date, should_study, hours_studied, distraction_level, notes)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ON CONFLICT(user_id, date) 
-                DO UPDATE SET 
-                    should_study = excluded.should_study,
-                    hours_studied = excluded.hours_studied,
-                    distraction_level = excluded.distraction_level,
-                    notes = excluded.notes
-            ''', (user_id, date, should_study, hours_studied, distraction_level, notes))
-            conn.commit()
-            conn.close()
+            with self.writer(immediate=True) as conn:
+                old_log = conn.execute('''
+                    SELECT should_study, hours_studied, distraction_level, notes
+                    FROM daily_logs WHERE user_id = ? AND date = ?
+                ''', (user_id, date)).fetchone()
+
+                conn.execute('''
+                    INSERT INTO daily_logs (user_id, date, should_study, hours_studied, distraction_level, notes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, date) 
+                    DO UPDATE SET 
+                        should_study = excluded.should_study,
+                        hours_studied = excluded.hours_studied,
+                        distraction_level = excluded.distraction_level,
+                        notes = excluded.notes
+                ''', (user_id, date, should_study, hours_studied, distraction_level, notes))
+
+                # Aggiorna il rollup settimanale con la differenza rispetto al log precedente
+                new_log = {
+                    'should_study': should_study,
+                    'hours_studied': hours_studied,
+                    'distraction_level': distraction_level,
+                    'notes': notes
+                }
+                delta = [new - old for new, old in
+                         zip(_log_contribution(new_log), _log_contribution(old_log))]
+                week_totals = conn.execute('''
+                    INSERT INTO weekly_user_stats
+                        (user_id, week_start, total_hours, study_days, total_study_days,
+                         distraction_sum, notes_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, week_start)
+                    DO UPDATE SET
+                        total_hours = total_hours + excluded.total_hours,
+                        study_days = study_days + excluded.study_days,
+                        total_study_days = total_study_days + excluded.total_study_days,
+                        distraction_sum = distraction_sum + excluded.distraction_sum,
+                        notes_count = notes_count + excluded.notes_count
+                    RETURNING total_hours, study_days
+                ''', (user_id, _week_start(date), *delta)).fetchone()
+            self._after_commit(lambda: self.report_cache.invalidate_week(_week_start(date)))
+            self._after_commit(lambda: self.leaderboards.update_stats(
+                user_id, _week_start(date), week_totals['total_hours'], week_totals['study_days']
+            ))
             return True
         except Exception as e:
             print(f"Errore add daily log: {e}")
@@ -170,77 +642,518 @@ class Database:
     
     def get_daily_log(self, user_id: int, date: str) -> Optional[Dict]:
         """Recupera log di un giorno specifico"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM daily_logs WHERE user_id = ? AND date = ?
-        ''', (user_id, date))
-        row = cursor.fetchone()
-        conn.close()
+        with self.reader() as conn:
+            row = conn.execute('''
+                SELECT * FROM daily_logs WHERE user_id = ? AND date = ?
+            ''', (user_id, date)).fetchone()
         return dict(row) if row else None
     
     def get_weekly_logs(self, user_id: int, week_start: str, week_end: str) -> List[Dict]:
         """Recupera log di una settimana"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM daily_logs 
-            WHERE user_id = ? AND date BETWEEN ? AND ?
-            ORDER BY date
-        ''', (user_id, week_start, week_end))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.reader() as conn:
+            rows = conn.execute(
+                SQL_WEEKLY_LOGS, (user_id, week_start, week_end)
+            ).fetchall()
         return [dict(row) for row in rows]
     
+    def get_user_history(self, user_id: int) -> List[Tuple]:
+        """
+        Tutti i log dell'utente in ordine di data, come tuple
+        (date, should_study, hours_studied, distraction_level, notes):
+        niente sqlite3.Row né dict per riga, vanno direttamente negli array di analytics
+        """
+        with self.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            hot = cursor.execute(SQL_USER_HISTORY, (user_id,)).fetchall()
+        # Il freddo si legge dopo il caldo: una riga spostata nel frattempo
+        # compare al massimo due volte (merge_history la tiene una), mai zero
+        if not self.cold.years:
+            return hot
+        return merge_history(self.cold.user_history(user_id), hot)
+    
     def get_user_weekly_stats(self, user_id: int, week_start: str, week_end: str) -> Dict:
-        """Calcola statistiche settimanali per utente"""
-        logs = self.get_weekly_logs(user_id, week_start, week_end)
+        """
+        Calcola statistiche settimanali per utente.
+        Per una settimana intera è una lettura per chiave dal rollup,
+        per intervalli diversi aggrega i log.
+        """
+        with self.reader() as conn:
+            if _is_full_week(week_start, week_end):
+                row = conn.execute(SQL_USER_WEEKLY_ROLLUP, (user_id, week_start)).fetchone()
+            else:
+                row = conn.execute(
+                    SQL_USER_WEEKLY_STATS, (user_id, week_start, week_end)
+                ).fetchone()
+        return _weekly_stats_from_row(row or _EMPTY_STATS_ROW)
+    
+    def get_all_users_weekly_stats(self, week_start: str, week_end: str) -> List[Dict]:
+        """
+        Statistiche settimanali di tutti gli utenti attivi in una sola query
+        (join con il rollup per una settimana intera, altrimenti un unico
+        passaggio GROUP BY sui log invece di una query per utente)
+        """
+        with self.reader() as conn:
+            if _is_full_week(week_start, week_end):
+                rows = conn.execute(SQL_ALL_USERS_WEEKLY_ROLLUP, (week_start,)).fetchall()
+            else:
+                rows = conn.execute(
+                    SQL_ALL_USERS_WEEKLY_STATS, (week_start, week_end)
+                ).fetchall()
         
-        total_hours = sum(log['hours_studied'] for log in logs if log['should_study'])
-        study_days = sum(1 for log in logs if log['should_study'] and log['hours_studied'] > 0)
-        total_study_days = sum(1 for log in logs if log['should_study'])
+        results = []
+        for row in rows:
+            stats = _weekly_stats_from_row(row)
+            stats['user_id'] = row['user_id']
+            stats['username'] = row['username']
+            stats['weekly_goal'] = row['weekly_goal']
+            stats['goal_reached'] = stats['total_hours'] >= row['weekly_goal']
+            results.append(stats)
+        return results
+    
+    def rebuild_weekly_rollup(self) -> List[Dict]:
+        """
+        Ricalcola weekly_user_stats da daily_logs.
+        Restituisce le righe (utente, settimana) diverse dal ricalcolo:
+        lista vuota = il rollup era consistente.
+        Le settimane archiviate (prima di archived_before) restano come sono.
+        """
+        columns = ('total_hours', 'study_days', 'total_study_days',
+                   'distraction_sum', 'notes_count')
         
-        # Calcola distrazione media
-        distraction_map = {'low': 1, 'medium': 2, 'high': 3}
-        distractions = [distraction_map.get(log['distraction_level'], 2) 
-                       for log in logs if log['should_study'] and log['hours_studied'] > 0]
-        avg_distraction = sum(distractions) / len(distractions) if distractions else 0
+        with self.writer(immediate=True) as conn:
+            cutoff = conn.execute(
+                'SELECT COALESCE(MAX(archived_before), \'\') FROM archive_segments'
+            ).fetchone()[0]
+            expected = {
+                (row['user_id'], row['week_start']): row
+                for row in conn.execute(WEEKLY_ROLLUP_SELECT)
+                if row['week_start'] >= cutoff
+            }
+            current = {
+                (row['user_id'], row['week_start']): row
+                for row in conn.execute(
+                    'SELECT * FROM weekly_user_stats WHERE week_start >= ?', (cutoff,)
+                )
+            }
+            
+            mismatches = []
+            for key in sorted(expected.keys() | current.keys()):
+                exp_values = [expected[key][c] if key in expected else 0 for c in columns]
+                cur_values = [current[key][c] if key in current else 0 for c in columns]
+                if any(abs(e - c) > 1e-9 for e, c in zip(exp_values, cur_values)):
+                    mismatches.append({
+                        'user_id': key[0],
+                        'week_start': key[1],
+                        'expected': dict(zip(columns, exp_values)),
+                        'found': dict(zip(columns, cur_values))
+                    })
+            
+            conn.execute('DELETE FROM weekly_user_stats WHERE week_start >= ?', (cutoff,))
+            conn.execute(f'''
+                INSERT OR REPLACE INTO weekly_user_stats
+                    (user_id, week_start, total_hours, study_days, total_study_days,
+                     distraction_sum, notes_count)
+                SELECT * FROM ({WEEKLY_ROLLUP_SELECT}) WHERE week_start >= ?
+            ''', (cutoff,))
         
-        if avg_distraction <= 1.5:
-            distraction_text = "Bassa"
-        elif avg_distraction <= 2.5:
-            distraction_text = "Media"
-        else:
-            distraction_text = "Alta"
+        if mismatches:
+            self.leaderboards.clear()
+        return mismatches
+    
+    # ========== ARCHIVIO ==========
+    
+    def get_archived_years(self) -> List[int]:
+        """Anni con un file nell'archivio freddo"""
+        with self.reader() as conn:
+            return [row['year'] for row in conn.execute('SELECT year FROM archive_segments ORDER BY year')]
+    
+    def archive_logs(self, before: date) -> Dict:
+        """
+        Sposta nell'archivio freddo i log con data precedente a before (un
+        lunedì, vedi archive.archive_cutoff) e i report delle stesse settimane.
+        Un mese per volta: il lock di scrittura viene rilasciato tra un mese e l'altro.
+        """
+        if not self.cold.archive_dir:
+            raise ValueError("ARCHIVE_DIR non configurata")
+        
+        with self.reader() as conn:
+            first = first_archivable_day(conn, before)
         
-        notes_count = sum(1 for log in logs if log['notes'])
+        moved = {'daily_logs': 0, 'weekly_reports': 0}
+        years = set()
+        if first is not None:
+            for start, end in month_ranges(first, before):
+                with self._write_lock:
+                    counts = self.cold.move(self.get_connection(), start.year, start, end)
+                    with self.writer() as conn:
+                        conn.execute('''
+                            INSERT INTO archive_segments
+                                (year, file_name, archived_before, daily_logs, weekly_reports)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT(year) DO UPDATE SET
+                                archived_before = MAX(archived_before, excluded.archived_before),
+                                daily_logs = daily_logs + excluded.daily_logs,
+                                weekly_reports = weekly_reports + excluded.weekly_reports,
+                                updated_at = CURRENT_TIMESTAMP
+                        ''', (start.year, archive_file_name(start.year), before.isoformat(),
+                              counts['daily_logs'], counts['weekly_reports']))
+                years.add(start.year)
+                for table, count in counts.items():
+                    moved[table] += count
+                self.cold.years = sorted(set(self.cold.years) | {start.year})
         
-        return {
-            'total_hours': total_hours,
-            'study_days': study_days,
-            'total_study_days': total_study_days,
-            'distraction_text': distraction_text,
-            'notes_count': notes_count
-        }
+        for year in sorted(years):
+            self.cold.compact(year)
+        
+        return {'before': before, 'years': sorted(years), **moved}
+    
+    # ========== GRUPPI ==========
+    
+    def add_group(self, chat_id: int, title: Optional[str] = None) -> bool:
+        """Registra (o riattiva) un gruppo in cui si trova il bot"""
+        try:
+            with self.writer() as conn:
+                conn.execute('''
+                    INSERT INTO group_chats (chat_id, title, is_active)
+                    VALUES (?, ?, 1)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        title = COALESCE(excluded.title, title),
+                        is_active = 1
+                ''', (chat_id, title))
+            return True
+        except Exception as e:
+            print(f"Errore add group: {e}")
+            return False
+    
+    def deactivate_group(self, chat_id: int) -> bool:
+        """Il bot è stato rimosso dal gruppo: niente più report"""
+        try:
+            with self.writer() as conn:
+                conn.execute('UPDATE group_chats SET is_active = 0 WHERE chat_id = ?', (chat_id,))
+            self._after_commit(lambda: self.leaderboards.invalidate_chat(chat_id))
+            return True
+        except Exception as e:
+            print(f"Errore deactivate group: {e}")
+            return False
+    
+    def add_group_member(self, chat_id: int, user_id: int) -> bool:
+        """Registra un utente come membro del gruppo"""
+        try:
+            with self.writer() as conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO group_members (chat_id, user_id) VALUES (?, ?)
+                ''', (chat_id, user_id))
+            self._after_commit(lambda: self.report_cache.invalidate_chat(chat_id))
+            self._after_commit(lambda: self.leaderboards.invalidate_chat(chat_id))
+            return True
+        except Exception as e:
+            print(f"Errore add group member: {e}")
+            return False
+    
+    def remove_group_member(self, chat_id: int, user_id: int) -> bool:
+        """Rimuove un utente uscito dal gruppo"""
+        try:
+            with self.writer() as conn:
+                conn.execute('''
+                    DELETE FROM group_members WHERE chat_id = ? AND user_id = ?
+                ''', (chat_id, user_id))
+            self._after_commit(lambda: self.report_cache.invalidate_chat(chat_id))
+            self._after_commit(lambda: self.leaderboards.invalidate_chat(chat_id))
+            return True
+        except Exception as e:
+            print(f"Errore remove group member: {e}")
+            return False
+    
+    def get_active_groups(self) -> Dict[int, Dict]:
+        """Gruppi attivi con i loro membri: {chat_id: {'title', 'members'}}"""
+        with self.reader() as conn:
+            groups = {
+                row['chat_id']: {'title': row['title'], 'members': set()}
+                for row in conn.execute(
+                    'SELECT chat_id, title FROM group_chats WHERE is_active = 1'
+                )
+            }
+            for row in conn.execute('SELECT chat_id, user_id FROM group_members'):
+                if row['chat_id'] in groups:
+                    groups[row['chat_id']]['members'].add(row['user_id'])
+        return groups
+    
+    def get_leaderboard(self, chat_id: Optional[int], week_start: str, user_id: Optional[int] = None,
+                        metric: str = 'ore', limit: int = 10) -> Dict:
+        """
+        Classifica della settimana: {'top': [(posizione, user_id, valori)],
+        'rank': posizione di user_id (None se non è in classifica), 'me': suoi valori, 'total'}.
+        chat_id None = tutti gli utenti attivi.
+        """
+        index = self.leaderboards
+        with index.lock:
+            boards = index.get(chat_id, week_start)
+            if boards is None:
+                with self.reader() as conn:
+                    if chat_id is None:
+                        rows = conn.execute(SQL_ALL_USERS_LEADERBOARD, (week_start,)).fetchall()
+                    else:
+                        rows = conn.execute(SQL_GROUP_LEADERBOARD, (week_start, chat_id)).fetchall()
+                boards = index.build(chat_id, week_start, rows)
+            
+            board = boards[metric]
+            return {
+                'top': board.top(limit),
+                'rank': board.rank(user_id) if user_id is not None else None,
+                'me': board.entries.get(user_id),
+                'total': len(board),
+            }
     
     # ========== WEEKLY REPORTS ==========
     
-    def save_weekly_report(self, week_start: str, week_end: str, report_text: str) -> bool:
-        """Salva report settimanale"""
+    def save_weekly_report(self, report: Dict, chat_id: Optional[int] = None) -> bool:
+        """
+        Salva report settimanale (reports.build_report) del gruppo chat_id, se indicato:
+        totali in weekly_reports, partecipanti in weekly_report_rows.
+        Un solo report per chat e settimana: se esiste già viene aggiornato.
+        """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO weekly_reports (week_start, week_end, report_text)
-                VALUES (?, ?, ?)
-            ''', (week_start, week_end, report_text))
-            conn.commit()
-            conn.close()
+            with self.writer() as conn:
+                report_id = conn.execute('''
+                    INSERT INTO weekly_reports
+                        (week_start, week_end, chat_id, total_users, active_users, total_hours, goals_reached)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(COALESCE(chat_id, 0), week_start) DO UPDATE SET
+                        week_end = excluded.week_end,
+                        total_users = excluded.total_users,
+                        active_users = excluded.active_users,
+                        total_hours = excluded.total_hours,
+                        goals_reached = excluded.goals_reached,
+                        report_text = NULL,
+                        created_at = CURRENT_TIMESTAMP
+                    RETURNING id
+                ''', (report['week_start'], report['week_end'], chat_id, report['total_users'],
+                      report['active_users'], report['total_hours'], report['goals_reached'])).fetchone()[0]
+                conn.execute('DELETE FROM weekly_report_rows WHERE report_id = ?', (report_id,))
+                conn.executemany(f'''
+                    INSERT INTO weekly_report_rows ({', '.join(REPORT_ROW_COLUMNS)})
+                    VALUES ({', '.join('?' * len(REPORT_ROW_COLUMNS))})
+                ''', [(report_id, *(row[column] for column in REPORT_ROW_COLUMNS[1:]))
+                      for row in report['rows']])
             return True
         except Exception as e:
             print(f"Errore save report: {e}")
             return False
     
+    def get_weekly_report(self, chat_id: Optional[int], week_start: str, rows: bool = True) -> Optional[Dict]:
+        """
+        Report salvato della chat (None = senza gruppo) per la settimana, anche se archiviato.
+        Con rows=False solo i totali (es. per il confronto con la settimana prima).
+        report_text è valorizzato solo per i vecchi report rimasti come testo.
+        """
+        with self.reader() as conn:
+            report = conn.execute(SQL_WEEKLY_REPORT, (chat_id or 0, week_start)).fetchone()
+            if report is not None:
+                report = dict(report)
+                if rows:
+                    report['rows'] = [dict(row) for row in conn.execute(SQL_WEEKLY_REPORT_ROWS, (report['id'],))]
+                return report
+        return self.cold.weekly_report(chat_id or 0, week_start, rows)
+    
+    # ========== COORDINAMENTO TRA WORKER ==========
+    
+    def acquire_lease(self, name: str, holder: str, ttl: float, now: Optional[float] = None) -> Dict:
+        """
+        Prende o rinnova il lease: riesce se è già di holder o se è scaduto.
+        Restituisce il lease dopo il tentativo (holder dice chi lo tiene).
+        """
+        now = time.time() if now is None else now
+        with self.writer(immediate=True) as conn:
+            # Nel DO UPDATE i nomi senza prefisso sono i valori attuali della riga
+            conn.execute('''
+                INSERT INTO leases (name, holder, expires_at, heartbeat_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    term = CASE WHEN holder = excluded.holder THEN term ELSE term + 1 END,
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at,
+                    heartbeat_at = excluded.heartbeat_at
+                WHERE holder = excluded.holder OR expires_at <= excluded.heartbeat_at
+            ''', (name, holder, now + ttl, now))
+            return dict(conn.execute('SELECT * FROM leases WHERE name = ?', (name,)).fetchone())
+    
+    def release_lease(self, name: str, holder: str) -> bool:
+        """Lascia il lease (allo spegnimento): un altro worker lo prende subito"""
+        try:
+            with self.writer() as conn:
+                conn.execute(
+                    'UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?',
+                    (name, holder)
+                )
+            return True
+        except Exception as e:
+            print(f"Errore rilascio lease {name}: {e}")
+            return False
+    
+    def claim_notifications(self, name: str, holder: str, claims: List[Tuple[str, str, str, int]],
+                            checkpoint: Optional[str] = None,
+                            now: Optional[float] = None) -> Optional[List[Tuple[str, str, str, int]]]:
+        """
+        Prende in carico le notifiche (giorno, minuto, tipo, destinatario) e
+        restituisce quelle non ancora prese da nessuno: solo queste vanno inviate.
+        Riesce solo se holder tiene ancora il lease (None altrimenti), così un
+        leader che ha perso il lease senza accorgersene non invia niente.
+        Salva anche checkpoint, da cui riparte il prossimo leader.
+        Le righe restano 'claimed' finché finish_notifications non registra l'esito.
+        """
+        now = time.time() if now is None else now
+        try:
+            with self.writer(immediate=True) as conn:
+                held = conn.execute(
+                    'SELECT 1 FROM leases WHERE name = ? AND holder = ? AND expires_at > ?',
+                    (name, holder, now)
+                ).fetchone()
+                if not held:
+                    return None
+                
+                claimed = []
+                for claim in claims:
+                    cursor = conn.execute('''
+                        INSERT OR IGNORE INTO notification_log
+                            (day, minute, kind, target_id, holder, status, claimed_at)
+                        VALUES (?, ?, ?, ?, ?, 'claimed', ?)
+                    ''', (*claim, holder, now))
+                    if cursor.rowcount:
+                        claimed.append(claim)
+                if checkpoint is not None:
+                    conn.execute('UPDATE leases SET checkpoint = ? WHERE name = ?', (checkpoint, name))
+            return claimed
+        except Exception as e:
+            print(f"Errore presa in carico notifiche: {e}")
+            return None
+    
+    def finish_notifications(self, holder: str, results: List[Tuple[Tuple[str, str, str, int], str]],
+                             max_attempts: int = 3) -> bool:
+        """
+        Esito delle notifiche prese in carico da holder: 'sent', 'failed',
+        'skipped' o 'released' (errore temporaneo: la riprende
+        reclaim_notifications, fino a max_attempts tentativi poi 'failed').
+        Le righe riprese nel frattempo da un altro leader non si toccano.
+        """
+        try:
+            with self.writer() as conn:
+                conn.executemany('''
+                    UPDATE notification_log
+                    SET status = CASE WHEN ? = 'released' AND attempts >= ? THEN 'failed' ELSE ? END
+                    WHERE day = ? AND minute = ? AND kind = ? AND target_id = ?
+                      AND holder = ? AND status = 'claimed'
+                ''', [(status, max_attempts, status, *claim, holder) for claim, status in results])
+            return True
+        except Exception as e:
+            print(f"Errore esito notifiche: {e}")
+            return False
+    
+    def reclaim_notifications(self, name: str, holder: str, max_age: float, takeover: bool = False,
+                              now: Optional[float] = None) -> Optional[List[Tuple[str, str, str, int]]]:
+        """
+        Riprende le notifiche da reinviare prese in carico negli ultimi
+        max_age secondi: quelle 'released' e, con takeover (appena diventati
+        leader), anche quelle rimaste 'claimed' da un leader caduto prima di
+        registrare l'esito. L'invio diventa almeno una volta: un leader
+        fermato durante l'invio può averle già consegnate.
+        None se holder non tiene il lease, come claim_notifications.
+        """
+        now = time.time() if now is None else now
+        statuses = ('claimed', 'released') if takeover else ('released',)
+        try:
+            with self.writer(immediate=True) as conn:
+                held = conn.execute(
+                    'SELECT 1 FROM leases WHERE name = ? AND holder = ? AND expires_at > ?',
+                    (name, holder, now)
+                ).fetchone()
+                if not held:
+                    return None
+                
+                rows = conn.execute(f'''
+                    SELECT day, minute, kind, target_id FROM notification_log
+                    WHERE status IN ('claimed', 'released') AND claimed_at >= ?
+                      AND status IN ({','.join('?' * len(statuses))})
+                ''', (now - max_age, *statuses)).fetchall()
+                claims = [tuple(row) for row in rows]
+                conn.executemany('''
+                    UPDATE notification_log
+                    SET holder = ?, status = 'claimed', attempts = attempts + 1, claimed_at = ?
+                    WHERE day = ? AND minute = ? AND kind = ? AND target_id = ?
+                ''', [(holder, now, *claim) for claim in claims])
+            return claims
+        except Exception as e:
+            print(f"Errore ripresa notifiche: {e}")
+            return None
+    
+    def get_change_seq(self) -> int:
+        """Ultima modifica registrata in change_log (punto di partenza di sync_changes)"""
+        with self.reader() as conn:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+    
+    def sync_changes(self, after_seq: int, limit: int = 10000) -> Tuple[int, List[Tuple[str, int]]]:
+        """
+        Modifiche registrate dopo after_seq (anche da altri worker): aggiorna
+        le cache e gli anni dell'archivio freddo e restituisce
+        (ultimo seq, [(entità, id)]) con entità 'user', 'group', 'log' o 'archive'.
+        """
+        with self.reader() as conn:
+            rows = conn.execute('''
+                SELECT seq, entity, entity_id, detail FROM change_log
+                WHERE seq > ? ORDER BY seq LIMIT ?
+            ''', (after_seq, limit)).fetchall()
+        if not rows:
+            return after_seq, []
+        
+        report_users = set()
+        week_totals = set()
+        archived_years = False
+        for row in rows:
+            if row['entity'] == 'user':
+                self.user_cache.invalidate(row['entity_id'])
+                # Orari e promemoria non cambiano report e classifiche
+                if row['detail'] == 'report':
+                    self.leaderboards.invalidate_user(row['entity_id'])
+                    report_users.add(row['entity_id'])
+            elif row['entity'] == 'log':
+                self.report_cache.invalidate_week(_week_start(row['detail']))
+                week_totals.add((row['entity_id'], _week_start(row['detail'])))
+            elif row['entity'] == 'group':
+                self.report_cache.invalidate_chat(row['entity_id'])
+                self.leaderboards.invalidate_chat(row['entity_id'])
+            elif row['entity'] == 'archive' and row['entity_id'] not in self.cold.years:
+                archived_years = True
+        if report_users:
+            # Obiettivi, nomi e utenti attivi cambiano solo i report che contengono quegli utenti
+            with self.reader() as conn:
+                chats = self._user_report_chats(conn, report_users)
+            self.report_cache.invalidate_chats(chats)
+        
+        if archived_years:
+            # Un altro worker ha archiviato un anno nuovo: storico e report passati lo leggono da lì
+            self.cold.years = self.get_archived_years()
+        
+        # Totali settimanali dei check-in degli altri worker nelle classifiche
+        if week_totals:
+            with self.reader() as conn:
+                for user_id, week_start in week_totals:
+                    row = conn.execute(SQL_USER_WEEKLY_ROLLUP, (user_id, week_start)).fetchone()
+                    if row:
+                        self.leaderboards.update_stats(user_id, week_start, row['total_hours'], row['study_days'])
+        
+        return rows[-1]['seq'], [(row['entity'], row['entity_id']) for row in rows]
+    
+    def prune_coordination(self, keep_days: int = 2) -> Dict[str, int]:
+        """Cancella notifiche prese in carico e modifiche più vecchie di keep_days giorni"""
+        with self.writer() as conn:
+            notifications = conn.execute(
+                "DELETE FROM notification_log WHERE day < date('now', ?)", (f'-{keep_days} days',)
+            ).rowcount
+            changes = conn.execute(
+                "DELETE FROM change_log WHERE changed_at < datetime('now', ?)", (f'-{keep_days} days',)
+            ).rowcount
+        return {'notification_log': notifications, 'change_log': changes}
+    
     # ========== UTILITY ==========
     
     def get_week_dates(self, offset: int = 0) -> Tuple[str, str]:
@@ -255,4 +1168,7 @@ class Database:
     
     def backup_database(self) -> str:
         """Restituisce il path del database per backup"""
+        # In WAL le ultime scritture possono stare ancora nel file -wal
+        with self.writer() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
         return self.db_path
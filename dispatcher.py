@@ -0,0 +1,106 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+# Tipi di notifica gestiti dal dispatcher
+CHECKIN = 'checkin'
+REMINDER_START = 'reminder_start'
+REMINDER_END = 'reminder_end'
+NOTIFICATION_KINDS = (CHECKIN, REMINDER_START, REMINDER_END)
+
+# Minuti recuperati al massimo se un tick arriva in ritardo
+MAX_CATCHUP_MINUTES = 5
+
+
+def normalize_time(time_str: Optional[str]) -> Optional[str]:
+    """Normalizza un orario in formato HH:MM (es: '9:5' -> '09:05')"""
+    if not time_str:
+        return None
+    hour, minute = map(int, time_str.split(':'))
+    return f"{hour:02d}:{minute:02d}"
+
+
+class MinuteDispatcher:
+    """
+    Indice in memoria HH:MM -> utenti per ogni tipo di notifica.
+
+    Al posto di un job APScheduler per utente e per notifica, un solo job
+    ogni minuto chiede al dispatcher chi è in scadenza. Aggiornare l'orario
+    di un utente costa O(1) e il numero di job resta costante.
+    """
+
+    def __init__(self):
+        # tipo -> 'HH:MM' -> insieme di user_id
+        self._buckets: Dict[str, Dict[str, Set[int]]] = {
+            kind: defaultdict(set) for kind in NOTIFICATION_KINDS
+        }
+        # tipo -> user_id -> 'HH:MM' (indice inverso per gli aggiornamenti)
+        self._times: Dict[str, Dict[int, str]] = {
+            kind: {} for kind in NOTIFICATION_KINDS
+        }
+        self._last_minute: Optional[datetime] = None
+
+    def set_time(self, kind: str, user_id: int, time_str: Optional[str]):
+        """Imposta (o rimuove, se None) l'orario di una notifica per l'utente"""
+        new_time = normalize_time(time_str)
+        old_time = self._times[kind].get(user_id)
+        if old_time == new_time:
+            return
+
+        if old_time is not None:
+            bucket = self._buckets[kind][old_time]
+            bucket.discard(user_id)
+            if not bucket:
+                del self._buckets[kind][old_time]
+
+        if new_time is None:
+            self._times[kind].pop(user_id, None)
+        else:
+            self._buckets[kind][new_time].add(user_id)
+            self._times[kind][user_id] = new_time
+
+    def remove_user(self, user_id: int):
+        """Rimuove l'utente da tutte le notifiche"""
+        for kind in NOTIFICATION_KINDS:
+            self.set_time(kind, user_id, None)
+
+    def get_time(self, kind: str, user_id: int) -> Optional[str]:
+        return self._times[kind].get(user_id)
+
+    def due(self, kind: str, time_str: str) -> List[int]:
+        """Utenti con notifica 'kind' all'orario HH:MM indicato"""
+        return list(self._buckets[kind].get(time_str, ()))
+
+    def minutes_to_dispatch(self, now: datetime) -> List[str]:
+        """
+        Minuti (HH:MM) da processare a questo tick.
+        Se il tick precedente è stato saltato recupera i minuti mancanti
+        (al massimo MAX_CATCHUP_MINUTES), senza mai ripetere un minuto.
+        """
+        current = now.replace(second=0, microsecond=0)
+        if self._last_minute is None:
+            minutes = [current]
+        elif current <= self._last_minute:
+            minutes = []
+        else:
+            first = max(
+                self._last_minute + timedelta(minutes=1),
+                current - timedelta(minutes=MAX_CATCHUP_MINUTES - 1)
+            )
+            minutes = []
+            minute = first
+            while minute <= current:
+                minutes.append(minute)
+                minute += timedelta(minutes=1)
+
+        if minutes:
+            self._last_minute = current
+        return [minute.strftime('%H:%M') for minute in minutes]
+
+    def resume_from(self, minute: datetime):
+        """Riparte dopo l'ultimo minuto processato (dal checkpoint del leader precedente)"""
+        self._last_minute = minute.replace(second=0, microsecond=0)
+
+    def __len__(self) -> int:
+        """Numero totale di notifiche indicizzate"""
+        return sum(len(times) for times in self._times.values())
@@ -0,0 +1,226 @@
+"""
+Esportazione di daily_logs, users, weekly_reports e weekly_report_rows in CSV
+o JSONL compresso.
+
+Le righe vengono lette dal cursore a blocchi di EXPORT_CHUNK_ROWS
+(fetchmany: SQLite le produce man mano, senza caricare la tabella) e
+scritte direttamente nel file .gz: la memoria resta costante anche con
+anni di log. L'ordinamento segue la chiave primaria, così SQLite non
+deve ordinare il risultato in una tabella temporanea.
+
+La lettura usa una connessione dedicata in sola lettura dentro una
+transazione: in WAL il bot continua a scrivere e l'export resta
+consistente. Tutto è sincrono: dagli handler va chiamato su un thread
+(asyncio.to_thread), come gli snapshot.
+
+weekly_report_rows (le statistiche di ogni partecipante, i report salvati
+dopo la migrazione 10 non hanno più il testo) riporta anche chat_id e
+week_start del suo report: si filtra per data e per utente come gli altri.
+
+Con archive_dir, daily_logs, weekly_reports e weekly_report_rows comprendono
+anche le righe già spostate nell'archivio freddo (archive.py): prima i file
+freddi in ordine di anno, poi il database caldo. Una riga presente in
+entrambi (spostamento in corso o interrotto) viene esportata una volta sola.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from archive import ColdStorage
+
+# Righe lette dal cursore ad ogni blocco
+EXPORT_CHUNK_ROWS = 1000
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Tabelle che hanno righe anche nell'archivio freddo -> tabella calda che
+# contiene l'id della prima colonna (le righe di un report si spostano con lui)
+ARCHIVED_TABLES = {
+    'daily_logs': 'daily_logs',
+    'weekly_reports': 'weekly_reports',
+    'weekly_report_rows': 'weekly_reports',
+}
+
+# Tabelle lette da una join (SQLite la appiattisce: il filtro usa gli indici)
+EXPORT_SOURCES = {
+    'weekly_report_rows': '''(
+        SELECT r.*, w.chat_id, w.week_start
+        FROM weekly_report_rows r JOIN weekly_reports w ON w.id = r.report_id
+    )''',
+}
+
+# tabella -> (colonne, colonna per il filtro di date, colonna utente, ordinamento)
+EXPORT_TABLES = {
+    'daily_logs': (
+        ('id', 'user_id', 'date', 'should_study', 'hours_studied',
+         'distraction_level', 'notes', 'created_at'),
+        'date', 'user_id', 'id',
+    ),
+    'users': (
+        ('user_id', 'username', 'weekly_goal', 'checkin_time', 'reminder_start',
+         'reminder_end', 'joined_date', 'is_active'),
+        'joined_date', 'user_id', 'user_id',
+    ),
+    'weekly_reports': (
+        ('id', 'chat_id', 'week_start', 'week_end', 'total_users', 'active_users',
+         'total_hours', 'goals_reached', 'report_text', 'created_at'),
+        'week_start', None, 'id',
+    ),
+    'weekly_report_rows': (
+        ('report_id', 'chat_id', 'week_start', 'user_id', 'username', 'weekly_goal',
+         'total_hours', 'study_days', 'total_study_days', 'avg_distraction',
+         'notes_count', 'goal_reached'),
+        'week_start', 'user_id', 'report_id, user_id',
+    ),
+}
+
+
+def parse_export_args(args: List[str]) -> Dict:
+    """
+    Argomenti di /export e di manage.py export:
+    <tabella> [csv|jsonl] [dal AAAA-MM-GG] [al AAAA-MM-GG] [user_id]
+    (dopo la tabella in qualsiasi ordine; la prima data è l'inizio, la seconda la fine)
+    """
+    if not args:
+        raise ValueError("Tabella mancante")
+    options = {'table': args[0], 'fmt': 'csv', 'start': None, 'end': None, 'user_id': None}
+    dates = []
+    for arg in args[1:]:
+        if arg.lower() in EXPORT_FORMATS:
+            options['fmt'] = arg.lower()
+        elif arg.lstrip('-').isdigit():
+            options['user_id'] = int(arg)
+        else:
+            try:
+                dates.append(datetime.strptime(arg, '%Y-%m-%d').date())
+            except ValueError:
+                raise ValueError(f"Argomento non valido: {arg}")
+    if len(dates) > 2:
+        raise ValueError("Al massimo due date (inizio e fine)")
+    if dates:
+        options['start'] = dates[0]
+    if len(dates) == 2:
+        options['end'] = dates[1]
+    if options['start'] and options['end'] and options['start'] > options['end']:
+        raise ValueError("La data di inizio è dopo la data di fine")
+    build_export_query(options['table'], options['start'], options['end'], options['user_id'])
+    return options
+
+
+def build_export_query(table: str, start: Optional[date] = None, end: Optional[date] = None,
+                       user_id: Optional[int] = None) -> Tuple[str, tuple]:
+    """Query e parametri per esportare la tabella con i filtri indicati"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Tabella non esportabile: {table} (disponibili: {', '.join(EXPORT_TABLES)})")
+    columns, date_column, user_column, order = EXPORT_TABLES[table]
+
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append(f'{date_column} >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        conditions.append(f'{date_column} <= ?')
+        params.append(end.isoformat())
+    if user_id is not None:
+        if user_column is None:
+            raise ValueError(f"La tabella {table} non si può filtrare per utente")
+        conditions.append(f'{user_column} = ?')
+        params.append(user_id)
+
+    sql = f"SELECT {', '.join(columns)} FROM {EXPORT_SOURCES.get(table, table)}"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {order}'
+    return sql, tuple(params)
+
+
+def _cold_chunks(conn: sqlite3.Connection, table: str, archive_dir: str,
+                 sql: str, params: tuple, chunk_rows: int) -> Iterator[List[Tuple]]:
+    """
+    Blocchi di righe dai file freddi, senza quelle ancora presenti nel caldo.
+    conn è già in transazione: il confronto avviene sulla stessa istantanea
+    del caldo che viene esportata dopo.
+    """
+    years = [row[0] for row in conn.execute('SELECT year FROM archive_segments ORDER BY year')]
+    for cursor in ColdStorage(archive_dir, years).iter_rows(sql, params):
+        while True:
+            chunk = cursor.fetchmany(chunk_rows)
+            if not chunk:
+                break
+            ids = list({row[0] for row in chunk})
+            placeholders = ', '.join('?' * len(ids))
+            hot = {row[0] for row in conn.execute(
+                f'SELECT id FROM {ARCHIVED_TABLES[table]} WHERE id IN ({placeholders})', ids
+            )}
+            if hot:
+                chunk = [row for row in chunk if row[0] not in hot]
+            if chunk:
+                yield chunk
+
+
+def export_table(db_path: str, table: str, dest_path: str, fmt: str = 'csv',
+                 start: Optional[date] = None, end: Optional[date] = None,
+                 user_id: Optional[int] = None, chunk_rows: int = EXPORT_CHUNK_ROWS,
+                 archive_dir: Optional[str] = None) -> Dict:
+    """
+    Esporta la tabella in dest_path (gzip) e restituisce
+    {'path', 'table', 'format', 'rows', 'size'}.
+    Con archive_dir vengono esportate anche le righe archiviate.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato non valido: {fmt} (disponibili: {', '.join(EXPORT_FORMATS)})")
+    sql, params = build_export_query(table, start, end, user_id)
+    columns = EXPORT_TABLES[table][0]
+
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    rows = 0
+    try:
+        conn.execute('BEGIN')
+        # La prima lettura fissa l'istantanea del caldo per tutto l'export
+        cold = (_cold_chunks(conn, table, archive_dir, sql, params, chunk_rows)
+                if archive_dir and table in ARCHIVED_TABLES else ())
+        with gzip.open(dest_path, 'wb', compresslevel=6) as raw:
+            with io.TextIOWrapper(raw, encoding='utf-8', newline='') as out:
+                if fmt == 'csv':
+                    writer = csv.writer(out)
+                    writer.writerow(columns)
+                    write_chunk = writer.writerows
+                else:
+                    def write_chunk(chunk):
+                        out.writelines(
+                            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                            for row in chunk
+                        )
+
+                for chunk in cold:
+                    write_chunk(chunk)
+                    rows += len(chunk)
+
+                cursor = conn.execute(sql, params)
+                while True:
+                    chunk = cursor.fetchmany(chunk_rows)
+                    if not chunk:
+                        break
+                    write_chunk(chunk)
+                    rows += len(chunk)
+        conn.rollback()
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    finally:
+        conn.close()
+
+    return {
+        'path': dest_path,
+        'table': table,
+        'format': fmt,
+        'rows': rows,
+        'size': os.path.getsize(dest_path),
+    }
@@ -0,0 +1,79 @@
+from typing import Dict, Optional, Set
+
+from async_database import AsyncDatabase
+
+
+class GroupRegistry:
+    """
+    Gruppi in cui si trova il bot e utenti che ne fanno parte.
+
+    Il registro è tenuto in memoria (caricato dal database al primo uso) e
+    ogni modifica viene scritta su SQLite: gli handler lo aggiornano ad ogni
+    messaggio di gruppo, ma si scrive solo quando cambia qualcosa.
+    """
+
+    def __init__(self, adb: AsyncDatabase):
+        self.adb = adb
+        # chat_id -> {'title': ..., 'members': set di user_id}
+        self._groups: Optional[Dict[int, Dict]] = None
+
+    def invalidate(self):
+        """Gruppi cambiati da un altro worker: si ricaricano al prossimo uso"""
+        self._groups = None
+
+    async def _loaded(self) -> Dict[int, Dict]:
+        if self._groups is None:
+            self._groups = await self.adb.get_active_groups()
+        return self._groups
+
+    async def add_group(self, chat_id: int, title: Optional[str] = None):
+        groups = await self._loaded()
+        group = groups.get(chat_id)
+        if group is not None and (title is None or group['title'] == title):
+            return
+        if group is None:
+            groups[chat_id] = {'title': title, 'members': set()}
+        else:
+            group['title'] = title
+        await self.adb.add_group(chat_id, title)
+
+    async def remove_group(self, chat_id: int):
+        groups = await self._loaded()
+        if groups.pop(chat_id, None) is not None:
+            await self.adb.deactivate_group(chat_id)
+
+    async def migrate_group(self, old_chat_id: int, new_chat_id: int):
+        """Il gruppo è diventato un supergruppo: i membri passano al nuovo chat_id"""
+        groups = await self._loaded()
+        old = groups.get(old_chat_id)
+        await self.add_group(new_chat_id, old['title'] if old else None)
+        if old is not None:
+            for user_id in old['members']:
+                await self.add_member(new_chat_id, user_id)
+            await self.remove_group(old_chat_id)
+
+    async def add_member(self, chat_id: int, user_id: int, title: Optional[str] = None):
+        """Registra l'utente nel gruppo (e il gruppo, se è nuovo)"""
+        groups = await self._loaded()
+        if chat_id not in groups:
+            await self.add_group(chat_id, title)
+        members = groups[chat_id]['members']
+        if user_id in members:
+            return
+        members.add(user_id)
+        await self.adb.add_group_member(chat_id, user_id)
+
+    async def remove_member(self, chat_id: int, user_id: int):
+        groups = await self._loaded()
+        group = groups.get(chat_id)
+        if group is not None and user_id in group['members']:
+            group['members'].discard(user_id)
+            await self.adb.remove_group_member(chat_id, user_id)
+
+    async def members(self, chat_id: int) -> Set[int]:
+        group = (await self._loaded()).get(chat_id)
+        return set(group['members']) if group else set()
+
+    async def groups(self) -> Dict[int, Set[int]]:
+        """Gruppi attivi: {chat_id: membri}"""
+        return {chat_id: set(group['members']) for chat_id, group in (await self._loaded()).items()}
@@ -0,0 +1,158 @@
+"""
+Classifiche settimanali dei gruppi (/leaderboard), tenute aggiornate ad ogni check-in.
+
+Per ogni (gruppo, settimana) richiesto almeno una volta c'è in memoria
+una classifica per metrica: le chiavi di ordinamento dei membri in una
+lista ordinata (bisect) più i valori per utente. Il check-in di un utente
+sposta solo la sua chiave (ricerca O(log n)); primi K e posizione di un
+utente si leggono con una bisezione, senza ricalcolare il report.
+
+La classifica si costruisce dal rollup weekly_user_stats al primo uso
+(Database.get_leaderboard) e viene scartata quando cambiano i membri del
+gruppo o i dati di un utente (nome, attivazione): si ricostruisce alla
+richiesta successiva. Come le altre cache non sopravvive al riavvio.
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Metriche della classifica: ore studiate o percentuale dell'obiettivo settimanale
+METRICS = ('ore', 'obiettivo')
+
+# Chiave: (chat_id del gruppo o None per tutti gli utenti, lunedì della settimana)
+BoardKey = Tuple[Optional[int], str]
+
+
+def _sort_key(metric: str, user_id: int, entry: Dict) -> Tuple:
+    """Chiave crescente = posizione in classifica (valori negati: il più alto prima)"""
+    if metric == 'obiettivo':
+        return (-completion(entry), -entry['total_hours'], user_id)
+    return (-entry['total_hours'], -entry['study_days'], user_id)
+
+
+def completion(entry: Dict) -> float:
+    """Frazione dell'obiettivo settimanale raggiunta (0 senza obiettivo)"""
+    goal = entry['weekly_goal']
+    return entry['total_hours'] / goal if goal else 0.0
+
+
+class Leaderboard:
+    """Classifica di un gruppo in una settimana per una metrica"""
+
+    def __init__(self, metric: str):
+        self.metric = metric
+        self._keys: List[Tuple] = []
+        self._user_keys: Dict[int, Tuple] = {}
+        self.entries: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.entries
+
+    def set(self, user_id: int, entry: Dict):
+        """Inserisce o sposta l'utente con i nuovi valori"""
+        old = self._user_keys.get(user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        key = _sort_key(self.metric, user_id, entry)
+        insort(self._keys, key)
+        self._user_keys[user_id] = key
+        self.entries[user_id] = entry
+
+    def _position(self, key: Tuple) -> int:
+        # A pari valore della metrica stessa posizione (1, 2, 2, 4)
+        return bisect_left(self._keys, key[:1]) + 1
+
+    def rank(self, user_id: int) -> Optional[int]:
+        key = self._user_keys.get(user_id)
+        return None if key is None else self._position(key)
+
+    def top(self, k: int) -> List[Tuple[int, int, Dict]]:
+        """Primi k come (posizione, user_id, valori)"""
+        return [(self._position(key), key[-1], self.entries[key[-1]]) for key in self._keys[:k]]
+
+
+class LeaderboardIndex:
+    """
+    Classifiche in memoria per (gruppo, settimana), LRU come ReportCache.
+    Thread-safe: gli aggiornamenti arrivano dal thread di scrittura dopo il
+    commit, le letture dal pool di lettura. Chi costruisce una classifica
+    tiene il lock anche durante la lettura dal database, così nessun
+    aggiornamento arrivato nel frattempo va perso.
+    """
+
+    def __init__(self, max_boards: int = 256):
+        self.max_boards = max_boards
+        self._boards: "OrderedDict[BoardKey, Dict[str, Leaderboard]]" = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, chat_id: Optional[int], week_start: str) -> Optional[Dict[str, Leaderboard]]:
+        key = (chat_id, week_start)
+        with self.lock:
+            boards = self._boards.get(key)
+            if boards is not None:
+                self._boards.move_to_end(key)
+            return boards
+
+    def build(self, chat_id: Optional[int], week_start: str, rows: Iterable[Dict]) -> Dict[str, Leaderboard]:
+        """Classifiche dai valori dei membri (user_id, username, weekly_goal, total_hours, study_days)"""
+        boards = {metric: Leaderboard(metric) for metric in METRICS}
+        for row in rows:
+            entry = {
+                'username': row['username'],
+                'weekly_goal': row['weekly_goal'] or 0,
+                'total_hours': row['total_hours'] or 0.0,
+                'study_days': row['study_days'] or 0,
+            }
+            for board in boards.values():
+                board.set(row['user_id'], entry)
+
+        with self.lock:
+            self._boards[(chat_id, week_start)] = boards
+            while len(self._boards) > self.max_boards:
+                self._boards.popitem(last=False)
+        return boards
+
+    def _update(self, user_id: int, week_start: Optional[str], **fields):
+        with self.lock:
+            for (_, board_week), boards in self._boards.items():
+                if week_start is not None and board_week != week_start:
+                    continue
+                first = next(iter(boards.values()))
+                if user_id not in first:
+                    continue
+                entry = dict(first.entries[user_id], **fields)
+                for board in boards.values():
+                    board.set(user_id, entry)
+
+    def update_stats(self, user_id: int, week_start: str, total_hours: float, study_days: int):
+        """Nuovi totali della settimana dopo un check-in"""
+        self._update(user_id, week_start, total_hours=total_hours, study_days=study_days)
+
+    def update_goal(self, user_id: int, weekly_goal: int):
+        """Nuovo obiettivo: cambia la metrica 'obiettivo' in tutte le settimane"""
+        self._update(user_id, None, weekly_goal=weekly_goal or 0)
+
+    def invalidate_user(self, user_id: int):
+        """Nome o stato dell'utente cambiati: le sue classifiche si ricostruiscono"""
+        with self.lock:
+            for key in [key for key, boards in self._boards.items()
+                        if user_id in next(iter(boards.values()))]:
+                del self._boards[key]
+
+    def invalidate_chat(self, chat_id: int):
+        """Sono cambiati i membri del gruppo"""
+        with self.lock:
+            for key in [key for key in self._boards if key[0] == chat_id]:
+                del self._boards[key]
+
+    def clear(self):
+        """Cambio che tocca tutte le classifiche (nuovo utente, rollup ricalcolato)"""
+        with self.lock:
+            self._boards.clear()
+
+    def __len__(self) -> int:
+        return len(self._boards)
@@ -0,0 +1,676 @@
+"""
+Load test del bot contro una Bot API finta in locale.
+
+Avvia l'Application di bot.py puntandola ad un server HTTP locale che
+risponde come Telegram, popola un database di prova con N utenti e mesi
+di daily_logs, poi invia /start, /checkin (con i bottoni), /mystats e
+/weekly al ritmo richiesto. Alla fine stampa per ogni comando latenza
+p50/p95/p99, throughput e tempo passato nel database, più il tempo dello
+scheduler per indicizzare gli utenti e inviare le notifiche del minuto
+più affollato.
+
+Uso:
+    python loadtest.py --users 2000 --days 120 --rate 50 --duration 30
+    python loadtest.py --json risultati.json            # salva i risultati
+    python loadtest.py --baseline risultati.json        # confronta con un run precedente
+
+Gli update passano da application.update_queue come in produzione: il bot
+ne elabora al massimo CONCURRENT_UPDATES alla volta (--concurrent-updates),
+gli altri aspettano in coda e l'attesa entra nella latenza.
+
+Di default la Bot API finta non ha limiti (--api-rate alto, --chat-interval 0)
+così si misura il bot e non i limiti di Telegram: con --api-rate 30
+--chat-interval 1 si riproducono quelli reali.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import socket
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+from sql_trace import format_report as format_sql_trace
+
+# Utenti sintetici: id alti per non confondersi con utenti veri
+FIRST_USER_ID = 900_000_000
+CHECKIN_TIMES = ['21:00', '21:30', '22:00', '22:30', '23:00', '23:30']
+REMINDER_TIMES = [('18:00', '20:00'), ('19:00', '20:30'), ('20:00', '22:00')]
+
+DEFAULT_MIX = 'start=1,checkin=4,mystats=4,weekly=1'
+# Scostamento oltre il quale il confronto con --baseline segnala una regressione
+REGRESSION_THRESHOLD = 0.2
+
+# Accumulatore del tempo database dell'update in corso (vedi AsyncDatabase.add_query_listener)
+current_db_time = contextvars.ContextVar('current_db_time', default=None)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# ========== BOT API FINTA ==========
+
+class FakeBotAPI:
+    """
+    Server locale che risponde come la Bot API di Telegram.
+
+    Usa lo stesso WebServer di run.py: una route per ogni metodo usato dal
+    bot. Le risposte sono minime ma valide per python-telegram-bot.
+    Con latency > 0 simula il tempo di andata e ritorno verso Telegram.
+    """
+
+    METHODS = ('getMe', 'sendMessage', 'editMessageText', 'answerCallbackQuery',
+               'sendDocument', 'setWebhook', 'deleteWebhook', 'getUpdates', 'close')
+
+    def __init__(self, token: str, port: int, latency: float = 0.0):
+        from web_server import WebServer
+
+        self.token = token
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_id = 0
+        # Il server serve solo le route aggiunte qui sotto, niente webhook
+        self.server = WebServer(None, host='127.0.0.1', port=port)
+        self.server.routes.clear()
+        for method in self.METHODS:
+            self.server.add_route('POST', f'/bot{token}/{method}', self.handle)
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    async def handle(self, path: str, headers: Dict[str, str], body: bytes):
+        method = path.rsplit('/', 1)[-1]
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = {}
+        if headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+        elif method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            self._message_id += 1
+            chat_id = int(params.get('chat_id', 1))
+            result = {
+                'message_id': int(params.get('message_id', self._message_id)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        return 200, 'application/json', body, {}
+
+
+# ========== DATI DI PROVA ==========
+
+def seed_database(db, users: int, days: int, seed: int = 42) -> Dict[str, int]:
+    """Crea utenti sintetici con 'days' giorni di daily_logs e ricostruisce il rollup"""
+    rng = random.Random(seed)
+    today = datetime.now().date()
+
+    user_rows = []
+    log_rows = []
+    for number in range(users):
+        user_id = FIRST_USER_ID + number
+        reminder_start, reminder_end = rng.choice(REMINDER_TIMES)
+        user_rows.append((
+            user_id, f'user{number}', rng.choice([10, 15, 20, 25, 30]),
+            rng.choice(CHECKIN_TIMES), reminder_start, reminder_end
+        ))
+        for offset in range(1, days + 1):
+            # Non tutti fanno il check-in ogni giorno
+            if rng.random() > 0.85:
+                continue
+            should_study = rng.random() < 0.8
+            hours = rng.choice([0, 0.5, 1, 1.5, 2, 2.5, 3]) if should_study else 0
+            notes = rng.choice(['', '', '', 'capitolo 3', 'esercizi']) if should_study else 'Giorno libero'
+            log_rows.append((
+                user_id, (today - timedelta(days=offset)).strftime('%Y-%m-%d'),
+                should_study, hours, rng.choice(['low', 'medium', 'high']), notes
+            ))
+
+    with db.writer() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO users
+                (user_id, username, weekly_goal, checkin_time, reminder_start, reminder_end)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', user_rows)
+        conn.executemany('''
+            INSERT OR REPLACE INTO daily_logs
+                (user_id, date, should_study, hours_studied, distraction_level, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', log_rows)
+    db.rebuild_weekly_rollup()
+    db.user_cache.clear()
+    return {'users': len(user_rows), 'daily_logs': len(log_rows)}
+
+
+# ========== UPDATE SINTETICI ==========
+
+class UpdateFactory:
+    """Costruisce gli Update che Telegram invierebbe al bot"""
+
+    def __init__(self, application):
+        self.application = application
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def _user(self, user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Load',
+                'username': f'user{user_id - FIRST_USER_ID}'}
+
+    def command(self, user_id: int, text: str):
+        from telegram import Update
+
+        update_id, message_id = self._next_ids()
+        command = text.split()[0]
+        data = {
+            'update_id': update_id,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id),
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+            },
+        }
+        return Update.de_json(data, self.application.bot)
+
+    def start_checkin(self, user_id: int):
+        import checkin_flow
+
+        return checkin_flow.start(user_id, datetime.now().date())
+
+    def checkin_button(self, user_id: int, answers, step: str, value):
+        """Click sul bottone del check-in con quel valore: (update, risposte aggiornate)"""
+        import checkin_flow
+
+        # Stessa chiave del bot: le risposte viaggiano firmate nel callback_data
+        key = checkin_flow.signing_key(self.application.bot.token)
+        option = checkin_flow.option_index(step, value)
+        callback_data = checkin_flow.encode(step, option, answers, key)
+        return self.button(user_id, callback_data), answers.answer(step, option)
+
+    def button(self, user_id: int, callback_data: str):
+        from telegram import Update
+
+        update_id, message_id = self._next_ids()
+        data = {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': callback_data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': 'check-in',
+                },
+            },
+        }
+        return Update.de_json(data, self.application.bot)
+
+
+# ========== RACCOLTA RISULTATI ==========
+
+class Results:
+    """Latenze e tempo database per comando, tempo per metodo di Database"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.db_times: Dict[str, List[float]] = defaultdict(list)
+        self.db_calls: Dict[str, List[int]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.method_times: Dict[str, List[float]] = defaultdict(list)
+        # Update nella coda dell'Application: update_id -> (accumulatore tempo database, fine)
+        self.in_flight: Dict[int, tuple] = {}
+        self.started = 0.0
+        self.finished = 0.0
+
+    def on_query(self, name: str, elapsed: float, write: bool):
+        self.method_times[name].append(elapsed)
+        accumulator = current_db_time.get()
+        if accumulator is not None:
+            accumulator[0] += elapsed
+            accumulator[1] += 1
+
+    def summary(self) -> Dict:
+        duration = max(self.finished - self.started, 1e-9)
+        commands = {}
+        for name, values in sorted(self.latencies.items()):
+            commands[name] = {
+                'count': len(values),
+                'errors': self.errors.get(name, 0),
+                'throughput': len(values) / duration,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': max(values) * 1000,
+                'db_ms_mean': sum(self.db_times[name]) / len(values) * 1000,
+                'db_ms_p95': percentile(self.db_times[name], 95) * 1000,
+                'db_calls_mean': sum(self.db_calls[name]) / len(values),
+            }
+
+        methods = {}
+        for name, values in sorted(self.method_times.items()):
+            methods[name] = {
+                'count': len(values),
+                'total_ms': sum(values) * 1000,
+                'mean_ms': sum(values) / len(values) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+            }
+
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            'duration_s': duration,
+            'updates': total,
+            'throughput': total / duration,
+            'commands': commands,
+            'db_methods': methods,
+        }
+
+
+# ========== SCENARI ==========
+
+async def timed_update(application, results: Results, name: str, update):
+    """
+    Mette l'update nella coda dell'Application, come fanno polling e webhook,
+    e ne misura latenza (attesa in coda compresa) e tempo nel database.
+    Inizio e fine li segnano gli handler di track_updates.
+    """
+    accumulator = [0.0, 0]
+    finished = asyncio.get_running_loop().create_future()
+    results.in_flight[update.update_id] = (accumulator, finished)
+    start = time.perf_counter()
+    try:
+        await application.update_queue.put(update)
+        await finished
+    finally:
+        elapsed = time.perf_counter() - start
+        del results.in_flight[update.update_id]
+        results.latencies[name].append(elapsed)
+        results.db_times[name].append(accumulator[0])
+        results.db_calls[name].append(accumulator[1])
+
+
+async def run_scenario(application, factory: UpdateFactory, results: Results,
+                       scenario: str, user_id: int, rng: random.Random):
+    if scenario == 'start':
+        await timed_update(application, results, '/start', factory.command(user_id, '/start'))
+    elif scenario == 'mystats':
+        await timed_update(application, results, '/mystats', factory.command(user_id, '/mystats'))
+    elif scenario == 'weekly':
+        await timed_update(application, results, '/weekly', factory.command(user_id, '/weekly'))
+    elif scenario == 'checkin':
+        await timed_update(application, results, '/checkin', factory.command(user_id, '/checkin'))
+        if rng.random() < 0.1:
+            steps = [('button:checkin_no', 'should_study', False)]
+        else:
+            steps = [
+                ('button:checkin_yes', 'should_study', True),
+                ('button:hours', 'hours', rng.choice([0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0])),
+                ('button:distraction', 'distraction', rng.choice(['low', 'medium', 'high'])),
+            ]
+        answers = factory.start_checkin(user_id)
+        for name, step, value in steps:
+            update, answers = factory.checkin_button(user_id, answers, step, value)
+            await timed_update(application, results, name, update)
+
+
+def track_updates(application, results: Results):
+    """
+    Handler prima e dopo tutti quelli del bot: il primo attribuisce le query
+    all'update (il task lo crea l'Application), l'ultimo segnala la fine a
+    timed_update. Gli handler del bot non fermano la catena
+    (ApplicationHandlerStop): l'ultimo gruppo gira sempre, anche dopo un errore.
+    """
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    async def begin(update, context):
+        accumulator, _ = results.in_flight.get(update.update_id, (None, None))
+        current_db_time.set(accumulator)
+
+    async def end(update, context):
+        _, finished = results.in_flight.get(update.update_id, (None, None))
+        if finished is not None and not finished.done():
+            finished.set_result(None)
+
+    application.add_handler(TypeHandler(Update, begin), group=-1000)
+    application.add_handler(TypeHandler(Update, end), group=1000)
+
+
+def button_name(callback_data: str, key: bytes) -> str:
+    """Nome del bottone nelle statistiche (come in run_scenario), dal callback_data del check-in"""
+    import checkin_flow
+
+    try:
+        step, answers = checkin_flow.decode(callback_data, key)
+    except ValueError:
+        return f"button:{checkin_flow.peek_step(callback_data) or 'sconosciuto'}"
+    if step == checkin_flow.FIRST_STEP:
+        return 'button:checkin_yes' if answers.value(step) else 'button:checkin_no'
+    return f'button:{step}'
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('start', 'checkin', 'mystats', 'weekly'):
+            raise ValueError(f"Scenario sconosciuto: {name}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+async def drive_load(application, results: Results, users: int, rate: float,
+                     duration: float, concurrency: int, mix: Dict[str, int], seed: int):
+    """
+    Arrivi a ritmo costante (open loop) per 'duration' secondi.
+    Oltre 'concurrency' scenari in corso gli arrivi aspettano: in quel caso
+    il throughput misurato resta sotto il rate richiesto.
+    """
+    rng = random.Random(seed)
+    factory = UpdateFactory(application)
+    scenarios = list(mix)
+    weights = [mix[name] for name in scenarios]
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    new_user_id = FIRST_USER_ID + users
+
+    async def one(scenario: str, user_id: int):
+        try:
+            await run_scenario(application, factory, results, scenario, user_id, rng)
+        finally:
+            slots.release()
+
+    loop = asyncio.get_running_loop()
+    results.started = loop.time()
+    next_arrival = results.started
+    while loop.time() - results.started < duration:
+        scenario = rng.choices(scenarios, weights)[0]
+        if scenario == 'start':
+            user_id = new_user_id
+            new_user_id += 1
+        else:
+            user_id = FIRST_USER_ID + rng.randrange(users)
+
+        await slots.acquire()
+        task = asyncio.create_task(one(scenario, user_id))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+        next_arrival += 1 / rate
+        delay = next_arrival - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    results.finished = loop.time()
+
+
+async def bench_scheduler(bot_module, application) -> Dict:
+    """Caricamento degli orari come all'avvio (a blocchi) e invio del minuto più affollato"""
+    from dispatcher import MinuteDispatcher, NOTIFICATION_KINDS
+
+    start = time.perf_counter()
+    application.minute_dispatcher = dispatcher = MinuteDispatcher()
+    application.schedules_pending = set()
+    application.schedules_ready = asyncio.Event()
+    await bot_module.load_schedules(application)
+    index_time = time.perf_counter() - start
+    users = await bot_module.adb.get_all_active_users()
+
+    minutes = [f'{hour:02d}:{minute:02d}' for hour in range(24) for minute in range(60)]
+    busiest = max(minutes, key=lambda minute: sum(
+        len(dispatcher.due(kind, minute)) for kind in NOTIFICATION_KINDS
+    ))
+
+    senders = {
+        'checkin': bot_module.send_user_checkin,
+        'reminder_start': bot_module.send_start_reminder,
+        'reminder_end': bot_module.send_end_reminder,
+    }
+    start = time.perf_counter()
+    tasks = [
+        senders[kind](application, user_id)
+        for kind in NOTIFICATION_KINDS
+        for user_id in dispatcher.due(kind, busiest)
+    ]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    fanout_time = time.perf_counter() - start
+
+    return {
+        'users': len(users),
+        'indexed': len(dispatcher),
+        'index_ms': index_time * 1000,
+        'busiest_minute': busiest,
+        'notifications': len(tasks),
+        'fanout_ms': fanout_time * 1000,
+        'notifications_per_s': len(tasks) / fanout_time if fanout_time else 0.0,
+    }
+
+
+# ========== REPORT ==========
+
+def print_report(report: Dict):
+    seed = report['seed']
+    print(f"\nDatabase: {seed['users']} utenti, {seed['daily_logs']} daily_logs "
+          f"(popolato in {seed['seed_s']:.1f}s)")
+
+    load = report['load']
+    print(f"\nCarico: {load['updates']} update in {load['duration_s']:.1f}s "
+          f"({load['throughput']:.1f} update/s)\n")
+    header = (f"{'comando':<22}{'n':>7}{'err':>5}{'/s':>8}{'p50':>9}{'p95':>9}"
+              f"{'p99':>9}{'max':>9}{'db':>8}{'db p95':>8}{'query':>7}")
+    print(header)
+    print('-' * len(header))
+    for name, stats in load['commands'].items():
+        print(f"{name:<22}{stats['count']:>7}{stats['errors']:>5}{stats['throughput']:>8.1f}"
+              f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+              f"{stats['max_ms']:>9.2f}{stats['db_ms_mean']:>8.2f}{stats['db_ms_p95']:>8.2f}"
+              f"{stats['db_calls_mean']:>7.1f}")
+    print("(tempi in ms; db = tempo medio nel database per update, query = operazioni per update)")
+
+    print(f"\n{'metodo Database':<32}{'n':>8}{'totale ms':>12}{'medio ms':>10}{'p95 ms':>10}")
+    for name, stats in load['db_methods'].items():
+        print(f"{name:<32}{stats['count']:>8}{stats['total_ms']:>12.1f}"
+              f"{stats['mean_ms']:>10.3f}{stats['p95_ms']:>10.3f}")
+
+    scheduler = report['scheduler']
+    print(f"\nScheduler: {scheduler['indexed']} orari di {scheduler['users']} utenti indicizzati in "
+          f"{scheduler['index_ms']:.1f} ms; minuto più affollato {scheduler['busiest_minute']}: "
+          f"{scheduler['notifications']} notifiche in {scheduler['fanout_ms']:.1f} ms "
+          f"({scheduler['notifications_per_s']:.0f}/s)")
+
+    print(f"\nChiamate alla Bot API: {dict(sorted(report['api_calls'].items()))}")
+    if report.get('sql_trace'):
+        print()
+        print(format_sql_trace(report['sql_trace']))
+
+
+def compare_with_baseline(report: Dict, baseline: Dict) -> int:
+    """Confronta p95 e tempo database con un run precedente; 1 se c'è una regressione"""
+    regressions = []
+    for name, stats in report['load']['commands'].items():
+        old = baseline.get('load', {}).get('commands', {}).get(name)
+        if not old:
+            continue
+        for key in ('p95_ms', 'db_ms_mean'):
+            if old[key] > 0 and stats[key] > old[key] * (1 + REGRESSION_THRESHOLD):
+                regressions.append(f"{name} {key}: {old[key]:.2f} -> {stats[key]:.2f}")
+
+    old_fanout = baseline.get('scheduler', {}).get('fanout_ms', 0)
+    new_fanout = report['scheduler']['fanout_ms']
+    if old_fanout > 0 and new_fanout > old_fanout * (1 + REGRESSION_THRESHOLD):
+        regressions.append(f"scheduler fanout_ms: {old_fanout:.1f} -> {new_fanout:.1f}")
+
+    if not regressions:
+        print(f"\nNessuna regressione oltre il {REGRESSION_THRESHOLD:.0%} rispetto al baseline")
+        return 0
+    print(f"\nRegressioni oltre il {REGRESSION_THRESHOLD:.0%} rispetto al baseline:")
+    for regression in regressions:
+        print(f"  {regression}")
+    return 1
+
+
+# ========== MAIN ==========
+
+async def run_load_test(args) -> Dict:
+    # bot.py legge la configurazione all'import: va importato dopo aver impostato l'ambiente
+    import bot
+    import checkin_flow
+    from rate_limiter import PriorityRateLimiter
+
+    api = FakeBotAPI(os.environ['BOT_TOKEN'], args.api_port, latency=args.api_latency / 1000)
+    await api.start()
+
+    start = time.perf_counter()
+    seed_info = seed_database(bot.db, args.users, args.days, args.seed)
+    seed_info['seed_s'] = time.perf_counter() - start
+    if bot.db.tracer is not None:
+        # Solo le query del carico, non quelle del popolamento
+        bot.db.tracer.reset()
+
+    application = bot.build_application(PriorityRateLimiter(
+        overall_max_rate=args.api_rate, private_chat_interval=args.chat_interval
+    ))
+    results = Results()
+
+    key = checkin_flow.signing_key(application.bot.token)
+
+    async def count_error(update, context):
+        if update is not None and update.callback_query:
+            name = button_name(update.callback_query.data, key)
+        elif update is not None and update.effective_message:
+            name = update.effective_message.text.split()[0]
+        else:
+            name = 'sconosciuto'
+        results.errors[name] += 1
+
+    application.add_error_handler(count_error)
+    track_updates(application, results)
+    bot.adb.add_query_listener(results.on_query)
+
+    await application.initialize()
+    # Consuma update_queue con lo stesso limite di update in parallelo della produzione
+    await application.start()
+    try:
+        scheduler = await bench_scheduler(bot, application)
+        await drive_load(application, results, args.users, args.rate, args.duration,
+                         args.concurrency, parse_mix(args.mix), args.seed)
+        await bot.adb.barrier()
+        sql_trace = bot.db.sql_trace_report()
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+        bot.adb.shutdown()
+
+    return {
+        'args': vars(args),
+        'seed': seed_info,
+        'load': results.summary(),
+        'scheduler': scheduler,
+        'api_calls': dict(api.calls),
+        'sql_trace': sql_trace,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test del bot con una Bot API finta")
+    parser.add_argument('--users', type=int, default=1000, help="utenti sintetici")
+    parser.add_argument('--days', type=int, default=90, help="giorni di daily_logs per utente")
+    parser.add_argument('--rate', type=float, default=50, help="scenari al secondo")
+    parser.add_argument('--duration', type=float, default=20, help="durata in secondi")
+    parser.add_argument('--concurrency', type=int, default=200, help="scenari in corso al massimo")
+    parser.add_argument('--concurrent-updates', type=int,
+                        help="update elaborati in parallelo dal bot (default: CONCURRENT_UPDATES)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="pesi degli scenari")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help="file database (default: file temporaneo)")
+    parser.add_argument('--api-port', type=int, default=0, help="porta della Bot API finta")
+    parser.add_argument('--api-latency', type=float, default=0, help="latenza simulata della Bot API (ms)")
+    parser.add_argument('--api-rate', type=float, default=10000, help="richieste/s verso la Bot API")
+    parser.add_argument('--chat-interval', type=float, default=0, help="secondi tra messaggi alla stessa chat")
+    parser.add_argument('--json', help="salva i risultati in questo file")
+    parser.add_argument('--baseline', help="confronta con i risultati salvati di un run precedente")
+    parser.add_argument('--sql-trace', action='store_true', help="traccia le query SQL (SQL_TRACE=1)")
+    args = parser.parse_args()
+
+    if not args.api_port:
+        args.api_port = free_port()
+
+    db_dir = None
+    if not args.db:
+        db_dir = tempfile.TemporaryDirectory(prefix='loadtest-')
+        args.db = os.path.join(db_dir.name, 'loadtest.db')
+
+    token = '123456:LOADTEST'
+    os.environ['BOT_TOKEN'] = token
+    os.environ['DB_PATH'] = args.db
+    os.environ['BOT_API_BASE_URL'] = f'http://127.0.0.1:{args.api_port}/bot'
+    os.environ['SNAPSHOT_DIR'] = ''
+    os.environ['SQL_TRACE'] = '1' if args.sql_trace else '0'
+    if args.concurrent_updates:
+        os.environ['CONCURRENT_UPDATES'] = str(args.concurrent_updates)
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    for name in ('httpx', 'telegram', 'apscheduler', 'web_server'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    try:
+        report = asyncio.run(run_load_test(args))
+    finally:
+        if db_dir is not None:
+            db_dir.cleanup()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRisultati salvati in {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            return compare_with_baseline(report, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
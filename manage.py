@@ -0,0 +1,151 @@
+"""
+Comandi di amministrazione del database da terminale.
+
+Uso:
+    python manage.py migrate [db_path]              # applica migrazioni e controlla i piani delle query
+    python manage.py rebuild-rollup [db_path]       # ricalcola weekly_user_stats e verifica la consistenza
+    python manage.py snapshot <cartella> [db_path]  # snapshot full/incrementale nella cartella
+    python manage.py restore <cartella> <dest_path> [snapshot]  # ricostruisce il database
+    python manage.py export <dest.gz> <tabella> [csv|jsonl] [dal] [al] [user_id]
+                                                    # esporta daily_logs, users, weekly_reports
+                                                    # o weekly_report_rows
+    python manage.py archive [giorni] [db_path]     # sposta nell'archivio freddo i log più vecchi
+"""
+import sys
+from datetime import date
+
+from archive import archive_cutoff
+from config import Config
+from database import Database
+from export import export_table, parse_export_args
+from migrations import get_schema_version
+from snapshots import SnapshotManager
+
+
+def migrate_command(args) -> int:
+    """Migra il database (avviene all'apertura) e verifica che le query calde usino gli indici"""
+    db = Database(args[0] if args else Config.DB_PATH)
+    try:
+        with db.reader() as conn:
+            print(f"Versione schema: {get_schema_version(conn)}")
+
+        ok = True
+        for name, result in db.check_query_plans().items():
+            status = "OK " if result['uses_index'] else "KO "
+            ok = ok and result['uses_index']
+            print(f"{status} {name}")
+            for detail in result['plan']:
+                print(f"      {detail}")
+        return 0 if ok else 1
+    finally:
+        db.close()
+
+
+def rebuild_rollup_command(args) -> int:
+    """Ricalcola il rollup settimanale dai log e riporta le differenze trovate"""
+    db = Database(args[0] if args else Config.DB_PATH)
+    try:
+        mismatches = db.rebuild_weekly_rollup()
+    finally:
+        db.close()
+
+    if not mismatches:
+        print("Rollup settimanale consistente con daily_logs")
+        return 0
+
+    print(f"Rollup settimanale: {len(mismatches)} righe non consistenti (ora corrette)")
+    for mismatch in mismatches:
+        print(f"  utente {mismatch['user_id']}, settimana {mismatch['week_start']}: "
+              f"atteso {mismatch['expected']}, trovato {mismatch['found']}")
+    return 1
+
+
+def snapshot_command(args) -> int:
+    """Crea uno snapshot (full o delta) nella cartella indicata"""
+    if not args:
+        print(__doc__)
+        return 2
+
+    manager = SnapshotManager(
+        args[1] if len(args) > 1 else Config.DB_PATH, args[0],
+        keep_chains=Config.SNAPSHOT_KEEP_CHAINS, full_every=Config.SNAPSHOT_FULL_EVERY
+    )
+    snapshot = manager.snapshot()
+    if snapshot is None:
+        print("Nessuna modifica dall'ultimo snapshot")
+    else:
+        print(f"Snapshot {snapshot['type']}: {snapshot['file']} "
+              f"({snapshot['pages']} pagine, {snapshot['size']} byte)")
+    return 0
+
+
+def restore_command(args) -> int:
+    """Ricostruisce il database da una cartella di snapshot"""
+    if len(args) < 2:
+        print(__doc__)
+        return 2
+
+    manager = SnapshotManager(Config.DB_PATH, args[0])
+    path = manager.restore(args[1], upto=args[2] if len(args) > 2 else None)
+    print(f"Database ricostruito in {path}")
+    return 0
+
+
+def export_command(args) -> int:
+    """Esporta una tabella (filtrata per date e utente) in CSV/JSONL compresso"""
+    if len(args) < 2:
+        print(__doc__)
+        return 2
+
+    try:
+        options = parse_export_args(args[1:])
+    except ValueError as e:
+        print(f"Errore: {e}")
+        return 2
+
+    result = export_table(Config.DB_PATH, dest_path=args[0], archive_dir=Config.ARCHIVE_DIR, **options)
+    print(f"Esportate {result['rows']} righe di {result['table']} in {result['path']} "
+          f"({result['format']}, {result['size']} byte)")
+    return 0
+
+
+def archive_command(args) -> int:
+    """Sposta in ARCHIVE_DIR i log più vecchi di N giorni (default ARCHIVE_AFTER_DAYS)"""
+    days = int(args[0]) if args else Config.ARCHIVE_AFTER_DAYS
+    try:
+        before = archive_cutoff(date.today(), days)
+    except ValueError as e:
+        print(f"Errore: {e}")
+        return 2
+
+    db = Database(args[1] if len(args) > 1 else Config.DB_PATH, archive_dir=Config.ARCHIVE_DIR)
+    try:
+        result = db.archive_logs(before)
+    finally:
+        db.close()
+
+    print(f"Archiviati {result['daily_logs']} log e {result['weekly_reports']} report "
+          f"precedenti al {before.isoformat()} in {Config.ARCHIVE_DIR} "
+          f"(anni: {', '.join(map(str, result['years'])) or 'nessuno'})")
+    return 0
+
+
+COMMANDS = {
+    'migrate': migrate_command,
+    'rebuild-rollup': rebuild_rollup_command,
+    'snapshot': snapshot_command,
+    'restore': restore_command,
+    'export': export_command,
+    'archive': archive_command,
+}
+
+
+def main(argv) -> int:
+    if len(argv) < 2 or argv[1] not in COMMANDS:
+        print(__doc__)
+        return 2
+    return COMMANDS[argv[1]](argv[2:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,316 @@
+"""
+Metriche in formato testo Prometheus (nessuna dipendenza esterna).
+
+Contatori, gauge e istogrammi con etichette, esposti da run.py su
+GET /metrics. Le metriche del bot sono definite qui come variabili di
+modulo e aggiornate dagli altri moduli:
+
+    from metrics import HANDLER_LATENCY
+    HANDLER_LATENCY.labels('/start').observe(0.012)
+
+LoopMonitor misura quanto l'event loop resta bloccato (codice sincrono
+lento, query eseguite fuori dai thread del database, ecc.).
+"""
+import asyncio
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket (secondi) per latenze di handler e query
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bucket (secondi) per il ritardo dello scheduler
+LAG_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """Elenco delle metriche da esporre"""
+
+    def __init__(self):
+        self._metrics: List['Metric'] = []
+
+    def register(self, metric: 'Metric'):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Serie per i valori delle etichette (nell'ordine di labelnames)"""
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: attese etichette {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock: threading.Lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    """Contatore monotono (nome con suffisso _total)"""
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}')
+        return lines
+
+
+class Gauge(Metric):
+    """
+    Valore istantaneo. Con set_function il valore viene letto al momento
+    dell'esportazione (es: profondità di una coda).
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        if self._function is not None:
+            lines.append(f'{self.name} {_format_value(self._function())}')
+            return lines
+        for key, child in sorted(self._children.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}')
+        return lines
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...], lock: threading.Lock):
+        self.buckets = buckets
+        # Un contatore per bucket (non cumulativo) più quello per +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    """Istogramma a bucket cumulativi (_bucket, _sum, _count)"""
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets, self._lock)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            cumulative = 0
+            bounds = list(self.buckets) + [math.inf]
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+# ========== METRICHE DEL BOT ==========
+
+HANDLER_LATENCY = Histogram(
+    'bot_handler_duration_seconds',
+    'Durata degli handler per comando e step del check-in',
+    ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total',
+    'Eccezioni non gestite negli handler',
+    ['handler']
+)
+DB_QUERY_DURATION = Histogram(
+    'bot_db_query_duration_seconds',
+    'Tempo nel thread del database per metodo di Database',
+    ['method', 'kind']
+)
+DB_WRITE_BATCH_SIZE = Histogram(
+    'bot_db_write_batch_size',
+    'Scritture per commit della coda write-behind (group commit)',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+SCHEDULER_LAG = Histogram(
+    'bot_scheduler_lag_seconds',
+    'Ritardo tra orario previsto e invio effettivo delle notifiche',
+    ['kind'],
+    buckets=LAG_BUCKETS
+)
+TELEGRAM_REQUESTS = Counter(
+    'bot_telegram_requests_total',
+    'Chiamate alla Bot API riuscite',
+    ['endpoint']
+)
+TELEGRAM_FAILURES = Counter(
+    'bot_telegram_request_failures_total',
+    'Chiamate alla Bot API fallite',
+    ['endpoint', 'error']
+)
+TELEGRAM_RETRIES = Counter(
+    'bot_telegram_request_retries_total',
+    'Nuovi tentativi dopo un flood limit (RetryAfter)',
+    ['endpoint']
+)
+TELEGRAM_QUEUE_DEPTH = Gauge(
+    'bot_telegram_queue_depth',
+    'Richieste alla Bot API in attesa nel rate limiter'
+)
+PENDING_UPDATES = Gauge(
+    'bot_pending_updates',
+    'Update ricevuti in attesa di essere processati'
+)
+EVENT_LOOP_LAG = Histogram(
+    'bot_event_loop_lag_seconds',
+    'Ritardo del timer di controllo dell\'event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+STARTUP_PHASE_SECONDS = Gauge(
+    'bot_startup_phase_seconds',
+    'Durata delle fasi di avvio (ready e first_update: secondi dall\'import del bot)',
+    ['phase']
+)
+EVENT_LOOP_BLOCKED = Counter(
+    'bot_event_loop_blocked_seconds_total',
+    'Tempo in cui l\'event loop è rimasto bloccato oltre la soglia'
+)
+
+
+def observe_query(method: str, elapsed: float, write: bool):
+    """Listener per AsyncDatabase.add_query_listener"""
+    DB_QUERY_DURATION.labels(method, 'write' if write else 'read').observe(elapsed)
+
+
+async def handle_metrics(path: str, headers: Dict[str, str], body: bytes):
+    """Route GET /metrics per WebServer"""
+    return 200, CONTENT_TYPE, REGISTRY.render().encode('utf-8'), {}
+
+
+class LoopMonitor:
+    """
+    Controlla l'event loop con un timer ogni 'interval' secondi: il ritardo
+    con cui il timer si sveglia è il tempo in cui il loop era occupato.
+    Oltre 'threshold' il ritardo viene sommato in EVENT_LOOP_BLOCKED.
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.05):
+        self.interval = interval
+        self.threshold = threshold
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.observe(lag)
+            if lag > self.threshold:
+                EVENT_LOOP_BLOCKED.inc(lag)
@@ -0,0 +1,419 @@
+"""
+Migrazioni dello schema del database.
+
+La versione dello schema è salvata in PRAGMA user_version: all'avvio
+vengono applicate in ordine solo le migrazioni con versione maggiore,
+ognuna nella sua transazione. Un database esistente (user_version = 0)
+viene aggiornato sul posto senza perdere dati.
+
+Per aggiornare a mano un database e verificare i piani delle query:
+    python manage.py migrate study_bot.db
+"""
+import sqlite3
+from typing import Callable, List, Tuple, Union
+
+from reports import REPORT_ROW_COLUMNS, parse_report_text, render_report
+
+# Aggregati settimanali per utente ricalcolati da daily_logs.
+# week_start = lunedì della settimana della data (strftime %w: 0 = domenica)
+WEEKLY_ROLLUP_SELECT = '''
+    SELECT
+        user_id,
+        date(date, '-' || ((CAST(strftime('%w', date) AS INTEGER) + 6) % 7) || ' days') AS week_start,
+        COALESCE(SUM(CASE WHEN should_study THEN hours_studied END), 0) AS total_hours,
+        COUNT(CASE WHEN should_study AND hours_studied > 0 THEN 1 END) AS study_days,
+        COUNT(CASE WHEN should_study THEN 1 END) AS total_study_days,
+        COALESCE(SUM(CASE WHEN should_study AND hours_studied > 0 THEN
+            CASE distraction_level
+                WHEN 'low' THEN 1 WHEN 'medium' THEN 2 WHEN 'high' THEN 3 ELSE 2
+            END
+        END), 0) AS distraction_sum,
+        COUNT(CASE WHEN notes IS NOT NULL AND notes != '' THEN 1 END) AS notes_count
+    FROM daily_logs
+    GROUP BY user_id, week_start
+'''
+
+
+
+def convert_report_texts(conn: sqlite3.Connection):
+    """
+    Converte in righe strutturate i report salvati come testo. Solo se il
+    testo rigenerato è identico all'originale e ogni @username corrisponde
+    ad un solo utente; gli altri restano in report_text.
+    """
+    user_ids = {}
+    for user_id, username in conn.execute('SELECT user_id, username FROM users'):
+        user_ids.setdefault(username, []).append(user_id)
+
+    reports = conn.execute('''
+        SELECT id, week_start, week_end, report_text FROM weekly_reports
+        WHERE report_text IS NOT NULL
+    ''').fetchall()
+    for report_id, week_start, week_end, text in reports:
+        report = parse_report_text(text, week_start, week_end)
+        if report is None or render_report(report) != text:
+            continue
+        matches = [user_ids.get(row['username'], ()) for row in report['rows']]
+        if any(len(found) != 1 for found in matches) or len({found[0] for found in matches}) != len(matches):
+            continue
+
+        conn.executemany(f'''
+            INSERT INTO weekly_report_rows ({', '.join(REPORT_ROW_COLUMNS)})
+            VALUES ({', '.join('?' * len(REPORT_ROW_COLUMNS))})
+        ''', [(report_id, found[0], *(row[column] for column in REPORT_ROW_COLUMNS[2:]))
+              for row, found in zip(report['rows'], matches)])
+        conn.execute('''
+            UPDATE weekly_reports
+            SET total_users = ?, active_users = ?, total_hours = ?, goals_reached = ?, report_text = NULL
+            WHERE id = ?
+        ''', (report['total_users'], report['active_users'], report['total_hours'],
+              report['goals_reached'], report_id))
+
+
+# (versione, descrizione, statement SQL o funzione che riceve la connessione)
+# Non modificare migrazioni già rilasciate: aggiungerne sempre una nuova in coda
+MIGRATIONS: List[Tuple[int, str, Tuple[Union[str, Callable[[sqlite3.Connection], None]], ...]]] = [
+    (1, "schema iniziale", (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            weekly_goal INTEGER DEFAULT 20,
+            checkin_time TEXT DEFAULT "23:00",
+            reminder_start TEXT,
+            reminder_end TEXT,
+            joined_date DATE DEFAULT CURRENT_DATE,
+            is_active BOOLEAN DEFAULT 1
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            date DATE,
+            should_study BOOLEAN,
+            hours_studied REAL,
+            distraction_level TEXT,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            UNIQUE(user_id, date)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS weekly_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            week_start DATE,
+            week_end DATE,
+            report_text TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (2, "indici per statistiche settimanali, utenti attivi e report", (
+        # Copre le statistiche settimanali (per utente e di gruppo):
+        # range su (user_id, date) senza leggere la tabella
+        '''
+        CREATE INDEX IF NOT EXISTS idx_daily_logs_user_date_stats
+        ON daily_logs(user_id, date, should_study, hours_studied, distraction_level, notes)
+        ''',
+        # Scansioni per intervallo di date su tutti gli utenti
+        '''
+        CREATE INDEX IF NOT EXISTS idx_daily_logs_date
+        ON daily_logs(date, user_id)
+        ''',
+        # Utenti attivi: copre il lato "users" del report di gruppo
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_active
+        ON users(is_active, user_id, username, weekly_goal)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_weekly_reports_week
+        ON weekly_reports(week_start, week_end)
+        ''',
+    )),
+    (3, "rollup settimanale weekly_user_stats", (
+        # Aggiornata da add_daily_log nella stessa transazione del log
+        '''
+        CREATE TABLE IF NOT EXISTS weekly_user_stats (
+            user_id INTEGER NOT NULL,
+            week_start DATE NOT NULL,
+            total_hours REAL NOT NULL DEFAULT 0,
+            study_days INTEGER NOT NULL DEFAULT 0,
+            total_study_days INTEGER NOT NULL DEFAULT 0,
+            distraction_sum INTEGER NOT NULL DEFAULT 0,
+            notes_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, week_start)
+        ) WITHOUT ROWID
+        ''',
+        'DELETE FROM weekly_user_stats',
+        f'''
+        INSERT INTO weekly_user_stats
+            (user_id, week_start, total_hours, study_days, total_study_days,
+             distraction_sum, notes_count)
+        {WEEKLY_ROLLUP_SELECT}
+        ''',
+    )),
+    (4, "stato dei check-in in corso", (
+        '''
+        CREATE TABLE IF NOT EXISTS checkin_states (
+            user_id INTEGER PRIMARY KEY,
+            date DATE NOT NULL,
+            should_study BOOLEAN NOT NULL,
+            hours_studied REAL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+    )),
+    (5, "registro dei gruppi e dei loro membri", (
+        '''
+        CREATE TABLE IF NOT EXISTS group_chats (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            added_date DATE DEFAULT CURRENT_DATE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS group_members (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id)',
+        # Report salvati una volta per gruppo (NULL = report senza gruppo)
+        'ALTER TABLE weekly_reports ADD COLUMN chat_id INTEGER',
+    )),
+    (6, "un solo report per chat e settimana", (
+        # Dei duplicati resta il più recente
+        '''
+        DELETE FROM weekly_reports
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM weekly_reports
+            GROUP BY COALESCE(chat_id, 0), week_start
+        )
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_weekly_reports_chat_week
+        ON weekly_reports(COALESCE(chat_id, 0), week_start)
+        ''',
+    )),
+    (7, "check-in senza stato sul server", (
+        # Le risposte viaggiano nel callback_data dei bottoni (checkin_flow)
+        'DROP TABLE IF EXISTS checkin_states',
+    )),
+    (8, "archivio freddo dei log vecchi", (
+        # Un file per anno in ARCHIVE_DIR; archived_before = primo giorno rimasto caldo
+        '''
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            year INTEGER PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            archived_before DATE NOT NULL,
+            daily_logs INTEGER NOT NULL DEFAULT 0,
+            weekly_reports INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (9, "coordinamento tra più worker (leader, notifiche, modifiche)", (
+        # Un lease per ruolo (es. 'scheduler'): chi lo tiene lo rinnova prima di expires_at.
+        # term cresce ad ogni cambio di leader, checkpoint è la posizione del leader
+        '''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            term INTEGER NOT NULL DEFAULT 1,
+            expires_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            checkpoint TEXT
+        )
+        ''',
+        # Notifiche già prese in carico: ognuna viene inviata una volta sola
+        '''
+        CREATE TABLE IF NOT EXISTS notification_log (
+            day DATE NOT NULL,
+            minute TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            target_id INTEGER NOT NULL,
+            holder TEXT NOT NULL,
+            PRIMARY KEY (day, minute, kind, target_id)
+        ) WITHOUT ROWID
+        ''',
+        # Modifiche che gli altri worker devono vedere (orari, cache, gruppi)
+        '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            detail TEXT,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_users_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('user', NEW.user_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_users_update AFTER UPDATE ON users
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('user', NEW.user_id);
+        END
+        ''',
+        # Solo i log recenti: sono quelli dei report in cache (e così import e seed non riempiono la tabella)
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_logs_insert AFTER INSERT ON daily_logs
+        WHEN NEW.date >= date('now', '-14 days')
+        BEGIN
+            INSERT INTO change_log (entity, entity_id, detail) VALUES ('log', NEW.user_id, NEW.date);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_logs_update AFTER UPDATE ON daily_logs
+        WHEN NEW.date >= date('now', '-14 days')
+        BEGIN
+            INSERT INTO change_log (entity, entity_id, detail) VALUES ('log', NEW.user_id, NEW.date);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_groups_insert AFTER INSERT ON group_chats
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('group', NEW.chat_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_groups_update AFTER UPDATE ON group_chats
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('group', NEW.chat_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_members_insert AFTER INSERT ON group_members
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('group', NEW.chat_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_members_delete AFTER DELETE ON group_members
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('group', OLD.chat_id);
+        END
+        ''',
+    )),
+    (10, "report settimanali strutturati", (
+        # Totali del gruppo; report_text resta solo per i vecchi report non convertibili
+        'ALTER TABLE weekly_reports ADD COLUMN total_users INTEGER',
+        'ALTER TABLE weekly_reports ADD COLUMN active_users INTEGER',
+        'ALTER TABLE weekly_reports ADD COLUMN total_hours REAL',
+        'ALTER TABLE weekly_reports ADD COLUMN goals_reached INTEGER',
+        # Una riga per partecipante attivo (il testo si genera con reports.render_report)
+        '''
+        CREATE TABLE IF NOT EXISTS weekly_report_rows (
+            report_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            weekly_goal INTEGER,
+            total_hours REAL NOT NULL,
+            study_days INTEGER NOT NULL,
+            total_study_days INTEGER NOT NULL,
+            avg_distraction REAL,
+            notes_count INTEGER NOT NULL DEFAULT 0,
+            goal_reached BOOLEAN NOT NULL,
+            PRIMARY KEY (report_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        convert_report_texts,
+    )),
+    (11, "modifiche degli utenti che toccano i report", (
+        # detail = 'report' solo se cambia qualcosa che compare nei report e nelle classifiche:
+        # orari e promemoria (/settime, /setreminders) non invalidano i report degli altri worker
+        'DROP TRIGGER IF EXISTS change_log_users_insert',
+        'DROP TRIGGER IF EXISTS change_log_users_update',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_users_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO change_log (entity, entity_id, detail) VALUES ('user', NEW.user_id, 'report');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_users_update AFTER UPDATE ON users
+        BEGIN
+            INSERT INTO change_log (entity, entity_id, detail) VALUES (
+                'user', NEW.user_id,
+                CASE WHEN OLD.weekly_goal IS NOT NEW.weekly_goal
+                       OR OLD.username IS NOT NEW.username
+                       OR OLD.is_active IS NOT NEW.is_active
+                     THEN 'report' END
+            );
+        END
+        ''',
+    )),
+    (12, "stato di invio delle notifiche", (
+        # 'claimed' in invio, 'sent' inviata, 'released' da riprovare, 'failed' o 'skipped' chiusa
+        # senza invio. Le righe già presenti erano state inviate (o perse): restano 'sent'
+        "ALTER TABLE notification_log ADD COLUMN status TEXT NOT NULL DEFAULT 'sent'",
+        'ALTER TABLE notification_log ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE notification_log ADD COLUMN claimed_at REAL',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_notification_log_unsent ON notification_log(claimed_at)
+        WHERE status IN ('claimed', 'released')
+        ''',
+    )),
+    (13, "anni archiviati visibili agli altri worker", (
+        # Gli altri worker rileggono archive_segments (ColdStorage.years) in sync_changes
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_archive_insert AFTER INSERT ON archive_segments
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('archive', NEW.year);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_archive_update AFTER UPDATE ON archive_segments
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('archive', NEW.year);
+        END
+        ''',
+    )),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Versione corrente dello schema (0 = database mai migrato)"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """
+    Applica le migrazioni mancanti e restituisce le versioni applicate.
+    Ogni migrazione è atomica: o passa tutta (insieme a user_version) o niente.
+    """
+    applied = []
+    current = get_schema_version(conn)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            # PRAGMA non accetta parametri; version è un intero nostro
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        print(f"Migrazione {version} applicata: {description}")
+        applied.append(version)
+
+    return applied
+
@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import TELEGRAM_REQUESTS, TELEGRAM_FAILURES, TELEGRAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Priorità delle richieste (valore più basso = servita prima)
+PRIORITY_INTERACTIVE = 0   # risposte ai comandi e ai bottoni
+PRIORITY_BULK = 10         # check-in automatici, reminder, report programmati
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Coda centrale per tutte le chiamate alla Bot API.
+
+    - limite globale (Telegram: ~30 messaggi/secondo in totale)
+    - limite per chat sui messaggi nuovi (1/s in privato, 20/minuto nei gruppi)
+    - le richieste interattive passano davanti a quelle massive:
+      si passa la priorità con rate_limit_args=PRIORITY_BULK
+    - su RetryAfter sospende tutti gli invii e riprova con backoff
+
+    Le statistiche (profondità coda, latenza, errori) sono in stats().
+    """
+
+    def __init__(
+        self,
+        overall_max_rate: float = 30,
+        private_chat_interval: float = 1.0,
+        group_chat_interval: float = 3.0,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        queue_warning_threshold: int = 200,
+    ):
+        self.overall_interval = 1 / overall_max_rate
+        self.private_chat_interval = private_chat_interval
+        self.group_chat_interval = group_chat_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.queue_warning_threshold = queue_warning_threshold
+
+        # Heap di (priorità, progressivo, future) in attesa del turno globale
+        self._waiting: List = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+        # chat_id -> primo istante utile per il prossimo messaggio
+        self._chat_next_slot: Dict[int, float] = {}
+        self._waiting_for_chat = 0
+
+        # Statistiche
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self._latencies: deque = deque(maxlen=1000)
+
+    async def initialize(self) -> None:
+        # Application.initialize inizializza il bot due volte (anche tramite l'Updater)
+        if self._pump_task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self) -> None:
+        if self._pump_task:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+
+        for _, _, future in self._waiting:
+            if not future.done():
+                future.cancel()
+        self._waiting.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict, List[Dict]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict, List[Dict]]:
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        chat_id = data.get('chat_id')
+        loop = asyncio.get_running_loop()
+        enqueued_at = loop.time()
+
+        for attempt in range(self.max_retries + 1):
+            # Il limite per chat vale solo per i messaggi nuovi (send*)
+            if chat_id is not None and endpoint.startswith('send'):
+                await self._wait_for_chat(chat_id)
+            await self._wait_for_turn(priority)
+
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retries += 1
+                TELEGRAM_RETRIES.labels(endpoint).inc()
+                delay = e.retry_after + self.backoff_base * (2 ** attempt)
+                # Blocca tutti gli invii finché Telegram non ci riammette
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    TELEGRAM_FAILURES.labels(endpoint, type(e).__name__).inc()
+                    raise
+                logger.warning(
+                    f"Flood limit su {endpoint} (chat {chat_id}): "
+                    f"nuovo tentativo tra {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+            except Exception as e:
+                self.failed += 1
+                TELEGRAM_FAILURES.labels(endpoint, type(e).__name__).inc()
+                raise
+            else:
+                self.sent += 1
+                TELEGRAM_REQUESTS.labels(endpoint).inc()
+                self._latencies.append(loop.time() - enqueued_at)
+                return result
+
+    async def _wait_for_chat(self, chat_id: int):
+        """Prenota il prossimo slot libero per la chat e lo attende"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        interval = self.group_chat_interval if int(chat_id) < 0 else self.private_chat_interval
+
+        slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+        self._chat_next_slot[chat_id] = slot + interval
+        if len(self._chat_next_slot) > 10000:
+            self._forget_idle_chats(now)
+
+        if slot > now:
+            self._waiting_for_chat += 1
+            try:
+                await asyncio.sleep(slot - now)
+            finally:
+                self._waiting_for_chat -= 1
+
+    def _forget_idle_chats(self, now: float):
+        self._chat_next_slot = {
+            chat_id: slot for chat_id, slot in self._chat_next_slot.items() if slot > now
+        }
+
+    async def _wait_for_turn(self, priority: int):
+        """Si mette in coda per il limite globale, in ordine di priorità"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._counter), future))
+        self._wakeup.set()
+
+        if len(self._waiting) == self.queue_warning_threshold:
+            logger.warning(f"Coda invii lunga: {len(self._waiting)} richieste in attesa")
+
+        await future
+
+    async def _pump(self):
+        """Concede il turno alle richieste in coda, al massimo overall_max_rate al secondo"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            delay = max(self._next_slot, self._paused_until) - now
+            if delay > 0:
+                # Dopo l'attesa si rilegge la testa: una richiesta più urgente può essere arrivata
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            future.set_result(None)
+            self._next_slot = now + self.overall_interval
+
+    def stats(self) -> Dict[str, float]:
+        """Profondità della coda, contatori e latenza (secondi, dall'accodamento all'invio)"""
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            'queue_depth': len(self._waiting) + self._waiting_for_chat,
+            'queue_depth_bulk': sum(1 for item in self._waiting if item[0] >= PRIORITY_BULK),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'latency_p50': percentile(0.50),
+            'latency_p95': percentile(0.95),
+            'latency_max': latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+# Chiave: (chat_id del gruppo o None per il report di tutti gli utenti, lunedì della settimana)
+ReportKey = Tuple[Optional[int], str]
+
+
+class ReportCache:
+    """
+    Cache LRU dei report settimanali già renderizzati.
+
+    Nessuna scadenza: una voce resta valida finché Database non la
+    invalida (check-in in quella settimana, cambio obiettivo o nome di un
+    utente, nuovi utenti o membri del gruppo). Come UserCache usa un contatore di scritture:
+    un report calcolato mentre arrivava un check-in non finisce in cache.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: "OrderedDict[ReportKey, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: Optional[int], week_start: str) -> Optional[str]:
+        key = (chat_id, week_start)
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def load_token(self) -> int:
+        """Da prendere prima di leggere le statistiche con cui costruire il report"""
+        with self._lock:
+            return self._writes
+
+    def put(self, chat_id: Optional[int], week_start: str, text: str, token: Optional[int] = None):
+        key = (chat_id, week_start)
+        with self._lock:
+            if token is not None and token != self._writes:
+                return
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_week(self, week_start: str):
+        """Un check-in ha cambiato i totali di quella settimana"""
+        with self._lock:
+            self._writes += 1
+            for key in [key for key in self._entries if key[1] == week_start]:
+                del self._entries[key]
+
+    def invalidate_chat(self, chat_id: Optional[int]):
+        """Sono cambiati i membri del gruppo (None: il report di tutti gli utenti)"""
+        with self._lock:
+            self._writes += 1
+            for key in [key for key in self._entries if key[0] == chat_id]:
+                del self._entries[key]
+
+    def invalidate_chats(self, chat_ids: Iterable[Optional[int]]):
+        """È cambiato un utente: i report delle chat in cui compare"""
+        chat_ids = set(chat_ids)
+        with self._lock:
+            self._writes += 1
+            for key in [key for key in self._entries if key[0] in chat_ids]:
+                del self._entries[key]
+
+    def clear(self):
+        """Cambio che tocca tutti i report (obiettivo, nuovo utente)"""
+        with self._lock:
+            self._writes += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,167 @@
+"""
+Report settimanali salvati come righe strutturate e resi in testo al bisogno.
+
+Per ogni chat e settimana weekly_reports contiene i totali del gruppo
+(utenti, partecipanti attivi, ore, obiettivi raggiunti) e
+weekly_report_rows le statistiche di ogni partecipante attivo. Il testo
+si genera con render_report quando serve (/weekly, invio della domenica):
+il confronto con la settimana prima e la lettura di un report passato
+sono letture per indice, senza testo da interpretare.
+
+I report salvati come testo prima della migrazione 10 vengono convertiti
+con parse_report_text solo se il testo rigenerato è identico all'originale;
+gli altri restano come testo in report_text.
+"""
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Colonne di weekly_report_rows, nell'ordine della tabella
+REPORT_ROW_COLUMNS = ('report_id', 'user_id', 'username', 'weekly_goal', 'total_hours', 'study_days',
+                      'total_study_days', 'avg_distraction', 'notes_count', 'goal_reached')
+
+# Totali del gruppo aggiunti a weekly_reports (colonna, tipo)
+REPORT_SUMMARY_COLUMNS = (('total_users', 'INTEGER'), ('active_users', 'INTEGER'),
+                          ('total_hours', 'REAL'), ('goals_reached', 'INTEGER'))
+
+# Punteggio rappresentativo di ogni livello (per i report convertiti dal testo)
+DISTRACTION_TEXT_SCORES = {'Bassa': 1.0, 'Media': 2.0, 'Alta': 3.0}
+
+_USER_BLOCK = re.compile(
+    r'@(?P<username>[^\n]*):\n'
+    r'• Ore studiate: (?P<total_hours>[\d.]+)h / (?P<weekly_goal>\d+)h obiettivo(?P<reached> ✅)?\n'
+    r'• Giorni di studio: (?P<study_days>\d+)/(?P<total_study_days>\d+)\n'
+    r'• Distrazione media: (?P<distraction>Bassa|Media|Alta)\n'
+    r'(?:• Note aggiunte: (?P<notes_count>\d+)\n)?'
+    r'\n'
+)
+_GROUP_TOTALS = re.compile(
+    r'• Partecipanti attivi: (?P<active_users>\d+)/(?P<total_users>\d+)\n'
+    r'• Totale ore studiate: (?P<total_hours>[\d.]+)h\n'
+)
+_PERSONAL_HEADER = "📊 **STATISTICHE PERSONALI:**\n\n"
+_GROUP_HEADER = "---\n\n📊 **STATISTICHE DI GRUPPO:**\n\n"
+
+
+def distraction_text(avg_distraction: float) -> str:
+    """Converte la distrazione media (1-3) in testo"""
+    if avg_distraction <= 1.5:
+        return "Bassa"
+    elif avg_distraction <= 2.5:
+        return "Media"
+    return "Alta"
+
+
+def build_report(users: List[Dict], week_start: str, week_end: str) -> Dict:
+    """
+    Report strutturato dalle statistiche settimanali degli utenti
+    (Database.get_all_users_weekly_stats): totali del gruppo più una
+    riga per ogni partecipante attivo.
+    """
+    rows = [
+        {
+            'user_id': stats['user_id'],
+            'username': stats['username'],
+            'weekly_goal': stats['weekly_goal'],
+            'total_hours': stats['total_hours'],
+            'study_days': stats['study_days'],
+            'total_study_days': stats['total_study_days'],
+            'avg_distraction': stats['avg_distraction'],
+            'notes_count': stats['notes_count'],
+            'goal_reached': bool(stats['goal_reached']),
+        }
+        for stats in users if stats['study_days'] > 0
+    ]
+    return {
+        'week_start': week_start,
+        'week_end': week_end,
+        'total_users': len(users),
+        'active_users': len(rows),
+        'total_hours': sum(row['total_hours'] for row in rows),
+        'goals_reached': sum(1 for row in rows if row['goal_reached']),
+        'rows': rows,
+    }
+
+
+def render_report(report: Dict, previous: Optional[Dict] = None) -> str:
+    """Testo del report settimanale; con previous (la settimana prima) anche il confronto"""
+    # Header
+    start_date = datetime.strptime(report['week_start'], '%Y-%m-%d').strftime('%d/%m')
+    end_date = datetime.strptime(report['week_end'], '%Y-%m-%d').strftime('%d/%m')
+
+    message = f"📈 **REPORT SETTIMANALE**\n"
+    message += f"Settimana {start_date} - {end_date}\n\n"
+    message += _PERSONAL_HEADER
+
+    # Statistiche per utente
+    for row in report['rows']:
+        message += f"@{row['username']}:\n"
+        message += f"• Ore studiate: {row['total_hours']}h / {row['weekly_goal']}h obiettivo"
+        if row['goal_reached']:
+            message += " ✅"
+        message += f"\n• Giorni di studio: {row['study_days']}/{row['total_study_days']}\n"
+        message += f"• Distrazione media: {distraction_text(row['avg_distraction'] or 0)}\n"
+        if row['notes_count'] > 0:
+            message += f"• Note aggiunte: {row['notes_count']}\n"
+        message += "\n"
+
+    # Statistiche di gruppo (senza partecipanti il totale è 0, non 0.0)
+    active_users = report['active_users']
+    total_hours = report['total_hours'] or 0
+    message += _GROUP_HEADER
+    message += f"• Partecipanti attivi: {active_users}/{report['total_users']}\n"
+    message += f"• Totale ore studiate: {total_hours}h\n"
+
+    if active_users > 0:
+        avg_hours = total_hours / active_users
+        message += f"• Media ore/persona: {avg_hours:.1f}h\n"
+        completion_rate = (report['goals_reached'] / active_users) * 100
+        message += f"• Tasso completamento obiettivi: {completion_rate:.0f}%\n"
+
+    if previous is not None and previous['total_hours'] is not None:
+        delta = total_hours - previous['total_hours']
+        message += f"• Rispetto alla settimana scorsa: {delta:+.1f}h\n"
+
+    return message
+
+
+def parse_report_text(text: str, week_start: str, week_end: str) -> Optional[Dict]:
+    """
+    Report strutturato da un testo salvato (senza user_id: solo username).
+    None se il testo non ha il formato di render_report.
+    """
+    if _PERSONAL_HEADER not in text or _GROUP_HEADER not in text:
+        return None
+    personal = text.split(_PERSONAL_HEADER, 1)[1]
+    personal, group = personal.split(_GROUP_HEADER, 1)
+
+    rows = []
+    position = 0
+    while position < len(personal):
+        match = _USER_BLOCK.match(personal, position)
+        if match is None:
+            return None
+        rows.append({
+            'username': match['username'],
+            'weekly_goal': int(match['weekly_goal']),
+            'total_hours': float(match['total_hours']),
+            'study_days': int(match['study_days']),
+            'total_study_days': int(match['total_study_days']),
+            'avg_distraction': DISTRACTION_TEXT_SCORES[match['distraction']],
+            'notes_count': int(match['notes_count'] or 0),
+            'goal_reached': bool(match['reached']),
+        })
+        position = match.end()
+
+    totals = _GROUP_TOTALS.match(group)
+    if totals is None or int(totals['active_users']) != len(rows):
+        return None
+    return {
+        'week_start': week_start,
+        'week_end': week_end,
+        'total_users': int(totals['total_users']),
+        'active_users': len(rows),
+        'total_hours': float(totals['total_hours']),
+        'goals_reached': sum(1 for row in rows if row['goal_reached']),
+        'rows': rows,
+    }
@@ -1,37 +1,102 @@
 """
 Wrapper per far girare il bot come Web Service su Render (gratis)
-Apre una porta HTTP per far contento Render, ma il bot continua a funzionare normalmente
+Un solo event loop asyncio serve sia il bot sia la porta HTTP richiesta da Render:
+- modalità polling (default): HTTP solo per l'health check
+- modalità webhook (WEBHOOK_MODE=1): Telegram invia gli update via POST
+- GET /metrics: metriche in formato Prometheus
 """
+import asyncio
+import logging
 import os
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import signal
+from time import perf_counter
 
-# Importa il bot
+from telegram import Update
+
+# Importa il bot (il profilo di avvio parte da qui)
+from startup import PROFILE
 import bot
+import metrics
+from config import Config
+from web_server import WebServer
+
+logger = logging.getLogger(__name__)
+
+
+async def serve():
+    """Avvia server HTTP, bot e scheduler; si ferma con SIGINT/SIGTERM"""
+    application = bot.build_application()
+
+    server = WebServer(
+        application,
+        port=int(os.environ.get('PORT', 10000)),
+        webhook_path=Config.WEBHOOK_PATH if Config.WEBHOOK_MODE else None,
+        secret_token=Config.WEBHOOK_SECRET,
+        max_pending=Config.WEBHOOK_MAX_PENDING
+    )
+    server.add_route('GET', '/metrics', metrics.handle_metrics)
+    metrics.TELEGRAM_QUEUE_DEPTH.set_function(lambda: application.bot.rate_limiter.stats()['queue_depth'])
+    metrics.PENDING_UPDATES.set_function(application.update_queue.qsize)
+    loop_monitor = metrics.LoopMonitor()
+
+    # Prima di tutto la porta HTTP, così l'health check di Render passa subito
+    with PROFILE.phase('http'):
+        await server.start()
+    loop_monitor.start()
+
+    with PROFILE.phase('telegram'):
+        await application.initialize()
+    # Database, orari degli utenti ed elezione del leader in background.
+    # In polling gli update li riceve solo il leader: il polling parte con la leadership
+    application.scheduler = bot.setup_scheduler(application)
+    await bot.start_background_tasks(application, poll=not Config.WEBHOOK_MODE)
+
+    if Config.WEBHOOK_MODE:
+        # Ogni worker serve gli update che gli arrivano (il bilanciatore li distribuisce)
+        receive_start = perf_counter()
+        if Config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                Config.WEBHOOK_URL,
+                secret_token=Config.WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Webhook registrato: {Config.WEBHOOK_URL}")
+        else:
+            logger.info(f"Webhook locale su {Config.WEBHOOK_PATH} (non registrato su Telegram)")
+        PROFILE.record('webhook', receive_start)
+
+    await application.start()
+    if Config.WEBHOOK_MODE:
+        PROFILE.ready()
+        logger.info(f"🚀 Bot avviato come {bot.WORKER_ID}! (pronto dopo {PROFILE.ready_at:.2f}s)")
+    else:
+        logger.info(f"🚀 Bot avviato come {bot.WORKER_ID}! (polling quando diventa leader)")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        await stop_event.wait()
+    finally:
+        # Prima il lease: un altro worker prende subito scheduler e polling
+        await bot.stop_background_tasks(application)
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        application.scheduler.shutdown(wait=False)
+        await application.shutdown()
+        await server.stop()
+        await loop_monitor.stop()
+        # Chiusura pulita di thread e connessioni del database
+        bot.adb.shutdown()
 
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    """Handler per rispondere alle richieste HTTP di Render"""
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(b'Bot is running!')
-    
-    def log_message(self, format, *args):
-        # Silenzia i log HTTP
-        pass
-
-def run_web_server():
-    """Avvia un semplice server HTTP sulla porta richiesta da Render"""
-    port = int(os.environ.get('PORT', 10000))
-    server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-    print(f'HTTP server running on port {port}')
-    server.serve_forever()
 
 if __name__ == '__main__':
-    # Avvia il server HTTP in un thread separato
-    web_thread = threading.Thread(target=run_web_server, daemon=True)
-    web_thread.start()
-    
-    # Avvia il bot nel thread principale
-    bot.main()
+    if not Config.validate_token():
+        logger.error("❌ BOT_TOKEN non configurato! Controlla il file .env")
+    elif not Config.validate_webhook():
+        logger.error("❌ WEBHOOK_SECRET non configurato: in modalità webhook è obbligatorio")
+    else:
+        asyncio.run(serve())
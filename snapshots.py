@@ -0,0 +1,248 @@
+"""
+Snapshot del database SQLite con la online backup API.
+
+La copia avviene a blocchi di pagine (backup_step) tenendo aperta una
+transazione di lettura sulla sorgente: in WAL i writer continuano a
+scrivere, la copia resta consistente e non riparte ad ogni commit.
+Poi il file viene compresso in streaming con gzip. Tutto è sincrono:
+dagli handler va chiamato su un thread (AsyncDatabase.run / to_thread).
+
+Snapshot periodici in una cartella locale:
+- "full": copia completa compressa
+- "delta": solo le pagine cambiate rispetto allo snapshot precedente
+- retention: si tengono le ultime N catene full + delta
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Pagine copiate ad ogni backup_step e pausa tra un blocco e l'altro
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+# Blocchi da 1 MB per la compressione in streaming
+CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def copy_database(db_path: str, dest_path: str, pages_per_step: int = PAGES_PER_STEP,
+                  sleep: float = STEP_SLEEP) -> int:
+    """
+    Copia consistente di db_path in dest_path (file SQLite non compresso).
+    Restituisce il numero di pagine copiate.
+    """
+    source = sqlite3.connect(db_path)
+    dest = sqlite3.connect(dest_path)
+    pages = {'total': 0}
+
+    def progress(status, remaining, total):
+        pages['total'] = total
+
+    try:
+        # Transazione di lettura: fissa lo snapshot, i writer non vengono bloccati
+        source.execute('BEGIN')
+        source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        source.backup(dest, pages=pages_per_step, progress=progress, sleep=sleep)
+        source.rollback()
+        # La copia non deve dipendere da file -wal esterni
+        dest.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dest.close()
+        source.close()
+    return pages['total']
+
+
+def compress_file(path: str, dest_path: str):
+    """Comprime path in dest_path (gzip) a blocchi di CHUNK_SIZE"""
+    with open(path, 'rb') as src, gzip.open(dest_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def create_compressed_snapshot(db_path: str, dest_path: str) -> Dict:
+    """Snapshot consistente e compresso (.db.gz) del database"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(dest_path)))
+    os.close(fd)
+    try:
+        pages = copy_database(db_path, tmp_path)
+        raw_size = os.path.getsize(tmp_path)
+        compress_file(tmp_path, dest_path)
+    finally:
+        os.remove(tmp_path)
+    return {
+        'path': dest_path,
+        'pages': pages,
+        'raw_size': raw_size,
+        'size': os.path.getsize(dest_path),
+    }
+
+
+def _page_hashes(path: str, page_size: int) -> List[str]:
+    hashes = []
+    with open(path, 'rb') as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            hashes.append(hashlib.blake2b(page, digest_size=16).hexdigest())
+    return hashes
+
+
+class SnapshotManager:
+    """
+    Snapshot periodici incrementali in una cartella locale.
+
+    Il manifest (manifest.json) elenca le catene: uno snapshot full seguito
+    dai delta. L'hash delle pagine dell'ultimo snapshot permette di scrivere
+    nel delta solo le pagine modificate.
+    """
+
+    def __init__(self, db_path: str, directory: str, keep_chains: int = 4,
+                 full_every: int = 24):
+        self.db_path = db_path
+        self.directory = directory
+        self.keep_chains = keep_chains
+        # Dopo quanti delta si riparte con un full
+        self.full_every = full_every
+        os.makedirs(directory, exist_ok=True)
+
+    # ========== MANIFEST ==========
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def load_manifest(self) -> Dict:
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'chains': [], 'page_size': None, 'page_hashes': []}
+
+    def _save_manifest(self, manifest: Dict):
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    # ========== SNAPSHOT ==========
+
+    def snapshot(self) -> Optional[Dict]:
+        """
+        Crea uno snapshot (full o delta). Restituisce i dati dello snapshot,
+        o None se dal precedente non è cambiata nessuna pagina.
+        """
+        manifest = self.load_manifest()
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=self.directory)
+        os.close(fd)
+        try:
+            copy_database(self.db_path, tmp_path)
+            with sqlite3.connect(tmp_path) as conn:
+                page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            hashes = _page_hashes(tmp_path, page_size)
+
+            chains = manifest['chains']
+            same_layout = bool(chains) and manifest['page_size'] == page_size
+            if same_layout and hashes == manifest['page_hashes']:
+                return None
+
+            manifest['sequence'] = manifest.get('sequence', 0) + 1
+            prefix = f"snapshot-{timestamp}-{manifest['sequence']:05d}"
+
+            if not same_layout or len(chains[-1]['deltas']) >= self.full_every:
+                name = f'{prefix}.full.db.gz'
+                compress_file(tmp_path, os.path.join(self.directory, name))
+                chains.append({'full': name, 'deltas': []})
+                entry = {'file': name, 'type': 'full', 'pages': len(hashes)}
+            else:
+                old_hashes = manifest['page_hashes']
+                changed = [
+                    number for number, page_hash in enumerate(hashes)
+                    if number >= len(old_hashes) or old_hashes[number] != page_hash
+                ]
+                name = f'{prefix}.delta.gz'
+                self._write_delta(tmp_path, os.path.join(self.directory, name),
+                                  page_size, len(hashes), changed)
+                chains[-1]['deltas'].append(name)
+                entry = {'file': name, 'type': 'delta', 'pages': len(changed)}
+        finally:
+            os.remove(tmp_path)
+
+        manifest['page_size'] = page_size
+        manifest['page_hashes'] = hashes
+        self._apply_retention(manifest)
+        self._save_manifest(manifest)
+
+        entry['size'] = os.path.getsize(os.path.join(self.directory, entry['file']))
+        return entry
+
+    def _write_delta(self, db_copy: str, dest_path: str, page_size: int,
+                     page_count: int, changed: List[int]):
+        """Delta: intestazione JSON + (numero pagina, contenuto) per le pagine cambiate"""
+        header = json.dumps({'page_size': page_size, 'page_count': page_count}).encode()
+        with open(db_copy, 'rb') as src, gzip.open(dest_path, 'wb', compresslevel=6) as dst:
+            dst.write(struct.pack('>I', len(header)) + header)
+            for number in changed:
+                src.seek(number * page_size)
+                dst.write(struct.pack('>I', number) + src.read(page_size))
+
+    def _apply_retention(self, manifest: Dict):
+        """Tiene solo le ultime keep_chains catene full + delta"""
+        chains = manifest['chains']
+        while len(chains) > self.keep_chains:
+            old = chains.pop(0)
+            for name in [old['full']] + old['deltas']:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    # ========== RESTORE ==========
+
+    def restore(self, dest_path: str, upto: Optional[str] = None) -> str:
+        """
+        Ricostruisce il database in dest_path dall'ultima catena
+        (o fino allo snapshot 'upto' compreso).
+        """
+        manifest = self.load_manifest()
+        chain = None
+        for candidate in manifest['chains']:
+            chain = candidate
+            if upto is not None and (upto == candidate['full'] or upto in candidate['deltas']):
+                break
+        if chain is None:
+            raise FileNotFoundError("Nessuno snapshot disponibile")
+
+        with gzip.open(os.path.join(self.directory, chain['full']), 'rb') as src, \
+                open(dest_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        if upto == chain['full']:
+            return dest_path
+
+        for name in chain['deltas']:
+            self._apply_delta(os.path.join(self.directory, name), dest_path)
+            if name == upto:
+                break
+        return dest_path
+
+    @staticmethod
+    def _apply_delta(delta_path: str, db_file: str):
+        with gzip.open(delta_path, 'rb') as src, open(db_file, 'r+b') as dst:
+            header_len = struct.unpack('>I', src.read(4))[0]
+            header = json.loads(src.read(header_len))
+            page_size = header['page_size']
+            while True:
+                number_bytes = src.read(4)
+                if not number_bytes:
+                    break
+                number = struct.unpack('>I', number_bytes)[0]
+                dst.seek(number * page_size)
+                dst.write(src.read(page_size))
+            dst.truncate(header['page_count'] * page_size)
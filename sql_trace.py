@@ -0,0 +1,247 @@
+"""
+Tracciamento SQL opzionale (SQL_TRACE=1): tempo di ogni statement per metodo di Database.
+
+Ogni connessione aperta da Database registra una trace callback di
+sqlite3, chiamata all'inizio di ogni statement (compresi BEGIN e COMMIT
+impliciti). Uno statement dura fino all'inizio del successivo sulla
+stessa connessione o alla restituzione della connessione (fine del
+blocco reader()/writer()): il tempo comprende quindi anche la lettura
+delle righe. Il metodo chiamante è il primo metodo di Database sullo
+stack, saltando gli helper di connessione (reader, writer, batch, ...).
+
+Oltre ai tempi per metodo si tengono:
+- gli statement più lenti (con EXPLAIN QUERY PLAN calcolato quando si
+  chiede il riepilogo, per vedere le scansioni complete);
+- per ogni tipo di richiesta (handler del bot, vedi request()) quante
+  connessioni sono state aperte e quanti commit sono stati fatti.
+
+Costa una lettura dello stack per statement: è pensato per essere
+acceso quando serve, non sempre.
+"""
+import heapq
+import itertools
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Metodi di Database che aprono o passano la connessione: il tempo va al chiamante
+HELPER_METHODS = frozenset({
+    'reader', 'writer', 'batch', 'open', '_connect', 'get_connection', '_acquire_reader',
+})
+
+# Lunghezza massima dello statement salvato tra i più lenti
+MAX_SQL_LENGTH = 1000
+
+# Statement senza piano (transazioni)
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'END')
+
+
+class RequestTrace:
+    """Contatori di una singola richiesta"""
+    __slots__ = ('name', 'statements', 'commits', 'connections', 'seconds')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.statements = 0
+        self.commits = 0
+        self.connections = 0
+        self.seconds = 0.0
+
+
+_CURRENT_REQUEST: ContextVar[Optional[RequestTrace]] = ContextVar('sql_trace_request', default=None)
+
+
+def _is_commit(sql: str) -> bool:
+    return sql[:6].upper() == 'COMMIT'
+
+
+class SqlTracer:
+    """Statistiche degli statement di tutte le connessioni tracciate"""
+
+    def __init__(self, slow_queries: int = 20, owner_module: str = 'database'):
+        self.slow_size = slow_queries
+        self.owner_module = owner_module
+        self._lock = threading.Lock()
+        # Statement in corso per connessione: id -> (sql, metodo, inizio, richiesta)
+        self._running: Dict[int, Tuple[str, str, float, Optional[RequestTrace]]] = {}
+        self._sequence = itertools.count()
+        self.reset()
+
+    def reset(self):
+        """Azzera le statistiche (le connessioni restano tracciate)"""
+        with self._lock:
+            self.started_at = time.time()
+            # metodo -> [statement, secondi, max]
+            self.methods: Dict[str, List[float]] = {}
+            # richiesta -> [richieste, statement, commit, connessioni, secondi, max commit]
+            self.requests: Dict[str, List[float]] = {}
+            self.connections = 0
+            self.commits = 0
+            # min-heap (secondi, n, sql, metodo, istante): in cima il più veloce dei lenti
+            self._slow: List[Tuple[float, int, str, str, float]] = []
+
+    # ========== REGISTRAZIONE ==========
+
+    def install(self, conn: sqlite3.Connection):
+        """Traccia la connessione appena aperta"""
+        key = id(conn)
+        conn.set_trace_callback(lambda sql: self._statement(key, sql))
+        request = _CURRENT_REQUEST.get()
+        with self._lock:
+            self.connections += 1
+        if request is not None:
+            request.connections += 1
+
+    def finish(self, conn: sqlite3.Connection):
+        """La connessione torna libera: chiude lo statement in corso"""
+        running = self._running.pop(id(conn), None)
+        if running is not None:
+            self._record(*running, time.perf_counter())
+
+    def _statement(self, key: int, sql: str):
+        now = time.perf_counter()
+        running = self._running.pop(key, None)
+        if running is not None:
+            self._record(*running, now)
+        # I piani chiesti dal riepilogo non sono lavoro del bot
+        if sql.startswith('EXPLAIN'):
+            return
+        self._running[key] = (sql, self._caller(), now, _CURRENT_REQUEST.get())
+
+    def _caller(self) -> str:
+        """Primo metodo del modulo proprietario sullo stack, senza gli helper"""
+        frame = sys._getframe(2)
+        while frame is not None:
+            if (frame.f_globals.get('__name__') == self.owner_module
+                    and frame.f_code.co_name not in HELPER_METHODS):
+                return frame.f_code.co_name
+            frame = frame.f_back
+        return '?'
+
+    def _record(self, sql: str, method: str, start: float, request: Optional[RequestTrace], end: float):
+        elapsed = end - start
+        commit = _is_commit(sql)
+        if request is not None:
+            request.statements += 1
+            request.commits += commit
+            request.seconds += elapsed
+
+        with self._lock:
+            stats = self.methods.setdefault(method, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            self.commits += commit
+
+            entry = (elapsed, next(self._sequence), sql[:MAX_SQL_LENGTH], method, time.time())
+            if len(self._slow) < self.slow_size:
+                heapq.heappush(self._slow, entry)
+            elif elapsed > self._slow[0][0]:
+                heapq.heapreplace(self._slow, entry)
+
+    @contextmanager
+    def request(self, name: str):
+        """Attribuisce a name le query del blocco (anche quelle sui thread del database)"""
+        trace = RequestTrace(name)
+        token = _CURRENT_REQUEST.set(trace)
+        try:
+            yield trace
+        finally:
+            _CURRENT_REQUEST.reset(token)
+            with self._lock:
+                stats = self.requests.setdefault(name, [0, 0, 0, 0, 0.0, 0])
+                stats[0] += 1
+                stats[1] += trace.statements
+                stats[2] += trace.commits
+                stats[3] += trace.connections
+                stats[4] += trace.seconds
+                stats[5] = max(stats[5], trace.commits)
+
+    # ========== RIEPILOGO ==========
+
+    def report(self, explain: Optional[Callable[[str], List[str]]] = None, limit: int = 10) -> Dict:
+        """
+        Statistiche correnti: metodi per tempo totale, richieste, statement
+        più lenti (con il piano se è indicato explain: sql -> righe del piano).
+        """
+        with self._lock:
+            methods = sorted(self.methods.items(), key=lambda item: item[1][1], reverse=True)
+            requests = sorted(self.requests.items(), key=lambda item: item[1][4], reverse=True)
+            slow = sorted(self._slow, reverse=True)
+            report = {
+                'since': self.started_at,
+                'connections': self.connections,
+                'commits': self.commits,
+                'statements': sum(stats[0] for stats in self.methods.values()),
+                'seconds': sum(stats[1] for stats in self.methods.values()),
+                # Commit fuori dalle richieste: job, write-behind, avvio
+                'background_commits': self.commits - sum(stats[2] for stats in self.requests.values()),
+            }
+
+        report['methods'] = [
+            {'method': method, 'count': count, 'seconds': seconds, 'max': longest}
+            for method, (count, seconds, longest) in methods[:limit]
+        ]
+        report['requests'] = [
+            {'request': name, 'count': count, 'statements': statements, 'commits': commits,
+             'connections': connections, 'seconds': seconds, 'max_commits': max_commits}
+            for name, (count, statements, commits, connections, seconds, max_commits) in requests[:limit]
+        ]
+        report['slow'] = []
+        for elapsed, _, sql, method, when in slow[:limit]:
+            plan = []
+            if explain is not None and not sql.upper().startswith(TRANSACTION_STATEMENTS):
+                try:
+                    plan = explain(sql)
+                except sqlite3.Error as e:
+                    plan = [f"(piano non disponibile: {e})"]
+            report['slow'].append({'sql': sql, 'method': method, 'seconds': elapsed, 'at': when, 'plan': plan})
+        return report
+
+
+def is_full_scan(detail: str) -> bool:
+    """True se la riga del piano è una scansione di tabella senza indice"""
+    return detail.startswith('SCAN') and 'INDEX' not in detail
+
+
+def format_report(report: Dict, sql_width: int = 160) -> str:
+    """Riepilogo leggibile (per /sqltrace e per il log)"""
+    minutes = (time.time() - report['since']) / 60
+    lines = [
+        f"🔎 SQL negli ultimi {minutes:.0f} min: {report['statements']} statement, "
+        f"{report['seconds'] * 1000:.0f} ms, {report['commits']} commit "
+        f"({report['background_commits']} fuori dalle richieste), "
+        f"{report['connections']} connessioni aperte"
+    ]
+
+    if report['methods']:
+        lines.append("\nMetodi (tempo totale):")
+        for stats in report['methods']:
+            average = stats['seconds'] / stats['count'] * 1000
+            lines.append(f"• {stats['method']}: {stats['count']} × {average:.2f} ms = "
+                         f"{stats['seconds'] * 1000:.0f} ms (max {stats['max'] * 1000:.1f} ms)")
+
+    if report['requests']:
+        lines.append("\nRichieste (per richiesta: statement, commit, connessioni):")
+        for stats in report['requests']:
+            count = stats['count']
+            lines.append(f"• {stats['request']} ×{count}: {stats['statements'] / count:.1f} stmt, "
+                         f"{stats['commits'] / count:.2f} commit (max {stats['max_commits']}), "
+                         f"{stats['connections'] / count:.2f} conn, {stats['seconds'] / count * 1000:.1f} ms")
+
+    if report['slow']:
+        lines.append("\nStatement più lenti:")
+        for entry in report['slow']:
+            sql = ' '.join(entry['sql'].split())
+            if len(sql) > sql_width:
+                sql = sql[:sql_width] + '…'
+            full_scan = any(is_full_scan(detail) for detail in entry['plan'])
+            lines.append(f"• {entry['seconds'] * 1000:.1f} ms in {entry['method']}"
+                         f"{' ⚠️ scansione completa' if full_scan else ''}: {sql}")
+            for detail in entry['plan']:
+                lines.append(f"    {detail}")
+    return '\n'.join(lines)
@@ -0,0 +1,71 @@
+"""
+Profilo dell'avvio: quanto dura ogni fase, dall'import del bot al primo update.
+
+All'avvio il bot serve subito gli update: il database viene aperto
+(migrazioni) al primo uso e gli orari degli utenti vengono caricati a
+blocchi in background. Le fasi si sovrappongono, quindi per ognuna si
+registra inizio e durata rispetto all'origine (import di questo modulo,
+il primo del bot). Il riepilogo finisce nel log e in /metrics
+(bot_startup_phase_seconds).
+"""
+from contextlib import contextmanager
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+from metrics import STARTUP_PHASE_SECONDS
+
+
+class StartupProfile:
+    """Fasi dell'avvio come (nome, inizio, durata), in secondi dall'origine"""
+
+    def __init__(self):
+        self.origin = perf_counter()
+        self.phases: List[Tuple[str, float, float]] = []
+        self.details = {}
+        # Secondi dall'origine a quando il bot riceve update / al primo update servito
+        self.ready_at: Optional[float] = None
+        self.first_update_at: Optional[float] = None
+
+    def record(self, name: str, start: float, detail: Optional[str] = None):
+        """Registra la fase iniziata a start (perf_counter) e finita adesso"""
+        end = perf_counter()
+        self.phases.append((name, start - self.origin, end - start))
+        if detail:
+            self.details[name] = detail
+        STARTUP_PHASE_SECONDS.labels(name).set(end - start)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        yield
+        self.record(name, start)
+
+    def ready(self):
+        """Da chiamare quando il bot comincia a ricevere update"""
+        self.ready_at = perf_counter() - self.origin
+        STARTUP_PHASE_SECONDS.labels('ready').set(self.ready_at)
+
+    def first_update(self):
+        """Primo update servito (chiamato ad ogni update, conta solo il primo)"""
+        if self.first_update_at is None:
+            self.first_update_at = perf_counter() - self.origin
+            STARTUP_PHASE_SECONDS.labels('first_update').set(self.first_update_at)
+
+    def summary(self) -> str:
+        """Es: 'import 0.41s, http 0.01s, ... | pronto dopo 0.80s'"""
+        parts = []
+        for name, start, duration in self.phases:
+            part = f"{name} {duration:.2f}s"
+            if name in self.details:
+                part += f" ({self.details[name]})"
+            parts.append(part)
+        message = ', '.join(parts)
+        if self.ready_at is not None:
+            message += f" | pronto dopo {self.ready_at:.2f}s"
+        if self.first_update_at is not None:
+            message += f", primo update dopo {self.first_update_at:.2f}s"
+        return message
+
+
+# Creato al primo import: bot.py lo importa prima di tutto il resto
+PROFILE = StartupProfile()
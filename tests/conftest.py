@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# I moduli del bot sono nella radice del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database nuovo (tutte le migrazioni applicate) in una cartella temporanea"""
+    database = Database(str(tmp_path / 'study_bot.db'), archive_dir=str(tmp_path / 'archivio'))
+    yield database
+    database.close()
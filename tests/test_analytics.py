@@ -0,0 +1,146 @@
+"""/mystats di lungo periodo: periodo richiesto, serie di studio e metriche"""
+from datetime import date, timedelta
+
+import pytest
+
+import analytics
+import bot
+from analytics import UserHistory
+
+TODAY = date(2026, 3, 15)   # domenica
+
+
+def log(day, hours=2.0, distraction='low', notes='', should_study=True):
+    return (day.isoformat() if isinstance(day, date) else day, should_study, hours, distraction, notes)
+
+
+def days_before(count, **kwargs):
+    """Log di studio negli ultimi count giorni fino a oggi compreso"""
+    return [log(TODAY - timedelta(days=offset), **kwargs) for offset in range(count - 1, -1, -1)]
+
+
+# ========== PERIODO ==========
+
+@pytest.mark.parametrize('name, days', [('mese', 30), ('trimestre', 90), ('anno', 365)])
+def test_named_ranges_end_today(name, days):
+    title, start, end = bot.parse_mystats_range([name], TODAY)
+    assert end == TODAY
+    assert (end - start).days + 1 == days
+
+
+def test_all_starts_from_the_first_log():
+    assert bot.parse_mystats_range(['TUTTO'], TODAY) == ("Da sempre", None, TODAY)
+
+
+def test_custom_range():
+    assert bot.parse_mystats_range(['2026-01-01', '2026-03-31'], TODAY) \
+        == ("Periodo", date(2026, 1, 1), date(2026, 3, 31))
+
+
+@pytest.mark.parametrize('args', [
+    [],
+    ['settimane'],
+    ['2026-03-31', '2026-01-01'],        # inizio dopo la fine
+    ['2026-01-01'],
+    ['01/01/2026', '31/03/2026'],
+    ['2020-01-01', '9999-12-31'],        # oltre MYSTATS_MAX_DAYS
+    ['0001-01-01', '9999-11-30'],
+])
+def test_invalid_ranges_are_rejected(args):
+    with pytest.raises(ValueError):
+        bot.parse_mystats_range(args, TODAY)
+
+
+def test_longest_accepted_range():
+    start = date(2016, 1, 1)
+    end = start + timedelta(days=bot.MYSTATS_MAX_DAYS - 1)
+    assert bot.parse_mystats_range([start.isoformat(), end.isoformat()], TODAY)[1:] == (start, end)
+    with pytest.raises(ValueError):
+        bot.parse_mystats_range([start.isoformat(), (end + timedelta(days=1)).isoformat()], TODAY)
+
+
+def test_range_is_clamped_to_first_log_and_today():
+    rows = [log('2026-03-10', 3.0)]
+    summary = analytics.user_analytics(rows, date(2016, 6, 1), date(2026, 6, 1), TODAY)
+    assert (summary['start'], summary['end']) == (date(2026, 3, 10), TODAY)
+    assert summary['days'] == 6
+    assert summary['total_hours'] == 3.0
+
+
+def test_range_without_days_to_show():
+    rows = [log('2026-03-10')]
+    assert analytics.user_analytics([], None, TODAY, TODAY) is None
+    assert analytics.user_analytics(rows, date(2026, 1, 1), date(2026, 2, 1), TODAY) is None
+    assert analytics.user_analytics(rows, date(2026, 4, 1), date(2026, 5, 1), TODAY) is None
+
+
+# ========== SERIE ==========
+
+def streaks(rows, today=TODAY):
+    return analytics.streaks(UserHistory.from_rows(rows), today)
+
+
+def test_consecutive_study_days():
+    assert streaks(days_before(5)) == (5, 5)
+
+
+def test_free_day_neither_breaks_nor_extends_the_streak():
+    rows = days_before(5)
+    rows[2] = log(TODAY - timedelta(days=2), hours=0, should_study=False)
+    assert streaks(rows) == (4, 4)
+
+
+def test_missing_day_or_zero_hours_break_the_streak():
+    rows = days_before(6)
+    del rows[1]                                        # 5 giorni fa: niente check-in
+    assert streaks(rows) == (4, 4)
+
+    rows = days_before(6)
+    rows[3] = log(TODAY - timedelta(days=2), hours=0)  # doveva studiare, 0 ore
+    assert streaks(rows) == (2, 3)
+
+
+def test_current_streak_needs_a_check_in_today_or_yesterday():
+    rows = [log(TODAY - timedelta(days=offset)) for offset in (4, 3, 2)]
+    assert streaks(rows) == (0, 3)
+    assert streaks(rows, today=TODAY - timedelta(days=1)) == (3, 3)
+
+
+# ========== METRICHE ==========
+
+def test_summary_totals_follow_the_weekly_rules():
+    rows = [
+        log('2026-03-02', 2.0, 'low', 'capitolo 1'),
+        log('2026-03-03', 4.0, 'high'),
+        log('2026-03-04', 0.0, 'medium'),               # pianificato, non studiato
+        log('2026-03-05', 5.0, 'high', should_study=False),  # giorno libero: ore non contate
+    ]
+    summary = analytics.summarize(UserHistory.from_rows(rows), date(2026, 3, 2), date(2026, 3, 8), TODAY)
+
+    assert summary['days'] == 7
+    assert summary['logged_days'] == 4
+    assert summary['total_hours'] == 6.0
+    assert summary['study_days'] == 2
+    assert summary['planned_days'] == 3
+    assert summary['avg_distraction'] == 2.0
+    assert summary['notes_count'] == 1
+    assert summary['rolling_7'] == pytest.approx(6.0 / 7)
+    assert summary['rolling_30'] is None
+    assert summary['best_week'] == (date(2026, 3, 2), 6.0)
+    assert summary['by_weekday'][0] == 2.0 and summary['by_weekday'][1] == 4.0
+    assert summary['by_weekday'][3] == 0.0
+
+
+def test_summary_months_and_windows():
+    rows = [log(date(2026, 1, 1) + timedelta(days=offset), hours=1.0) for offset in range(60)]
+    rows.append(log('2026-03-10', 8.0))
+    summary = analytics.summarize(UserHistory.from_rows(rows), date(2026, 1, 1), date(2026, 3, 14), TODAY)
+
+    assert [month['month'] for month in summary['months']] == \
+        [date(2026, 1, 1), date(2026, 2, 1), date(2026, 3, 1)]
+    assert [month['hours'] for month in summary['months']] == [31.0, 28.0, 9.0]
+    assert [month['study_days'] for month in summary['months']] == [31, 28, 2]
+    assert summary['total_hours'] == 68.0
+    assert summary['rolling_7'] == pytest.approx(8.0 / 7)
+    # Dal 2 marzo c'è un buco: la settimana migliore è la prima che contiene le 8 ore del 10
+    assert summary['best_week'] == (date(2026, 3, 4), 8.0)
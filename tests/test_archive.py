@@ -0,0 +1,133 @@
+"""Archivio freddo: spostamento di un mese, storia ed export senza righe perse o doppie"""
+import csv
+import gzip
+import sqlite3
+from datetime import date
+
+import pytest
+
+from archive import merge_history
+from export import export_table
+from reports import build_report
+
+ARCHIVED_DAYS = ['2025-01-06', '2025-01-07', '2025-01-20']
+HOT_DAYS = ['2025-02-10', '2026-03-02']
+BEFORE = date(2025, 2, 3)   # lunedì
+
+
+@pytest.fixture
+def archived(db):
+    """Log e report di gennaio 2025 spostati nell'archivio, il resto nel caldo"""
+    db.add_user(1, 'anna')
+    db.add_user(2, 'bruno')
+    for day in ARCHIVED_DAYS + HOT_DAYS:
+        db.add_daily_log(1, day, True, 2.0, 'low')
+    db.add_daily_log(2, '2025-01-07', True, 3.0, 'high')
+    db.save_weekly_report(build_report(db.get_all_users_weekly_stats('2025-01-06', '2025-01-12'),
+                                       '2025-01-06', '2025-01-12'), chat_id=-100)
+    db.save_weekly_report(build_report(db.get_all_users_weekly_stats('2025-02-10', '2025-02-16'),
+                                       '2025-02-10', '2025-02-16'), chat_id=-100)
+
+    result = db.archive_logs(BEFORE)
+    assert result['years'] == [2025]
+    assert (result['daily_logs'], result['weekly_reports']) == (4, 1)
+    return db
+
+
+def cold_rows(db, sql):
+    conn = sqlite3.connect(db.cold.path(2025))
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def export_rows(db, tmp_path, table, **options):
+    result = export_table(db.db_path, table, str(tmp_path / f'{table}.csv.gz'),
+                          archive_dir=db.cold.archive_dir, **options)
+    with gzip.open(result['path'], 'rt', encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert result['rows'] == len(rows)
+    return rows
+
+
+def reinsert_in_hot(db, day):
+    """Come uno spostamento interrotto: la riga è già nel freddo ma anche ancora nel caldo"""
+    row = cold_rows(db, f"SELECT * FROM daily_logs WHERE user_id = 1 AND date = '{day}'")[0]
+    with db.writer() as conn:
+        conn.execute(f"INSERT INTO daily_logs VALUES ({', '.join('?' * len(row))})", row)
+
+
+# ========== SPOSTAMENTO ==========
+
+def test_month_moves_to_the_year_file(archived, tmp_path):
+    with archived.reader() as conn:
+        hot_days = [row[0] for row in conn.execute('SELECT date FROM daily_logs WHERE user_id = 1 ORDER BY date')]
+        hot_reports = [row[0] for row in conn.execute('SELECT week_start FROM weekly_reports ORDER BY week_start')]
+        orphans = conn.execute('''
+            SELECT COUNT(*) FROM weekly_report_rows
+            WHERE report_id NOT IN (SELECT id FROM weekly_reports)
+        ''').fetchone()[0]
+    assert hot_days == HOT_DAYS
+    assert hot_reports == ['2025-02-10']
+    assert orphans == 0
+
+    assert (tmp_path / 'archivio' / 'archive_2025.db').exists()
+    assert [row[0] for row in cold_rows(archived, 'SELECT date FROM daily_logs WHERE user_id = 1 ORDER BY date')] \
+        == ARCHIVED_DAYS
+    assert cold_rows(archived, 'SELECT week_start FROM weekly_reports') == [('2025-01-06',)]
+    assert cold_rows(archived, 'SELECT user_id FROM weekly_report_rows ORDER BY user_id') == [(1,), (2,)]
+    assert archived.get_archived_years() == [2025]
+
+
+def test_archiving_again_moves_nothing(archived):
+    assert archived.archive_logs(BEFORE)['daily_logs'] == 0
+    assert len(cold_rows(archived, 'SELECT * FROM daily_logs')) == 4
+
+
+# ========== STORIA ==========
+
+def test_history_returns_archived_rows_once(archived):
+    assert [row[0] for row in archived.get_user_history(1)] == ARCHIVED_DAYS + HOT_DAYS
+
+    reinsert_in_hot(archived, '2025-01-07')
+    assert [row[0] for row in archived.get_user_history(1)] == ARCHIVED_DAYS + HOT_DAYS
+
+
+def test_merge_history_prefers_hot_rows():
+    cold = [('2025-01-06', 1, 2.0, 'low', ''), ('2025-01-07', 1, 2.0, 'low', '')]
+    hot = [('2025-01-07', 1, 5.0, 'low', ''), ('2025-02-10', 1, 1.0, 'low', '')]
+    assert merge_history(cold, hot) == [cold[0], *hot]
+    # Il giorno rimasto nel caldo torna al suo posto tra quelli freddi
+    later = ('2025-01-20', 1, 3.0, 'low', '')
+    assert merge_history([*cold, later], hot) == [cold[0], hot[0], later, hot[1]]
+    assert merge_history([], hot) == hot
+
+
+def test_archived_report_is_still_readable(archived):
+    report = archived.get_weekly_report(-100, '2025-01-06')
+    assert report['active_users'] == 2
+    assert [row['username'] for row in report['rows']] == ['anna', 'bruno']
+
+
+# ========== EXPORT ==========
+
+def test_export_includes_archived_rows_once(archived, tmp_path):
+    reinsert_in_hot(archived, '2025-01-07')
+
+    # Ordine per id: la riga rimasta nel caldo esce con il caldo, una volta sola
+    logs = export_rows(archived, tmp_path, 'daily_logs', user_id=1)
+    assert sorted(row['date'] for row in logs) == ARCHIVED_DAYS + HOT_DAYS
+
+    reports = export_rows(archived, tmp_path, 'weekly_reports')
+    assert [row['week_start'] for row in reports] == ['2025-01-06', '2025-02-10']
+
+    rows = export_rows(archived, tmp_path, 'weekly_report_rows')
+    assert [(row['week_start'], row['user_id']) for row in rows] \
+        == [('2025-01-06', '1'), ('2025-01-06', '2'), ('2025-02-10', '1')]
+
+
+def test_export_filters_apply_to_the_archive(archived, tmp_path):
+    logs = export_rows(archived, tmp_path, 'daily_logs', start=date(2025, 1, 7), end=date(2025, 2, 10))
+    assert [(row['date'], row['user_id']) for row in logs] \
+        == [('2025-01-07', '1'), ('2025-01-20', '1'), ('2025-01-07', '2'), ('2025-02-10', '1')]
@@ -0,0 +1,95 @@
+"""callback_data firmato del check-in: codifica, verifica e scadenza"""
+import base64
+from datetime import date
+
+import pytest
+
+import checkin_flow
+from checkin_flow import ExpiredCallback, InvalidCallback
+
+KEY = checkin_flow.signing_key('123456:TOKEN')
+NOW = 1_780_000_000.0
+DAY = date(2026, 6, 1)
+
+
+def answered(*steps):
+    """Check-in iniziato a NOW con le risposte (passo, valore) date"""
+    answers = checkin_flow.start(42, DAY, now=NOW)
+    for step, value in steps:
+        answers = answers.answer(step, checkin_flow.option_index(step, value))
+    return answers
+
+
+def tamper(data: str, position: int) -> str:
+    raw = bytearray(base64.urlsafe_b64decode(data))
+    raw[position] ^= 0x01
+    return base64.urlsafe_b64encode(bytes(raw)).decode('ascii')
+
+
+def test_round_trip_keeps_user_day_and_answers():
+    answers = answered(('should_study', True))
+    data = checkin_flow.encode('hours', checkin_flow.option_index('hours', 2.5), answers, KEY)
+
+    assert len(data) == checkin_flow.CALLBACK_DATA_LENGTH <= 64
+    step, decoded = checkin_flow.decode(data, KEY, now=NOW)
+    assert step == 'hours'
+    assert decoded.user_id == 42
+    assert decoded.date == DAY
+    assert decoded.value('should_study') is True
+    assert decoded.value('hours') == 2.5
+    assert decoded.value('distraction') is None
+    assert checkin_flow.next_step(step, decoded) == 'distraction'
+
+
+def test_every_keyboard_button_decodes_to_its_option():
+    answers = answered(('should_study', True), ('hours', 1.0))
+    markup = checkin_flow.keyboard('distraction', answers, KEY)
+    buttons = [button for row in markup.inline_keyboard for button in row]
+
+    values = [checkin_flow.decode(button.callback_data, KEY, now=NOW)[1].value('distraction')
+              for button in buttons]
+    assert values == ['low', 'medium', 'high']
+
+
+def test_free_day_ends_the_check_in():
+    data = checkin_flow.encode('should_study', checkin_flow.option_index('should_study', False),
+                               answered(), KEY)
+    step, answers = checkin_flow.decode(data, KEY, now=NOW)
+    assert checkin_flow.next_step(step, answers) is None
+
+
+@pytest.mark.parametrize('position', [0, 1, 9, 11, 15, 16, 23])
+def test_changed_byte_breaks_the_signature(position):
+    data = checkin_flow.encode('should_study', 0, answered(), KEY)
+    with pytest.raises(InvalidCallback):
+        checkin_flow.decode(tamper(data, position), KEY, now=NOW)
+
+
+def test_other_key_is_rejected():
+    data = checkin_flow.encode('should_study', 0, answered(), KEY)
+    with pytest.raises(InvalidCallback):
+        checkin_flow.decode(data, checkin_flow.signing_key('654321:ALTRO'), now=NOW)
+
+
+@pytest.mark.parametrize('data', ['', 'checkin_yes', 'hours_2.5', '!' * checkin_flow.CALLBACK_DATA_LENGTH])
+def test_foreign_callback_data_is_invalid(data):
+    with pytest.raises(InvalidCallback):
+        checkin_flow.decode(data, KEY, now=NOW)
+    assert checkin_flow.peek_step(data) is None
+
+
+def test_expiry_counts_from_the_start_of_the_check_in():
+    data = checkin_flow.encode('should_study', 0, answered(), KEY)
+    ttl = 6 * 3600
+
+    assert checkin_flow.decode(data, KEY, ttl=ttl, now=NOW + ttl - 60)[0] == 'should_study'
+    with pytest.raises(ExpiredCallback):
+        checkin_flow.decode(data, KEY, ttl=ttl, now=NOW + ttl + 60)
+    # Senza ttl non scade
+    assert checkin_flow.decode(data, KEY, now=NOW + 10 * ttl)[0] == 'should_study'
+
+
+def test_peek_step_reads_the_step_without_the_key():
+    answers = answered(('should_study', True))
+    data = checkin_flow.encode('hours', 0, answers, KEY)
+    assert checkin_flow.peek_step(data) == 'hours'
@@ -0,0 +1,185 @@
+"""Più worker sullo stesso database: lease del leader, notifiche prese in carico, change_log"""
+import asyncio
+
+import pytest
+
+from async_database import AsyncDatabase
+from coordination import LeaderLease
+
+LEASE = 'scheduler'
+TTL = 30.0
+T0 = 1_000_000.0
+
+
+def claim(target_id, minute='21:00', kind='checkin', day='2026-03-02'):
+    return (day, minute, kind, target_id)
+
+
+def statuses(db):
+    with db.reader() as conn:
+        return {row['target_id']: (row['status'], row['holder'], row['attempts'])
+                for row in conn.execute('SELECT * FROM notification_log')}
+
+
+# ========== LEASE ==========
+
+def test_lease_is_exclusive_until_it_expires(db):
+    assert db.acquire_lease(LEASE, 'a', TTL, now=T0)['holder'] == 'a'
+    # Valido: b non lo prende, a lo rinnova senza cambiare term
+    assert db.acquire_lease(LEASE, 'b', TTL, now=T0 + 10)['holder'] == 'a'
+    renewed = db.acquire_lease(LEASE, 'a', TTL, now=T0 + 20)
+    assert (renewed['holder'], renewed['term']) == ('a', 1)
+    assert db.acquire_lease(LEASE, 'b', TTL, now=T0 + 40)['holder'] == 'a'
+
+    # a smette di rinnovare: dopo ttl lo prende b con un nuovo term
+    lease = db.acquire_lease(LEASE, 'b', TTL, now=T0 + 20 + TTL)
+    assert (lease['holder'], lease['term']) == ('b', 2)
+    assert db.acquire_lease(LEASE, 'a', TTL, now=T0 + 21 + TTL)['holder'] == 'b'
+
+
+def test_released_lease_is_taken_at_once(db):
+    db.acquire_lease(LEASE, 'a', TTL, now=T0)
+    assert db.release_lease(LEASE, 'a')
+    lease = db.acquire_lease(LEASE, 'b', TTL, now=T0 + 1)
+    assert (lease['holder'], lease['term']) == ('b', 2)
+
+
+def test_leader_lease_failover(db):
+    adb = AsyncDatabase(db, write_behind=False)
+    events = []
+
+    async def elected(lease, name):
+        events.append((name, lease['term']))
+
+    async def scenario():
+        a = LeaderLease(adb, LEASE, 'a', ttl=TTL, interval=1,
+                        on_elected=lambda lease: elected(lease, 'a'))
+        b = LeaderLease(adb, LEASE, 'b', ttl=TTL, interval=1,
+                        on_elected=lambda lease: elected(lease, 'b'))
+        await a.renew()
+        await b.renew()
+        assert a.is_leader and not b.is_leader
+
+        # Spegnimento di a: lascia il lease e b lo prende al prossimo rinnovo
+        await a.stop()
+        assert not a.is_leader
+        await b.renew()
+        assert b.is_leader and b.term == 2
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb.shutdown()
+    assert events == [('a', 1), ('b', 2)]
+
+
+def test_renew_interval_must_be_shorter_than_ttl(db):
+    with pytest.raises(ValueError):
+        LeaderLease(AsyncDatabase(db, write_behind=False), LEASE, 'a', ttl=10, interval=10)
+
+
+# ========== NOTIFICHE ==========
+
+def test_each_notification_is_claimed_once(db):
+    db.acquire_lease(LEASE, 'a', TTL, now=T0)
+    assert db.claim_notifications(LEASE, 'a', [claim(1), claim(2)], checkpoint='21:00', now=T0) \
+        == [claim(1), claim(2)]
+    # Lo stesso minuto di nuovo (es. job ripetuto): solo quelle nuove
+    assert db.claim_notifications(LEASE, 'a', [claim(1), claim(2), claim(3)], now=T0 + 1) == [claim(3)]
+    assert statuses(db)[1] == ('claimed', 'a', 1)
+    with db.reader() as conn:
+        assert conn.execute('SELECT checkpoint FROM leases').fetchone()[0] == '21:00'
+
+
+def test_claims_are_fenced_by_the_lease(db):
+    db.acquire_lease(LEASE, 'a', TTL, now=T0)
+    # Chi non tiene il lease non prende niente
+    assert db.claim_notifications(LEASE, 'b', [claim(1)], now=T0) is None
+
+    # a si ferma oltre la scadenza e b diventa leader: a non invia più
+    db.acquire_lease(LEASE, 'b', TTL, now=T0 + TTL + 1)
+    assert db.claim_notifications(LEASE, 'a', [claim(1)], now=T0 + TTL + 2) is None
+    assert db.claim_notifications(LEASE, 'b', [claim(1)], now=T0 + TTL + 2) == [claim(1)]
+    assert statuses(db) == {1: ('claimed', 'b', 1)}
+
+
+def test_failed_sends_are_retried_until_max_attempts(db):
+    db.acquire_lease(LEASE, 'a', 3600, now=T0)
+    db.claim_notifications(LEASE, 'a', [claim(1), claim(2), claim(3)], now=T0)
+    db.finish_notifications('a', [(claim(1), 'sent'), (claim(2), 'released'), (claim(3), 'failed')])
+    assert statuses(db) == {1: ('sent', 'a', 1), 2: ('released', 'a', 1), 3: ('failed', 'a', 1)}
+
+    # Solo quella rilasciata torna da inviare, una volta per ripresa
+    assert db.reclaim_notifications(LEASE, 'a', 3600, now=T0 + 60) == [claim(2)]
+    assert db.reclaim_notifications(LEASE, 'a', 3600, now=T0 + 61) == []
+    db.finish_notifications('a', [(claim(2), 'released')], max_attempts=3)
+    assert db.reclaim_notifications(LEASE, 'a', 3600, now=T0 + 120) == [claim(2)]
+    db.finish_notifications('a', [(claim(2), 'released')], max_attempts=3)
+    assert statuses(db)[2] == ('failed', 'a', 3)
+    assert db.reclaim_notifications(LEASE, 'a', 3600, now=T0 + 180) == []
+
+
+def test_takeover_resends_what_the_old_leader_left_claimed(db):
+    db.acquire_lease(LEASE, 'a', TTL, now=T0)
+    db.claim_notifications(LEASE, 'a', [claim(1), claim(2)], now=T0)
+    db.finish_notifications('a', [(claim(1), 'sent')])
+    # a cade mentre invia la 2: b prende il lease
+    db.acquire_lease(LEASE, 'b', TTL, now=T0 + TTL + 1)
+
+    # Senza takeover le notifiche 'claimed' restano di chi le sta inviando
+    assert db.reclaim_notifications(LEASE, 'b', 3600, now=T0 + TTL + 2) == []
+    assert db.reclaim_notifications(LEASE, 'b', 3600, takeover=True, now=T0 + TTL + 2) == [claim(2)]
+    assert statuses(db)[2] == ('claimed', 'b', 2)
+
+    # L'esito tardivo di a non tocca la riga ripresa da b
+    db.finish_notifications('a', [(claim(2), 'released')])
+    assert statuses(db)[2] == ('claimed', 'b', 2)
+    db.finish_notifications('b', [(claim(2), 'sent')])
+    assert statuses(db)[2] == ('sent', 'b', 2)
+
+
+def test_reclaim_needs_the_lease_and_skips_old_notifications(db):
+    db.acquire_lease(LEASE, 'a', TTL, now=T0)
+    db.claim_notifications(LEASE, 'a', [claim(1)], now=T0)
+    db.finish_notifications('a', [(claim(1), 'released')])
+
+    assert db.reclaim_notifications(LEASE, 'b', 3600, now=T0 + 1) is None
+    db.acquire_lease(LEASE, 'a', TTL, now=T0 + 3601)
+    assert db.reclaim_notifications(LEASE, 'a', 3600, now=T0 + 3601) == []
+
+
+# ========== MODIFICHE TRA WORKER ==========
+
+def test_schedule_changes_do_not_invalidate_reports(db):
+    db.add_user(1, 'anna')
+    db.add_group(-5, 'gruppo')
+    db.add_group_member(-5, 1)
+    seq = db.get_change_seq()
+    db.update_user_checkin_time(1, '21:30')
+    db.update_user_reminders(1, '18:00', '20:00')
+    for chat_id in (None, -5, -6):
+        db.report_cache.put(chat_id, '2026-03-02', 'report')
+
+    seq, changes = db.sync_changes(seq)
+    assert changes == [('user', 1), ('user', 1)]
+    assert db.report_cache.stats()['size'] == 3
+
+
+def test_goal_change_invalidates_only_reports_with_the_user(db):
+    db.add_user(1, 'anna')
+    db.add_user(2, 'bruno')
+    db.add_group(-5, 'gruppo di anna')
+    db.add_group_member(-5, 1)
+    db.add_group(-6, 'gruppo di bruno')
+    db.add_group_member(-6, 2)
+    seq = db.get_change_seq()
+    # Un altro worker cambia l'obiettivo di anna
+    with db.writer() as conn:
+        conn.execute('UPDATE users SET weekly_goal = 30 WHERE user_id = 1')
+    for chat_id in (None, -5, -6):
+        db.report_cache.put(chat_id, '2026-03-02', 'report')
+
+    db.sync_changes(seq)
+    assert db.report_cache.get(None, '2026-03-02') is None
+    assert db.report_cache.get(-5, '2026-03-02') is None
+    assert db.report_cache.get(-6, '2026-03-02') == 'report'
@@ -0,0 +1,110 @@
+"""Classifiche in memoria: stesse posizioni di un ORDER BY su weekly_user_stats dopo ogni check-in"""
+import pytest
+
+from database import SQL_ALL_USERS_LEADERBOARD, SQL_GROUP_LEADERBOARD
+from leaderboard import Leaderboard
+
+CHAT_ID = -100
+WEEK_START = '2026-03-09'
+
+# Stessa classifica calcolata da SQLite: RANK() dà la stessa posizione a pari valore
+SQL_RANKING = {
+    'ore': '''
+        SELECT RANK() OVER (ORDER BY total_hours DESC), user_id
+        FROM ({members})
+        ORDER BY total_hours DESC, study_days DESC, user_id
+    ''',
+    'obiettivo': '''
+        SELECT RANK() OVER (ORDER BY completion DESC), user_id
+        FROM (SELECT *, CASE WHEN weekly_goal THEN total_hours * 1.0 / weekly_goal ELSE 0 END AS completion
+              FROM ({members}))
+        ORDER BY completion DESC, total_hours DESC, user_id
+    ''',
+}
+
+
+def sql_ranking(db, chat_id, metric):
+    members = SQL_GROUP_LEADERBOARD if chat_id is not None else SQL_ALL_USERS_LEADERBOARD
+    params = (WEEK_START, chat_id) if chat_id is not None else (WEEK_START,)
+    with db.reader() as conn:
+        return [tuple(row) for row in conn.execute(SQL_RANKING[metric].format(members=members), params)]
+
+
+def index_ranking(db, chat_id, metric):
+    board = db.get_leaderboard(chat_id, WEEK_START, metric=metric, limit=100)
+    return [(rank, user_id) for rank, user_id, _ in board['top']]
+
+
+def assert_same_as_sql(db):
+    for chat_id in (CHAT_ID, None):
+        for metric in ('ore', 'obiettivo'):
+            expected = sql_ranking(db, chat_id, metric)
+            assert index_ranking(db, chat_id, metric) == expected, (chat_id, metric)
+            for rank, user_id in expected:
+                assert db.get_leaderboard(chat_id, WEEK_START, user_id, metric=metric)['rank'] == rank
+
+
+@pytest.fixture
+def group(db):
+    """Cinque membri del gruppo più un utente fuori dal gruppo, classifiche già in memoria"""
+    db.add_group(CHAT_ID, 'Studio')
+    for user_id in range(1, 7):
+        db.add_user(user_id, f'utente{user_id}')
+        if user_id <= 5:
+            db.add_group_member(CHAT_ID, user_id)
+    for user_id, hours in ((1, 5.0), (2, 3.0), (3, 3.0), (4, 1.0), (6, 8.0)):
+        db.add_daily_log(user_id, '2026-03-09', True, hours, 'low')
+        db.add_daily_log(user_id, '2026-03-10', True, hours, 'low')
+    db.update_user_goal(2, 12)
+
+    assert_same_as_sql(db)
+    assert len(db.leaderboards) == 2
+    return db
+
+
+def test_initial_ranking_with_ties(group):
+    # 2 e 3 a pari ore: stessa posizione, poi si salta la successiva
+    assert index_ranking(group, CHAT_ID, 'ore') == [(1, 1), (2, 2), (2, 3), (4, 4), (5, 5)]
+
+
+def test_lowered_hours_move_the_user_down(group):
+    boards = group.leaderboards.get(CHAT_ID, WEEK_START)
+    # Check-in corretto al ribasso (upsert dello stesso giorno)
+    group.add_daily_log(1, '2026-03-10', True, 1.0, 'low')
+    assert_same_as_sql(group)
+    assert index_ranking(group, CHAT_ID, 'ore')[:3] == [(1, 1), (1, 2), (1, 3)]
+
+    # Giorno cambiato in "non dovevo studiare": le sue ore escono dal totale
+    group.add_daily_log(1, '2026-03-09', False, 0.0, None)
+    assert_same_as_sql(group)
+
+    group.add_daily_log(5, '2026-03-11', True, 2.5, 'medium')
+    group.add_daily_log(3, '2026-03-10', True, 0.5, 'high')
+    assert_same_as_sql(group)
+    # Le classifiche sono state aggiornate, non ricostruite
+    assert group.leaderboards.get(CHAT_ID, WEEK_START) is boards
+
+
+def test_ties_break_on_study_days_then_user_id(group):
+    # Stesse ore, più giorni di studio: davanti ma con la stessa posizione
+    group.add_daily_log(4, '2026-03-09', True, 2.0, 'low')
+    group.add_daily_log(4, '2026-03-10', True, 2.0, 'low')
+    group.add_daily_log(4, '2026-03-11', True, 2.0, 'low')
+    assert_same_as_sql(group)
+    assert index_ranking(group, CHAT_ID, 'ore')[1:4] == [(2, 4), (2, 2), (2, 3)]
+
+
+def test_goal_change_reorders_completion(group):
+    group.update_user_goal(4, 2)
+    group.update_user_goal(1, 40)
+    assert_same_as_sql(group)
+    assert index_ranking(group, CHAT_ID, 'obiettivo')[0] == (1, 4)
+
+
+def test_positions_match_for_a_plain_board():
+    board = Leaderboard('ore')
+    for user_id, hours in ((1, 2.0), (2, 5.0), (3, 2.0), (4, 0.0)):
+        board.set(user_id, {'weekly_goal': 10, 'total_hours': hours, 'study_days': 1})
+    board.set(2, {'weekly_goal': 10, 'total_hours': 1.0, 'study_days': 1})
+    assert [(rank, user_id) for rank, user_id, _ in board.top(10)] == [(1, 1), (1, 3), (3, 2), (4, 4)]
+    assert board.rank(2) == 3 and board.rank(99) is None
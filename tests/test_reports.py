@@ -0,0 +1,124 @@
+"""Report strutturati: testo generato e riletto, conversione della migrazione 10, export delle righe"""
+import csv
+import gzip
+import sqlite3
+from datetime import date
+
+import migrations
+from export import export_table
+from reports import build_report, parse_report_text, render_report
+
+WEEK_START, WEEK_END = '2026-03-09', '2026-03-15'
+
+
+def stats(user_id, username, total_hours, weekly_goal=10, study_days=3, notes_count=0, avg_distraction=1.0):
+    return {
+        'user_id': user_id, 'username': username, 'weekly_goal': weekly_goal,
+        'total_hours': total_hours, 'study_days': study_days, 'total_study_days': 5,
+        'avg_distraction': avg_distraction, 'notes_count': notes_count,
+        'goal_reached': total_hours >= weekly_goal,
+    }
+
+
+def sample_report():
+    return build_report([
+        stats(1, 'anna', 12.5, notes_count=2),
+        stats(2, 'bruno', 4.0, avg_distraction=3.0),
+        stats(3, 'carla', 0.0, study_days=0),
+    ], WEEK_START, WEEK_END)
+
+
+def read_csv(path):
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+# ========== TESTO ==========
+
+def test_parse_render_round_trip():
+    report = sample_report()
+    text = render_report(report)
+    parsed = parse_report_text(text, WEEK_START, WEEK_END)
+
+    assert render_report(parsed) == text
+    assert [row['username'] for row in parsed['rows']] == ['anna', 'bruno']
+    assert (parsed['total_users'], parsed['active_users'], parsed['goals_reached']) == (3, 2, 1)
+    assert parsed['total_hours'] == report['total_hours']
+    assert parsed['rows'][0]['notes_count'] == 2
+    assert parsed['rows'][1]['avg_distraction'] == 3.0
+
+
+def test_parse_rejects_other_text():
+    text = render_report(sample_report())
+    assert parse_report_text("Report libero scritto a mano", WEEK_START, WEEK_END) is None
+    assert parse_report_text(text.replace("• Giorni di studio", "• Giorni"), WEEK_START, WEEK_END) is None
+
+
+# ========== MIGRAZIONE 10 ==========
+
+def test_migration_10_converts_text_reports(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / 'vecchio.db'), isolation_level=None)
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [m for m in migrations.MIGRATIONS if m[0] <= 9])
+    migrations.migrate(conn)
+    monkeypatch.undo()
+    assert migrations.get_schema_version(conn) == 9
+
+    conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                     [(1, 'anna'), (2, 'bruno'), (3, 'carla')])
+    text = render_report(sample_report())
+    conn.execute('INSERT INTO weekly_reports (week_start, week_end, report_text) VALUES (?, ?, ?)',
+                 (WEEK_START, WEEK_END, text))
+    conn.execute('INSERT INTO weekly_reports (week_start, week_end, report_text) VALUES (?, ?, ?)',
+                 ('2026-03-02', '2026-03-08', "Report libero scritto a mano"))
+
+    migrations.migrate(conn)
+
+    converted = conn.execute('''
+        SELECT id, report_text, total_users, active_users, total_hours, goals_reached
+        FROM weekly_reports WHERE week_start = ?
+    ''', (WEEK_START,)).fetchone()
+    assert converted[1:] == (None, 3, 2, 16.5, 1)
+    rows = conn.execute('''
+        SELECT user_id, username, total_hours, notes_count, goal_reached
+        FROM weekly_report_rows WHERE report_id = ? ORDER BY user_id
+    ''', (converted[0],)).fetchall()
+    assert rows == [(1, 'anna', 12.5, 2, 1), (2, 'bruno', 4.0, 0, 0)]
+
+    # Il testo non riconosciuto resta com'era
+    assert conn.execute('SELECT report_text FROM weekly_reports WHERE week_start = ?',
+                        ('2026-03-02',)).fetchone()[0] == "Report libero scritto a mano"
+    conn.close()
+
+
+def test_converted_report_renders_the_original_text(db):
+    for user_id, username in ((1, 'anna'), (2, 'bruno'), (3, 'carla')):
+        db.add_user(user_id, username)
+    text = render_report(sample_report())
+    with db.writer() as conn:
+        conn.execute('INSERT INTO weekly_reports (week_start, week_end, report_text) VALUES (?, ?, ?)',
+                     (WEEK_START, WEEK_END, text))
+        migrations.convert_report_texts(conn)
+
+    saved = db.get_weekly_report(None, WEEK_START)
+    assert saved['report_text'] is None
+    assert render_report(saved) == text
+
+
+# ========== EXPORT ==========
+
+def test_export_report_rows(db, tmp_path):
+    db.save_weekly_report(sample_report(), chat_id=-100)
+    db.save_weekly_report(build_report([stats(1, 'anna', 3.0)], '2026-03-16', '2026-03-22'), chat_id=-100)
+    db.close()
+
+    result = export_table(db.db_path, 'weekly_report_rows', str(tmp_path / 'righe.csv.gz'))
+    rows = read_csv(result['path'])
+    assert result['rows'] == 3
+    assert [(row['week_start'], row['username'], row['total_hours']) for row in rows] == [
+        (WEEK_START, 'anna', '12.5'), (WEEK_START, 'bruno', '4.0'), ('2026-03-16', 'anna', '3.0'),
+    ]
+    assert {row['chat_id'] for row in rows} == {'-100'}
+
+    result = export_table(db.db_path, 'weekly_report_rows', str(tmp_path / 'anna.csv.gz'),
+                          start=date(2026, 3, 16), user_id=1)
+    assert [(row['week_start'], row['user_id']) for row in read_csv(result['path'])] == [('2026-03-16', '1')]
@@ -0,0 +1,61 @@
+"""Snapshot full + delta e restore: il database ricostruito è uguale a quello vivo"""
+import sqlite3
+
+import pytest
+
+from snapshots import SnapshotManager
+
+
+def table_rows(path):
+    """Righe di tutte le tabelle (ordinate: alcune sono WITHOUT ROWID)"""
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        )]
+        return {table: sorted(conn.execute(f'SELECT * FROM "{table}"').fetchall(), key=repr)
+                for table in tables}
+    finally:
+        conn.close()
+
+
+def add_logs(db, user_id, days, hours=2.0):
+    for day in days:
+        assert db.add_daily_log(user_id, day, True, hours, 'low', f'nota {day}')
+
+
+@pytest.fixture
+def manager(db, tmp_path):
+    return SnapshotManager(db.db_path, str(tmp_path / 'snapshot'))
+
+
+def test_delta_restore_matches_live_database(db, manager, tmp_path):
+    db.add_user(1, 'anna')
+    add_logs(db, 1, [f'2026-03-{day:02d}' for day in range(1, 29)])
+    full = manager.snapshot()
+    assert full['type'] == 'full'
+    at_full = table_rows(db.db_path)
+
+    db.add_user(2, 'bruno')
+    add_logs(db, 2, ['2026-03-02', '2026-03-03'], hours=4.0)
+    add_logs(db, 1, ['2026-03-05'], hours=6.0)   # upsert di una riga esistente
+    db.update_user_goal(1, 30)
+    delta = manager.snapshot()
+    assert delta['type'] == 'delta'
+    assert 0 < delta['pages'] < full['pages']
+
+    # Nessuna modifica: nessuno snapshot
+    assert manager.snapshot() is None
+
+    restored = manager.restore(str(tmp_path / 'ripristino.db'))
+    assert table_rows(restored) == table_rows(db.db_path)
+
+    # Fino al full: lo stato di prima delle ultime scritture
+    restored = manager.restore(str(tmp_path / 'al_full.db'), upto=full['file'])
+    assert table_rows(restored) == at_full
+
+
+def test_restore_without_snapshots_fails(manager, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        manager.restore(str(tmp_path / 'ripristino.db'))
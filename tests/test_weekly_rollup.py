@@ -0,0 +1,83 @@
+"""weekly_user_stats aggiornato per differenza da add_daily_log"""
+
+WEEK = '2026-03-02'
+
+
+def rollup(db, user_id, week_start=WEEK):
+    with db.reader() as conn:
+        row = conn.execute(
+            'SELECT * FROM weekly_user_stats WHERE user_id = ? AND week_start = ?', (user_id, week_start)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def test_new_logs_add_to_the_week(db):
+    db.add_user(1, 'anna')
+    db.add_daily_log(1, '2026-03-02', True, 2.0, 'low', 'capitolo 1')
+    db.add_daily_log(1, '2026-03-04', True, 1.5, 'high')
+
+    stats = rollup(db, 1)
+    assert stats['total_hours'] == 3.5
+    assert stats['study_days'] == 2
+    assert stats['total_study_days'] == 2
+    assert stats['distraction_sum'] == 4
+    assert stats['notes_count'] == 1
+    assert db.rebuild_weekly_rollup() == []
+
+
+def test_upsert_applies_only_the_difference(db):
+    db.add_user(1, 'anna')
+    db.add_daily_log(1, '2026-03-02', True, 2.0, 'low', 'capitolo 1')
+    db.add_daily_log(1, '2026-03-03', True, 1.0, 'medium')
+    # Stesso giorno corretto due volte: conta solo l'ultima versione
+    db.add_daily_log(1, '2026-03-02', True, 3.0, 'high', '')
+    db.add_daily_log(1, '2026-03-02', True, 2.5, 'medium', 'ripasso')
+
+    stats = rollup(db, 1)
+    assert stats['total_hours'] == 3.5
+    assert stats['study_days'] == 2
+    assert stats['total_study_days'] == 2
+    assert stats['distraction_sum'] == 4
+    assert stats['notes_count'] == 1
+    assert db.rebuild_weekly_rollup() == []
+
+
+def test_free_day_and_zero_hours_remove_the_contribution(db):
+    db.add_user(1, 'anna')
+    db.add_daily_log(1, '2026-03-02', True, 2.0, 'low')
+    db.add_daily_log(1, '2026-03-03', True, 1.0, 'high')
+    db.add_daily_log(1, '2026-03-02', False, 0, 'low', 'Giorno libero')
+    db.add_daily_log(1, '2026-03-03', True, 0.0, 'high')
+
+    stats = rollup(db, 1)
+    assert stats['total_hours'] == 0
+    assert stats['study_days'] == 0
+    assert stats['total_study_days'] == 1
+    assert stats['distraction_sum'] == 0
+    assert stats['notes_count'] == 1
+    assert db.rebuild_weekly_rollup() == []
+
+
+def test_weeks_and_users_are_kept_apart(db):
+    db.add_user(1, 'anna')
+    db.add_user(2, 'bruno')
+    db.add_daily_log(1, '2026-03-08', True, 2.0, 'low')   # domenica
+    db.add_daily_log(1, '2026-03-09', True, 4.0, 'low')   # lunedì dopo
+    db.add_daily_log(2, '2026-03-08', True, 1.0, 'low')
+
+    assert rollup(db, 1)['total_hours'] == 2.0
+    assert rollup(db, 1, '2026-03-09')['total_hours'] == 4.0
+    assert rollup(db, 2)['total_hours'] == 1.0
+    assert db.get_user_weekly_stats(1, WEEK, '2026-03-08')['total_hours'] == 2.0
+
+
+def test_rebuild_repairs_a_drifted_rollup(db):
+    db.add_user(1, 'anna')
+    db.add_daily_log(1, '2026-03-02', True, 2.0, 'low')
+    with db.writer() as conn:
+        conn.execute('UPDATE weekly_user_stats SET total_hours = 99 WHERE user_id = 1')
+
+    differences = db.rebuild_weekly_rollup()
+    assert len(differences) == 1
+    assert rollup(db, 1)['total_hours'] == 2.0
+    assert db.rebuild_weekly_rollup() == []
@@ -0,0 +1,137 @@
+"""Write-behind: group commit delle scritture brevi e barrier() per rileggerle"""
+import asyncio
+import threading
+
+import pytest
+
+from async_database import AsyncDatabase
+from database import Database
+
+
+@pytest.fixture
+def adb(db):
+    # Attesa lunga: tutte le scritture di un test finiscono nello stesso batch
+    async_db = AsyncDatabase(db, write_delay=0.05, write_batch=100)
+    yield async_db
+    async_db.shutdown()
+
+
+def test_queued_writes_share_one_commit(db, adb):
+    db.add_user(1, 'anna')
+
+    async def scenario():
+        for day in range(2, 9):
+            assert await adb.add_daily_log(1, f'2026-03-0{day}', True, 1.0, 'low')
+        await adb.update_user_goal(1, 12)
+        # Accodate, non ancora scritte
+        assert adb.write_queue.pending() == 8
+        assert db.get_daily_log(1, '2026-03-02') is None
+
+        await adb.barrier()
+        assert adb.write_queue.pending() == 0
+
+    asyncio.run(scenario())
+    assert adb.write_queue.batches == 1
+    assert adb.write_queue.writes == 8
+    assert db.get_user_weekly_stats(1, '2026-03-02', '2026-03-08')['total_hours'] == 7.0
+
+
+def test_barrier_gives_read_your_write(db, adb):
+    db.add_user(1, 'anna')
+
+    async def scenario():
+        await adb.update_user_goal(1, 25)
+        await adb.add_daily_log(1, '2026-03-02', True, 3.0, 'medium', 'note')
+        await adb.barrier()
+        user = await adb.get_user(1)
+        log = await adb.get_daily_log(1, '2026-03-02')
+        return user, log
+
+    user, log = asyncio.run(scenario())
+    assert user['weekly_goal'] == 25
+    assert log['hours_studied'] == 3.0
+    assert log['notes'] == 'note'
+
+
+def test_full_queue_is_sent_without_waiting(db):
+    db.add_user(1, 'anna')
+    adb = AsyncDatabase(db, write_delay=10, write_batch=3)
+
+    async def scenario():
+        for day in range(2, 9):
+            await adb.add_daily_log(1, f'2026-03-0{day}', True, 1.0, 'low')
+        # Due batch pieni già inviati, uno in attesa
+        assert adb.write_queue.batches == 2
+        assert adb.write_queue.pending() == 1
+        await adb.write_queue.flush()
+
+    asyncio.run(scenario())
+    adb.shutdown()
+    assert db.get_user_weekly_stats(1, '2026-03-02', '2026-03-08')['study_days'] == 7
+
+
+def test_direct_write_runs_after_queued_ones(db, adb):
+    db.add_user(1, 'anna')
+
+    async def scenario():
+        await adb.add_daily_log(1, '2026-03-02', True, 2.0, 'low')
+        # Una scrittura non accodata manda prima la coda al thread di scrittura
+        return await adb.run(db.get_daily_log, 1, '2026-03-02', write=True)
+
+    assert asyncio.run(scenario())['hours_studied'] == 2.0
+
+
+def test_failed_call_does_not_roll_back_the_batch(db):
+    db.add_user(1, 'anna')
+    results = db.run_batch([
+        ('add_daily_log', (1, '2026-03-02', True, 1.0, 'low'), {}),
+        ('no_such_method', (), {}),
+        ('update_user_goal', (1, 30), {}),
+    ])
+    assert results[0] is True
+    assert isinstance(results[1], AttributeError)
+    assert results[2] is True
+    assert db.get_daily_log(1, '2026-03-02') is not None
+    assert db.load_user(1)['weekly_goal'] == 30
+
+
+def test_other_thread_callbacks_skip_the_open_batch(db):
+    """Il commit di un altro thread aggiorna le cache subito, anche se il batch poi fallisce"""
+    ran = []
+
+    def other_thread():
+        # Come una scrittura appena committata fuori dal batch
+        db._after_commit(lambda: ran.append(threading.current_thread().name))
+
+    with pytest.raises(RuntimeError):
+        with db.batch():
+            thread = threading.Thread(target=other_thread, name='altro')
+            thread.start()
+            thread.join()
+            assert ran == ['altro']
+            raise RuntimeError("batch annullato")
+    assert ran == ['altro']
+
+    # Nel thread del batch le callback aspettano il commit
+    with db.batch():
+        db._after_commit(lambda: ran.append('batch'))
+        assert ran == ['altro']
+    assert ran == ['altro', 'batch']
+
+def test_shutdown_writes_what_is_still_queued(tmp_path):
+    path = str(tmp_path / 'study_bot.db')
+    db = Database(path)
+    db.add_user(1, 'anna')
+    adb = AsyncDatabase(db, write_delay=10)
+
+    async def scenario():
+        await adb.add_daily_log(1, '2026-03-02', True, 2.0, 'low')
+
+    asyncio.run(scenario())
+    adb.shutdown()
+
+    reopened = Database(path)
+    try:
+        assert reopened.get_daily_log(1, '2026-03-02')['hours_studied'] == 2.0
+    finally:
+        reopened.close()
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class UserCache:
+    """
+    Cache LRU con scadenza (TTL) delle righe della tabella users.
+
+    Thread-safe: viene usata sia dall'event loop sia dai thread del database.
+    Restituisce sempre copie, così chi modifica il dict non sporca la cache.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # user_id -> (scadenza, riga)
+        self._lock = threading.Lock()
+        # Incrementato ad ogni scrittura: evita che una lettura partita prima
+        # di un update rimetta in cache la riga vecchia
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Riga dell'utente se in cache e non scaduta, altrimenti None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def load_token(self) -> int:
+        """Da prendere prima di leggere dal database la riga da mettere in cache"""
+        with self._lock:
+            return self._writes
+
+    def put(self, user_id: int, row: Dict, token: Optional[int] = None):
+        with self._lock:
+            if token is not None and token != self._writes:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, dict(row))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, user_id: int, **fields):
+        """Write-through: aggiorna i campi dell'utente se è già in cache"""
+        with self._lock:
+            self._writes += 1
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[1].update(fields)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._writes += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
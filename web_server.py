@@ -0,0 +1,179 @@
+"""
+Server HTTP asyncio minimale (nessuna dipendenza esterna).
+
+Gira nello stesso event loop del bot e serve:
+- GET /  e  GET /health  -> health check di Render
+- POST <WEBHOOK_PATH>    -> update di Telegram (solo in modalità webhook)
+"""
+import asyncio
+import hmac
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Telegram invia update di pochi KB: oltre questo la richiesta viene rifiutata
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 10
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+# (status, content-type, corpo, header extra)
+Response = Tuple[int, str, bytes, Dict[str, str]]
+RouteHandler = Callable[[str, Dict[str, str], bytes], Awaitable[Response]]
+
+
+def text_response(status: int, text: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return status, 'text/plain; charset=utf-8', text.encode('utf-8'), headers or {}
+
+
+class WebServer:
+    """
+    Server HTTP per health check e webhook Telegram.
+
+    Gli update validi vengono messi direttamente in application.update_queue.
+    Se la coda supera max_pending risponde 503: Telegram ritenta più tardi,
+    così sotto carico il bot rallenta invece di accumulare memoria.
+    """
+
+    def __init__(self, application: Application, host: str = '0.0.0.0', port: int = 10000,
+                 webhook_path: Optional[str] = None, secret_token: str = '',
+                 max_pending: int = 1000):
+        self.application = application
+        self.host = host
+        self.port = port
+        if webhook_path and not secret_token:
+            raise ValueError("Il webhook richiede un secret token")
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        self.routes: Dict[Tuple[str, str], RouteHandler] = {
+            ('GET', '/'): self.handle_health,
+            ('GET', '/health'): self.handle_health,
+        }
+        if webhook_path:
+            self.routes[('POST', webhook_path)] = self.handle_webhook
+
+        self.updates_received = 0
+        self.updates_rejected = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server running on port {self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def add_route(self, method: str, path: str, handler: RouteHandler):
+        self.routes[(method, path)] = handler
+
+    # ========== ROUTE ==========
+
+    async def handle_health(self, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        return text_response(200, 'Bot is running!')
+
+    async def handle_webhook(self, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        received = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(received.encode('utf-8'), self.secret_token.encode('utf-8')):
+            self.updates_rejected += 1
+            return text_response(403, 'Invalid secret token')
+
+        queue = self.application.update_queue
+        if queue.qsize() >= self.max_pending:
+            self.updates_rejected += 1
+            return text_response(503, 'Too many pending updates', {'Retry-After': '1'})
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            self.updates_rejected += 1
+            return text_response(400, f'Invalid update: {e}')
+
+        self.updates_received += 1
+        await queue.put(update)
+        return text_response(200, 'OK')
+
+    # ========== HTTP ==========
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Connessioni keep-alive: più richieste sulla stessa connessione finché
+        # il client non chiude o resta inattivo per più di READ_TIMEOUT
+        try:
+            while True:
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self._handle_request(reader), READ_TIMEOUT
+                    )
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except Exception as e:
+                    logger.error(f"Errore richiesta HTTP: {e}")
+                    response, keep_alive = text_response(400, 'Bad request'), False
+
+                status, content_type, body, extra_headers = response
+                head = [
+                    f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}',
+                    f'Content-Type: {content_type}',
+                    f'Content-Length: {len(body)}',
+                    f'Connection: {"keep-alive" if keep_alive else "close"}',
+                ]
+                head += [f'{name}: {value}' for name, value in extra_headers.items()]
+                try:
+                    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+                    await writer.drain()
+                except ConnectionError:
+                    return
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader) -> Tuple[Response, bool]:
+        """Legge una richiesta e la smista; restituisce (risposta, keep-alive)"""
+        request_line = await reader.readline()
+        if not request_line:
+            # Il client ha chiuso la connessione tra una richiesta e l'altra
+            raise asyncio.IncompleteReadError(b'', None)
+        method, target, version = request_line.decode('latin-1').strip().split(' ', 2)
+        path = target.split('?', 1)[0]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY_SIZE:
+            # Il corpo non viene letto: la connessione non è più riutilizzabile
+            return text_response(413, 'Payload too large'), False
+        body = await reader.readexactly(length) if length else b''
+
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                return text_response(405, 'Method not allowed'), keep_alive
+            return text_response(404, 'Not found'), keep_alive
+        return await handler(path, headers, body), keep_alive
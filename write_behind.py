@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import DB_WRITE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Coda delle scritture brevi (check-in, impostazioni) con group commit.
+
+    Le scritture non aspettano il database: vengono accodate e scritte in
+    un'unica transazione ogni max_delay secondi o appena la coda arriva a
+    max_batch operazioni. Un solo commit per tutto il blocco invece di uno
+    per bottone premuto.
+
+    - barrier(): attende che tutto ciò che è stato accodato finora sia
+      scritto (da chiamare prima di rileggere un dato appena scritto)
+    - drain(): allo spegnimento restituisce le operazioni ancora in coda,
+      che AsyncDatabase.shutdown scrive prima di chiudere le connessioni
+
+    Va usata dall'event loop. Le operazioni sono (nome del metodo di
+    Database, args, kwargs), eseguite da Database.run_batch.
+    """
+
+    def __init__(self, submit_batch: Callable[[List[Tuple[str, tuple, Dict]]], Awaitable[List]],
+                 max_delay: float = 0.005, max_batch: int = 100):
+        # submit_batch invia subito il batch al thread di scrittura e restituisce
+        # un awaitable: i batch (e le altre scritture) restano nell'ordine di invio
+        self._submit_batch = submit_batch
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, tuple, Dict]] = []
+        self._futures: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Ultimo batch inviato al thread di scrittura
+        self._last_batch: Optional[asyncio.Task] = None
+        # barrier() in attesa del prossimo invio
+        self._flush_waiters: List[asyncio.Future] = []
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, name: str, args: tuple, kwargs: Dict) -> asyncio.Future:
+        """Accoda la scrittura; il future si completa col risultato dopo il commit"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((name, args, kwargs))
+        self._futures.append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self.flush)
+        return future
+
+    def flush(self) -> Optional[asyncio.Task]:
+        """Invia subito le scritture in coda al thread di scrittura (senza attenderle)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return self._last_batch
+
+        calls, futures = self._pending, self._futures
+        self._pending, self._futures = [], []
+        self.batches += 1
+        self.writes += len(calls)
+        DB_WRITE_BATCH_SIZE.observe(len(calls))
+        self._last_batch = asyncio.ensure_future(self._complete(self._submit_batch(calls), futures))
+
+        waiters, self._flush_waiters = self._flush_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        return self._last_batch
+
+    async def _complete(self, batch: Awaitable[List], futures: List[asyncio.Future]):
+        try:
+            results = await batch
+        except Exception as e:
+            logger.error(f"Errore scrittura di {len(futures)} operazioni in coda: {e}")
+            results = [e] * len(futures)
+
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+                # Nessuno è obbligato ad attendere il future: evita il warning
+                future.exception()
+            else:
+                future.set_result(result)
+
+    async def barrier(self):
+        """
+        Attende che tutte le scritture accodate finora siano sul database.
+        Non anticipa l'invio: aspetta il prossimo batch (al massimo max_delay),
+        così più utenti che confermano insieme condividono lo stesso commit.
+        """
+        if self._pending:
+            waiter = asyncio.get_running_loop().create_future()
+            self._flush_waiters.append(waiter)
+            await waiter
+        if self._last_batch is not None:
+            await asyncio.shield(self._last_batch)
+
+    def drain(self) -> List[Tuple[str, tuple, Dict]]:
+        """Toglie dalla coda le scritture non ancora inviate (spegnimento senza event loop)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        calls = self._pending
+        for future in self._futures:
+            future.cancel()
+        self._pending, self._futures = [], []
+        return calls
+
+    def pending(self) -> int:
+        return len(self._pending)